@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class BudgetmapperConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "budgetmapper"
+
+    def ready(self):
+        # registers the receivers that queue the jobs
+        from . import jobs  # noqa: F401
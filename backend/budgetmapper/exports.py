@@ -0,0 +1,208 @@
+import json
+import tempfile
+from io import BytesIO
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+from django.db import connection
+from django.db import models as db_models
+
+from . import models
+
+# the title of the only sheet of the budget xlsx template (fixtures/budget_xlsx_template.json)
+XLSX_TEMPLATE_SHEET_TITLE = "x"
+
+TABLE_FORMATS = {
+    "parquet": {"content_type": "application/vnd.apache.parquet", "extension": "parquet"},
+    "arrow": {"content_type": "application/vnd.apache.arrow.file", "extension": "arrow"},
+}
+
+
+# the classifications of a system with the codes, names and item orders of their paths from the root
+_TREE_SQL = """
+WITH RECURSIVE tree (id, codes, names, sort_key) AS (
+    SELECT id, ARRAY[code]::text[], ARRAY[name], ARRAY[item_order]
+    FROM budgetmapper_classification
+    WHERE classification_system_id = %s AND parent_id IS NULL
+UNION ALL
+    SELECT c.id, array_append(tree.codes, c.code::text), array_append(tree.names, c.name),
+        array_append(tree.sort_key, c.item_order)
+    FROM budgetmapper_classification c JOIN tree ON c.parent_id = tree.id
+)
+"""
+
+
+def _get_depth(cs: models.ClassificationSystem) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(f"{_TREE_SQL} SELECT max(cardinality(sort_key)) FROM tree", [cs.id])
+        return cursor.fetchone()[0] or 0
+
+
+def _iterate_leaves(budget: models.BudgetBase, chunk_size: int = 1000):
+    """Yields the id, the codes and the names of the path of each leaf classification of ``budget`` in preorder,
+    along with its item value (None for mapped budgets and for leaves without an item), from a server-side cursor."""
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(
+            f"""{_TREE_SQL}
+            SELECT tree.id, tree.codes, tree.names, a.value
+            FROM tree
+            LEFT JOIN budgetmapper_budgetitembase i ON i.classification_id = tree.id AND i.budget_id = %s
+            LEFT JOIN budgetmapper_atomicbudgetitem a ON a.budgetitembase_ptr_id = i.id
+            WHERE NOT EXISTS (SELECT 1 FROM budgetmapper_classification c WHERE c.parent_id = tree.id)
+            ORDER BY tree.sort_key
+            """,
+            [budget.classification_system_id, budget.id],
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if len(rows) == 0:
+                break
+            yield from rows
+
+
+def iterate_rows(budget: models.BudgetBase, blank=""):
+    """Yields the header and then one row per leaf classification in the layout of the budget xlsx template: the code
+    and name of each level, padded with ``blank`` below shallow leaves, and the amount.
+
+    The depth of the tree is found with one aggregate query before the header, and the leaves are then read in
+    preorder from a server-side cursor, so the rows of a basic budget are never held in memory at once. The amounts of
+    a mapped budget are derived from the whole source budget and are still loaded before the first row.
+
+    The same list is yielded for every leaf, so consume each row before asking for the next one.
+    """
+    cs = budget.classification_system
+    max_level = _get_depth(cs)
+    level_names = list(cs.level_names or [])
+    level_names += [f"level_{i}" for i in range(len(level_names), max_level)]
+    header = []
+    for ln in level_names:
+        header += [ln, f"{ln}名称"]
+    yield header + ["金額"]
+    amounts = None if isinstance(budget, models.BasicBudget) else budget.get_item_amounts()
+    row = [blank] * (2 * max_level + 1)
+    for classification_id, codes, names, value in _iterate_leaves(budget):
+        for i, (code, name) in enumerate(zip(codes, names)):
+            row[2 * i] = code
+            row[2 * i + 1] = name
+        for i in range(2 * len(codes), 2 * max_level):
+            row[i] = blank
+        if amounts is not None:
+            row[-1] = amounts.get(classification_id, 0)
+        else:
+            row[-1] = 0 if value is None else float(value)
+        yield row
+
+
+def write_xlsx(budget: models.BudgetBase):
+    """Writes ``budget`` in the layout of the budget xlsx template to a temporary file and returns it, rewound.
+
+    The write-only workbook flushes every row to disk as it is appended, so memory does not grow with the budget.
+    The file is spooled rather than streamed, though: an xlsx is a zip archive whose directory is written last, so
+    no byte can be sent before the whole workbook is written.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(XLSX_TEMPLATE_SHEET_TITLE)
+    rows = iterate_rows(budget, blank=None)
+    header = next(rows)
+    for i in range(len(header)):
+        # narrow code columns and wide name columns, as in the template
+        ws.column_dimensions[get_column_letter(i + 1)].width = 8 if i % 2 == 0 else 32
+    ws.column_dimensions[get_column_letter(len(header))].width = 16
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    fp = tempfile.TemporaryFile()
+    wb.save(fp)
+    fp.seek(0)
+    return fp
+
+
+def get_budget_version(budget: models.BudgetBase):
+    """The last update of ``budget`` or of the budgets mapped from it, whose mappings are part of the export."""
+    return models.BudgetBase.objects.filter(
+        db_models.Q(pk=budget.pk) | db_models.Q(mappedbudget__source_budget=budget)
+    ).aggregate(db_models.Max("updated_at"))["updated_at__max"]
+
+
+def _get_mappings(budget: models.BudgetBase) -> dict:
+    """Maps the slug of the classification system of each budget mapped from ``budget`` to a dict from the source
+    classification id to the (code, name) of the mapped classification."""
+    mappings = {}
+    rows = (
+        models.MappedBudgetItem.source_classifications.through.objects.filter(
+            mappedbudgetitem__budget__mappedbudget__source_budget=budget
+        )
+        .order_by("mappedbudgetitem__budget__created_at", "mappedbudgetitem__classification__item_order")
+        .values_list(
+            "mappedbudgetitem__budget__classification_system__slug",
+            "classification_id",
+            "mappedbudgetitem__classification__code",
+            "mappedbudgetitem__classification__name",
+        )
+    )
+    for slug, source_id, code, name in rows:
+        mappings.setdefault(slug, {}).setdefault(source_id, (code, name))
+    return mappings
+
+
+def _strings(values: list) -> pa.Array:
+    return pa.array(values, pa.string()).dictionary_encode()
+
+
+def budget_table(budget: models.BudgetBase) -> pa.Table:
+    """Builds one row per leaf classification of ``budget`` with the codes and names of its levels, its amount and,
+    for each budget mapped from ``budget`` (e.g. COFOG), the mapped classification of its nearest mapped ancestor.
+
+    The classifications, the amounts and the mappings are fetched with one query each and the columns are built as
+    Arrow arrays, with the repetitive strings dictionary-encoded.
+    """
+    cs = budget.classification_system
+    children = cs.get_children_map()
+    amounts = budget.get_item_amounts()
+    mappings = _get_mappings(budget)
+    paths = list(cs.iterate_classifications(children))
+    max_level = max((len(p) for p in paths), default=0)
+    level_names = list(cs.level_names or [])
+    level_names += [f"level_{i}" for i in range(len(level_names), max_level)]
+
+    columns = {"classification_id": pa.array([p[-1].id for p in paths], pa.string())}
+    for i in range(max_level):
+        columns[f"level_{i}_code"] = _strings([p[i].code if i < len(p) else None for p in paths])
+        columns[f"level_{i}_name"] = _strings([p[i].name if i < len(p) else None for p in paths])
+    columns["amount"] = pa.array([float(amounts.get(p[-1].id, 0)) for p in paths], pa.float64())
+    for slug, mapping in mappings.items():
+        mapped = [next((mapping[c.id] for c in reversed(p) if c.id in mapping), (None, None)) for p in paths]
+        columns[f"{slug}_code"] = _strings([m[0] for m in mapped])
+        columns[f"{slug}_name"] = _strings([m[1] for m in mapped])
+    # constant columns, so that the exports of several budgets can be concatenated
+    columns["budget"] = _strings([budget.slug] * len(paths))
+    columns["government"] = _strings([budget.government_value.slug] * len(paths))
+    columns["year"] = pa.array([budget.year_value] * len(paths), pa.int32())
+
+    table = pa.table(columns)
+    metadata = {"level_names": level_names[:max_level], "budget_id": budget.id, "budget_name": budget.name}
+    return table.replace_schema_metadata({"openspending": json.dumps(metadata, ensure_ascii=False)})
+
+
+def write_table(table: pa.Table, format: str) -> BytesIO:
+    buf = BytesIO()
+    if format == "parquet":
+        pq.write_table(table, buf, compression="zstd")
+    elif format == "arrow":
+        with pa.ipc.new_file(buf, table.schema, options=pa.ipc.IpcWriteOptions(compression="zstd")) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f"unknown format {format}")
+    buf.seek(0)
+    return buf
+
+
+def get_table_export(budget: models.BudgetBase, format: str) -> models.Blob:
+    """Returns the blob of the ``format`` export of ``budget``, writing it if it is older than the budget."""
+    version = get_budget_version(budget)
+    cache = models.ExportCache.get_or_none(budget, format, version)
+    if cache is None:
+        cache = models.ExportCache.cache_export(write_table(budget_table(budget), format), budget, format, version)
+    return cache.blob
@@ -0,0 +1,56 @@
+from django.db import models
+from polymorphic.models import PolymorphicModel
+
+
+def root_model(model):
+    parents = model._meta.concrete_model._meta.get_parent_list()
+    return parents[-1] if len(parents) > 0 else model._meta.concrete_model
+
+
+class IdentityMap(object):
+    """Objects loaded while handling one request, so that each of them is fetched at most once.
+
+    Objects are keyed by the root model of their inheritance chain and their primary key, so that a budget loaded as
+    a ``BudgetBase`` is found again through a ``MappedBudget.source_budget`` foreign key.
+    """
+
+    def __init__(self):
+        self._objects = {}
+
+    def add(self, obj: models.Model) -> models.Model:
+        self._objects[(root_model(type(obj)), obj.pk)] = obj
+        return obj
+
+    def get(self, model, pk, queryset=None, real_instance: bool = True) -> models.Model:
+        """Returns the object, loading it from ``queryset`` (the default manager by default) on the first call.
+
+        Polymorphic objects are upgraded to their concrete class unless ``real_instance`` is False.
+        """
+        obj = self._objects.get((root_model(model), pk))
+        if obj is None:
+            obj = self.add((queryset if queryset is not None else model._default_manager.all()).get(pk=pk))
+        if real_instance and isinstance(obj, PolymorphicModel) and type(obj) is not obj.get_real_instance_class():
+            obj = self.add(obj.get_real_instance())
+        return obj
+
+    def prime(self, obj: models.Model, *field_names: str) -> models.Model:
+        """Fills the caches of the foreign keys ``field_names`` of ``obj`` from the map."""
+        self.add(obj)
+        for name in field_names:
+            field = obj._meta.get_field(name)
+            if field.is_cached(obj):
+                self.add(field.get_cached_value(obj))
+                continue
+            pk = getattr(obj, field.attname)
+            if pk is not None:
+                field.set_cached_value(obj, self.get(field.related_model, pk))
+        return obj
+
+
+def identity_map(request) -> IdentityMap:
+    """Returns the identity map of ``request``, creating it on first use."""
+    if request is None:
+        return IdentityMap()
+    if getattr(request, "_identity_map", None) is None:
+        request._identity_map = IdentityMap()
+    return request._identity_map
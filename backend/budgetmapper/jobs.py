@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, TextIOWrapper
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import loaders, models, rollups, serializers
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(kind: str):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+
+    return register
+
+
+def enqueue(kind: str, payload: dict) -> models.Job:
+    if kind not in HANDLERS:
+        raise ValueError(f"unknown job kind: {kind}")
+    return models.Job.objects.create(kind=kind, payload=payload)
+
+
+def claim_next_job():
+    """Marks the oldest queued job as running and returns it.
+
+    A job still running without any update for ``JOB_STALE_TIMEOUT`` seconds was left behind by a worker that died,
+    and is claimed again.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.JOB_STALE_TIMEOUT)
+    with transaction.atomic():
+        job = (
+            models.Job.objects.select_for_update(skip_locked=True)
+            .filter(Q(status="queued") | Q(status="running", updated_at__lt=stale))
+            .order_by("created_at")
+            .first()
+        )
+        if job is None:
+            return None
+        if job.status == "running":
+            logger.warning("job %s (%s) was abandoned since %s; running it again", job.id, job.kind, job.updated_at)
+        job.status = "running"
+        job.started_at = timezone.now()
+        job.save()
+    return job
+
+
+def run_job(job: models.Job) -> models.Job:
+    try:
+        job.result = HANDLERS[job.kind](job)
+        job.status = "succeeded"
+        job.progress = 1.0
+    except Exception as e:
+        logger.exception("job %s (%s) failed", job.id, job.kind)
+        job.status = "failed"
+        job.error = "".join(traceback.format_exception_only(type(e), e)).strip()
+    job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def run_next_job():
+    job = claim_next_job()
+    if job is None:
+        return None
+    return run_job(job)
+
+
+def _work(stop: threading.Event, once: bool, poll_interval: float) -> int:
+    done = 0
+    while not stop.is_set():
+        close_old_connections()
+        if run_next_job() is not None:
+            done += 1
+        elif once:
+            break
+        else:
+            stop.wait(poll_interval)
+    return done
+
+
+def _work_in_thread(stop: threading.Event, once: bool, poll_interval: float) -> int:
+    try:
+        return _work(stop, once, poll_interval)
+    finally:
+        connection.close()
+
+
+def work(concurrency: int = None, once: bool = False, poll_interval: float = 1.0, stop: threading.Event = None) -> int:
+    """Runs queued jobs in ``concurrency`` threads until ``stop`` is set (or the queue is empty with ``once``)."""
+    concurrency = concurrency or settings.JOB_WORKER_CONCURRENCY
+    stop = stop or threading.Event()
+    if concurrency == 1:
+        return _work(stop, once, poll_interval)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(_work_in_thread, stop, once, poll_interval) for _ in range(concurrency)]
+        try:
+            while not all(f.done() for f in futures):
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            stop.set()
+        return sum(f.result() for f in futures)
+
+
+def enqueue_budget_import(spec: dict, data: bytes, diff: bool = False, encoding: str = "utf-8") -> models.Job:
+    blob = models.Blob.write(BytesIO(data), name=spec["budget"]["slug"])
+    return enqueue("load_budget", {"spec": spec, "blob": blob.id, "diff": diff, "encoding": encoding})
+
+
+@handler("load_budget")
+def load_budget_job(job: models.Job) -> dict:
+    blob = models.Blob.objects.get(pk=job.payload["blob"])
+    spec = job.payload["spec"]
+    fp = TextIOWrapper(models.BlobReader(blob), encoding=job.payload.get("encoding", "utf-8"), newline="")
+    stats = loaders.load_budget_csv(spec, fp, diff=job.payload.get("diff", False), progress=job.set_progress)
+    blob.delete()
+    enqueue_wdmmg_cache_rebuilds(spec)
+    return stats
+
+
+def enqueue_wdmmg_cache_rebuild(budget_id: str) -> None:
+    """Queues the rebuild of the wdmmg tree and the stored totals of a budget, unless one is queued already."""
+    if not models.Job.objects.filter(kind="rebuild_wdmmg_cache", status="queued", payload__budget=budget_id).exists():
+        enqueue("rebuild_wdmmg_cache", {"budget": budget_id})
+
+
+def enqueue_wdmmg_cache_rebuilds(spec: dict) -> None:
+    """Queues the rebuild of the wdmmg trees of the budgets loaded with ``spec``."""
+    slugs = [spec["budget"]["slug"]] + ([spec["cofog"]["budget"]["slug"]] if "cofog" in spec else [])
+    for budget in models.BudgetBase.objects.filter(slug__in=slugs):
+        enqueue_wdmmg_cache_rebuild(budget.id)
+
+
+@receiver(post_save, sender=models.BasicBudget)
+@receiver(post_save, sender=models.MappedBudget)
+def enqueue_wdmmg_cache_rebuild_on_budget_save(sender, instance=None, **kwargs):
+    # every change of the items or classifications of a budget ends up saving it, so refresh what is derived from
+    # them here, once the change is committed, rather than when the budget is next read
+    if instance is not None:
+        budget_id = instance.id
+        transaction.on_commit(lambda: enqueue_wdmmg_cache_rebuild(budget_id))
+
+
+@handler("bulk_create_mapping")
+def bulk_create_mapping_job(job: models.Job) -> dict:
+    budget = models.MappedBudget.objects.get(pk=job.payload["budget"])
+    results = budget.bulk_create(job.payload["data"])
+    enqueue_wdmmg_cache_rebuild(budget.id)
+    return {"mapped_budget_items": len(results)}
+
+
+@handler("bulk_create_classification_tree")
+def bulk_create_classification_tree_job(job: models.Job) -> dict:
+    cs = models.ClassificationSystem.objects.get(pk=job.payload["classification_system"])
+    return {"classifications": len(cs.bulk_create_tree(job.payload["data"]))}
+
+
+@handler("rebuild_wdmmg_cache")
+def rebuild_wdmmg_cache_job(job: models.Job) -> dict:
+    budget = models.BudgetBase.objects.get(pk=job.payload["budget"])
+    serializers.WdmmgSerializer(budget).get_budgets(budget)
+    rollups.refresh_classification_amounts(budget)
+    return {"budget": budget.id}
@@ -0,0 +1,495 @@
+import csv
+import json
+from collections import Counter, defaultdict
+from zipfile import BadZipFile
+
+import shortuuid
+from django.db import transaction
+from django.utils import timezone
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+from . import models
+
+REQUIRED_SPEC_KEYS = ("government", "classification_system", "budget", "levels", "amount")
+# the nested fields the loaders read without a default, checked before any of them is used
+SPEC_FIELD_TYPES = (
+    (("government", "slug"), (str,)),
+    (("government", "name"), (str,)),
+    (("classification_system", "slug"), (str,)),
+    (("classification_system", "name"), (str,)),
+    (("budget", "slug"), (str,)),
+    (("budget", "name"), (str,)),
+    (("budget", "year"), (int,)),
+    (("levels",), (list,)),
+    (("amount", "column"), (str,)),
+    (("cofog", "column"), (str,)),
+    (("cofog", "budget", "slug"), (str,)),
+    (("cofog", "budget", "name"), (str,)),
+)
+SPEC_TYPE_NAMES = {(str,): "a string", (int,): "an integer", (list,): "a list"}
+
+
+def read_spec(fp) -> dict:
+    """Reads and validates a column-mapping spec for :func:`load_budget`.
+
+    A spec looks like::
+
+        {
+            "government": {"slug": "tama-shi", "name": "多摩市", "latitude": 35.637006, "longitude": 139.44631},
+            "classification_system": {"slug": "tama-shi-2021-nendo-yosan", "name": "多摩市2021年度予算"},
+            "budget": {"slug": "tama-shi-2021-nendo-yosan", "name": "多摩市2021年度予算", "year": 2021},
+            "levels": ["款", "項", "目", "細目", "節"],
+            "code_suffix": "",
+            "name_suffix": "名称",
+            "amount": {"column": "予算額", "scale": 1000},
+            "cofog": {
+                "column": "COFOG_Level2",
+                "classification_system": "cofog",
+                "budget": {"slug": "tama-shi-cofog2021", "name": "多摩市COFOG2021"}
+            },
+            "default_budget": "cofog"
+        }
+    """
+    return validate_spec(json.load(fp))
+
+
+def _check_spec_field(spec: dict, path: tuple, types: tuple) -> None:
+    value = spec
+    for i, key in enumerate(path):
+        if not isinstance(value, dict):
+            raise ValueError(f"spec.{'.'.join(path[:i])} must be an object")
+        if key not in value:
+            raise ValueError(f"spec lacks {'.'.join(path)}")
+        value = value[key]
+    # bool is a subclass of int, but true is not a year
+    if not isinstance(value, types) or isinstance(value, bool):
+        raise ValueError(f"spec.{'.'.join(path)} must be {SPEC_TYPE_NAMES[types]}")
+
+
+def validate_spec(spec: dict) -> dict:
+    if not isinstance(spec, dict):
+        raise ValueError("spec must be a JSON object")
+    missing = [k for k in REQUIRED_SPEC_KEYS if k not in spec]
+    if len(missing) > 0:
+        raise ValueError(f"spec lacks required keys: {', '.join(missing)}")
+    for path, types in SPEC_FIELD_TYPES:
+        if path[0] == "cofog" and "cofog" not in spec:
+            continue
+        _check_spec_field(spec, path, types)
+    if len(spec["levels"]) == 0:
+        raise ValueError("spec must have at least one level column")
+    if not all(isinstance(level, str) for level in spec["levels"]):
+        raise ValueError("spec.levels must be a list of column names")
+    if spec.get("default_budget") not in (None, "budget", "cofog"):
+        raise ValueError("default_budget must be either budget or cofog")
+    if spec.get("default_budget") == "cofog" and "cofog" not in spec:
+        raise ValueError("default_budget is cofog but no cofog column is specified")
+    return spec
+
+
+class RowError(ValueError):
+    def __init__(self, line: int, column: str, message: str):
+        super(RowError, self).__init__(f"line {line}: {message}")
+        self.line = line
+        self.column = column
+        self.message = message
+
+    def as_dict(self) -> dict:
+        return {"row": self.line, "column": self.column, "message": self.message}
+
+
+def parse_rows(spec: dict, rows, errors: list = None) -> dict:
+    """Builds the classification tree, leaf amounts and COFOG mapping of ``rows`` in memory.
+
+    A node is identified by the path of ``(code, name)`` pairs from its root. ``nodes`` lists the paths in order of
+    first appearance, which is pre-order for CSVs sorted by their level columns.
+
+    The first invalid row raises a :class:`RowError`. If a list is given as ``errors``, invalid rows are appended to it
+    and skipped instead, so that all of them can be reported at once.
+    """
+    code_suffix = spec.get("code_suffix", "")
+    name_suffix = spec.get("name_suffix", "名称")
+    amount_column = spec["amount"]["column"]
+    scale = spec["amount"].get("scale", 1)
+    cofog_column = spec["cofog"]["column"] if "cofog" in spec else None
+    nodes = {}
+    amounts = defaultdict(float)
+    mapping = defaultdict(dict)
+    for line, row in enumerate(rows, 2):
+        if all(v is None or v == "" for v in row.values()):
+            continue
+        try:
+            path = ()
+            for level in spec["levels"]:
+                try:
+                    code, name = row[f"{level}{code_suffix}"], row[f"{level}{name_suffix}"]
+                except KeyError as e:
+                    raise RowError(line, e.args[0], f"column {e} not found")
+                if not code and not name:
+                    break
+                path += ((code, name),)
+            if len(path) == 0:
+                raise RowError(line, f"{spec['levels'][0]}{code_suffix}", "no classification")
+            try:
+                amount = float(row[amount_column]) * scale
+            except (KeyError, TypeError, ValueError):
+                raise RowError(line, amount_column, f"invalid amount {row.get(amount_column)!r}")
+        except RowError as e:
+            if errors is None:
+                raise
+            errors.append(e.as_dict())
+            continue
+        for i in range(len(path)):
+            nodes[path[: i + 1]] = None
+        amounts[path] += amount
+        if cofog_column is not None and row.get(cofog_column):
+            mapping[row[cofog_column]][path] = None
+    return {
+        "nodes": list(nodes),
+        "amounts": dict(amounts),
+        "mapping": {k: list(v) for k, v in mapping.items()},
+    }
+
+
+def _get_or_create_targets(spec: dict) -> dict:
+    gov_spec = dict(spec["government"])
+    government = models.Government.objects.get_or_create(slug=gov_spec.pop("slug"), defaults=gov_spec)[0]
+    cs_spec = dict(spec["classification_system"])
+    cs = models.ClassificationSystem.objects.get_or_create(
+        slug=cs_spec.pop("slug"), defaults=dict(cs_spec, level_names=spec.get("level_names", spec["levels"]))
+    )[0]
+    budget_spec = spec["budget"]
+    budget = models.BasicBudget.objects.get_or_create(
+        slug=budget_spec["slug"],
+        defaults={
+            "name": budget_spec["name"],
+            "year_value": budget_spec["year"],
+            "government_value": government,
+            "subtitle": budget_spec.get("subtitle", ""),
+            "classification_system": cs,
+        },
+    )[0]
+    targets = {"government": government, "classification_system": cs, "budget": budget, "cofog_budget": None}
+    if "cofog" in spec:
+        cofog_cs = models.ClassificationSystem.objects.get(slug=spec["cofog"].get("classification_system", "cofog"))
+        cofog_budget_spec = spec["cofog"]["budget"]
+        targets["cofog_budget"] = models.MappedBudget.objects.get_or_create(
+            slug=cofog_budget_spec["slug"],
+            defaults={
+                "name": cofog_budget_spec["name"],
+                "subtitle": cofog_budget_spec.get("subtitle", ""),
+                "source_budget": budget,
+                "classification_system": cofog_cs,
+            },
+        )[0]
+    if spec.get("default_budget") is not None:
+        default = targets["cofog_budget"] if spec["default_budget"] == "cofog" else budget
+        models.DefaultBudget.objects.get_or_create(government=government, defaults={"budget": default})
+    return targets
+
+
+def _cofog_ids(cofog_budget: models.MappedBudget, codes) -> dict:
+    qs = models.Classification.objects.filter(classification_system=cofog_budget.classification_system)
+    known = dict(qs.values_list("code", "id"))
+    unknown = sorted(set(codes) - set(known))
+    if len(unknown) > 0:
+        raise ValueError(f"unknown COFOG codes: {', '.join(unknown)}")
+    return known
+
+
+def load_budget(spec: dict, rows, diff: bool = False, progress=None) -> dict:
+    """Loads ``rows`` into the budget described by ``spec``.
+
+    The whole tree, the atomic items and the COFOG mapping are built in memory and written with bulk statements, so the
+    number of queries does not grow with the number of rows.
+
+    By default the classifications and items of the budget are replaced. With ``diff=True`` the rows are matched to the
+    existing classifications by their path of codes and only the necessary inserts, updates and deletes are applied, so
+    ids survive re-imports and nothing is touched (and no cache invalidated) when nothing changed.
+    Returns the number of inserted, updated and deleted rows per table. ``progress`` is called with the completed
+    fraction of the work.
+    """
+    progress = progress or (lambda _: None)
+    parsed = parse_rows(spec, rows)
+    progress(0.3)
+    return load_parsed(spec, parsed, diff=diff, progress=progress)
+
+
+def load_parsed(spec: dict, parsed: dict, diff: bool = False, progress=None) -> dict:
+    """Writes the output of :func:`parse_rows`; see :func:`load_budget`."""
+    progress = progress or (lambda _: None)
+    with transaction.atomic():
+        targets = _get_or_create_targets(spec)
+        cs, budget, cofog_budget = targets["classification_system"], targets["budget"], targets["cofog_budget"]
+        cofog_ids = _cofog_ids(cofog_budget, parsed["mapping"]) if cofog_budget is not None else {}
+        with models.suspend_touch():
+            if diff:
+                stats = _diff_budget(parsed, cs, budget, cofog_budget, cofog_ids)
+            else:
+                stats = _replace_budget(parsed, cs, budget, cofog_budget, cofog_ids)
+        progress(0.9)
+        # The bulk writes bypassed the touch receivers, so touch the most upstream changed object once.
+        if _changed(stats["classifications"]):
+            cs.save()
+        elif _changed(stats["atomic_budget_items"]):
+            budget.save()
+        elif _changed(stats["mapped_budget_items"]) or _changed(stats["mapping_links"]):
+            cofog_budget.save()
+    return stats
+
+
+def _changed(stat: dict) -> bool:
+    return any(v > 0 for v in stat.values())
+
+
+def _stat(inserted: int = 0, updated: int = 0, deleted: int = 0) -> dict:
+    return {"inserted": inserted, "updated": updated, "deleted": deleted}
+
+
+def _new_classification(cs, path, parent_id, item_order) -> models.Classification:
+    return models.Classification(
+        id=shortuuid.uuid(),
+        code=path[-1][0],
+        name=path[-1][1],
+        classification_system=cs,
+        parent_id=parent_id,
+        item_order=item_order,
+    )
+
+
+def _insert_classifications(classifications: list) -> None:
+    levels = defaultdict(list)
+    depths = {}
+    for c in classifications:
+        depths[c.id] = depths.get(c.parent_id, -1) + 1
+        levels[depths[c.id]].append(c)
+    for depth in sorted(levels):
+        models.Classification.objects.bulk_create(levels[depth])
+
+
+def _insert_mapped_items(cofog_budget, cofog_ids, mapping: dict) -> list:
+    return models.BudgetItemBase.bulk_insert(
+        [models.MappedBudgetItem(budget=cofog_budget, classification_id=cofog_ids[code]) for code in mapping]
+    )
+
+
+def _insert_mapping_links(links) -> int:
+    through = models.MappedBudgetItem.source_classifications.through
+    through.objects.bulk_create(
+        [
+            through(mappedbudgetitem_id=mbi_id, classification_id=classification_id)
+            for mbi_id, classification_id in links
+        ]
+    )
+    return len(links)
+
+
+def _replace_budget(parsed, cs, budget, cofog_budget, cofog_ids) -> dict:
+    deleted = Counter()
+    if cofog_budget is not None:
+        deleted.update(models.BudgetItemBase.objects.filter(budget=cofog_budget).delete()[1])
+    deleted.update(models.BudgetItemBase.objects.filter(budget=budget).delete()[1])
+    deleted.update(models.Classification.objects.filter(classification_system=cs).delete()[1])
+
+    ids = {}
+    classifications = []
+    for item_order, path in enumerate(parsed["nodes"]):
+        c = _new_classification(cs, path, ids.get(path[:-1]), item_order)
+        ids[path] = c.id
+        classifications.append(c)
+    _insert_classifications(classifications)
+
+    models.BudgetItemBase.bulk_insert(
+        [
+            models.AtomicBudgetItem(budget=budget, classification_id=ids[path], value=value)
+            for path, value in parsed["amounts"].items()
+        ]
+    )
+
+    links = 0
+    if cofog_budget is not None:
+        mapped_items = _insert_mapped_items(cofog_budget, cofog_ids, parsed["mapping"])
+        links = _insert_mapping_links(
+            [(mbi.id, ids[path]) for mbi, paths in zip(mapped_items, parsed["mapping"].values()) for path in paths]
+        )
+    through = models.MappedBudgetItem.source_classifications.through
+    return {
+        "classifications": _stat(len(classifications), 0, deleted.get(models.Classification._meta.label, 0)),
+        "atomic_budget_items": _stat(len(parsed["amounts"]), 0, deleted.get(models.AtomicBudgetItem._meta.label, 0)),
+        "mapped_budget_items": _stat(len(parsed["mapping"]), 0, deleted.get(models.MappedBudgetItem._meta.label, 0)),
+        "mapping_links": _stat(links, 0, deleted.get(through._meta.label, 0)),
+    }
+
+
+def _match_classifications(parsed, cs) -> tuple:
+    """Matches the parsed nodes to the existing classifications of ``cs``.
+
+    A node matches the existing child of its (matched) parent with the same code and name, or failing that the only
+    remaining one with the same code, provided the code is unique among the incoming siblings too (a renamed node).
+    Returns the resolved id of every node path, the classifications to insert and those to update.
+    """
+    existing = {}
+    by_key = {}
+    by_code = defaultdict(list)
+    for c in models.Classification.objects.filter(classification_system=cs).only(
+        "id", "code", "name", "parent_id", "item_order"
+    ):
+        existing[c.id] = c
+        by_key[(c.parent_id, c.code, c.name)] = c
+        by_code[(c.parent_id, c.code)].append(c)
+    incoming_codes = defaultdict(int)
+    for path in parsed["nodes"]:
+        incoming_codes[(path[:-1], path[-1][0])] += 1
+
+    ids = {}
+    matched = set()
+    inserts = []
+    updates = []
+    for item_order, path in enumerate(parsed["nodes"]):
+        code, name = path[-1]
+        parent_id = ids.get(path[:-1])
+        c = by_key.get((parent_id, code, name))
+        if c is None or c.id in matched:
+            candidates = [d for d in by_code.get((parent_id, code), []) if d.id not in matched]
+            c = candidates[0] if len(candidates) == 1 and incoming_codes[(path[:-1], code)] == 1 else None
+        if c is None:
+            c = _new_classification(cs, path, parent_id, item_order)
+            inserts.append(c)
+        else:
+            matched.add(c.id)
+            if c.name != name or c.item_order != item_order:
+                c.name = name
+                c.item_order = item_order
+                updates.append(c)
+        ids[path] = c.id
+    deletes = [k for k in existing if k not in matched]
+    return ids, inserts, updates, deletes
+
+
+def _diff_budget(parsed, cs, budget, cofog_budget, cofog_ids) -> dict:
+    through = models.MappedBudgetItem.source_classifications.through
+    # Snapshot the current items and links first so that rows removed by cascade are counted as deleted, too.
+    current_items = {d.classification_id: d for d in models.AtomicBudgetItem.objects.filter(budget=budget)}
+    current_mapped = dict(
+        models.MappedBudgetItem.objects.filter(budget=cofog_budget).values_list("classification_id", "id")
+    )
+    current_links = {
+        (mbi_id, classification_id): link_id
+        for link_id, mbi_id, classification_id in through.objects.filter(
+            mappedbudgetitem_id__in=list(current_mapped.values())
+        ).values_list("id", "mappedbudgetitem_id", "classification_id")
+    }
+
+    ids, inserts, updates, deletes = _match_classifications(parsed, cs)
+    if len(deletes) > 0:
+        models.Classification.objects.filter(id__in=deletes).delete()
+    if len(updates) > 0:
+        # (classification_system, item_order) is unique and checked row by row, so move the reordered rows out of the
+        # way before giving them their final positions.
+        final = [c.item_order for c in updates]
+        for idx, c in enumerate(updates):
+            c.item_order = -idx - 1
+        models.Classification.objects.bulk_update(updates, ["item_order"])
+        now = timezone.now()
+        for c, item_order in zip(updates, final):
+            c.item_order = item_order
+            c.updated_at = now
+            # bulk_update does not call pre_save, so renamed rows get their search fields here
+            c.reading = models.jp_reading(c.name) if c.name is not None else None
+            c.search_vector = models.get_search_vector(c.name)
+        models.Classification.objects.bulk_update(
+            updates, ["name", "item_order", "reading", "search_vector", "updated_at"]
+        )
+    _insert_classifications(inserts)
+    stats = {"classifications": _stat(len(inserts), len(updates), len(deletes))}
+
+    amounts = {ids[path]: value for path, value in parsed["amounts"].items()}
+    item_updates = []
+    now = timezone.now()
+    for classification_id, value in amounts.items():
+        item = current_items.get(classification_id)
+        if item is not None and item.value != value:
+            item.value = value
+            item.updated_at = now
+            item_updates.append(item)
+    item_inserts = [
+        models.AtomicBudgetItem(budget=budget, classification_id=k, value=v)
+        for k, v in amounts.items()
+        if k not in current_items
+    ]
+    item_deletes = [d.id for k, d in current_items.items() if k not in amounts]
+    if len(item_deletes) > 0:
+        models.BudgetItemBase.objects.filter(id__in=item_deletes).delete()
+    if len(item_updates) > 0:
+        models.AtomicBudgetItem.objects.bulk_update(item_updates, ["value", "updated_at"])
+    models.BudgetItemBase.bulk_insert(item_inserts)
+    stats["atomic_budget_items"] = _stat(len(item_inserts), len(item_updates), len(item_deletes))
+
+    stats["mapped_budget_items"] = _stat()
+    stats["mapping_links"] = _stat()
+    if cofog_budget is None:
+        return stats
+    mapping = {cofog_ids[code]: [ids[path] for path in paths] for code, paths in parsed["mapping"].items()}
+    mapped_deletes = [v for k, v in current_mapped.items() if k not in mapping]
+    if len(mapped_deletes) > 0:
+        models.BudgetItemBase.objects.filter(id__in=mapped_deletes).delete()
+    new_codes = {code: paths for code, paths in parsed["mapping"].items() if cofog_ids[code] not in current_mapped}
+    for mbi in _insert_mapped_items(cofog_budget, cofog_ids, new_codes):
+        current_mapped[mbi.classification_id] = mbi.id
+    stats["mapped_budget_items"] = _stat(len(new_codes), 0, len(mapped_deletes))
+
+    wanted = {(current_mapped[k], v) for k, vs in mapping.items() for v in vs}
+    link_deletes = [v for k, v in current_links.items() if k not in wanted]
+    if len(link_deletes) > 0:
+        through.objects.filter(id__in=link_deletes).delete()
+    inserted = _insert_mapping_links([k for k in wanted if k not in current_links])
+    stats["mapping_links"] = _stat(inserted, 0, len(link_deletes))
+    return stats
+
+
+def load_budget_csv(spec: dict, fp, diff: bool = False, progress=None) -> dict:
+    return load_budget(spec, csv.DictReader(fp), diff=diff, progress=progress)
+
+
+def _cell_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def read_xlsx(fp, spec: dict) -> tuple:
+    """Opens the first sheet of a workbook in the layout of the budget xlsx template.
+
+    The level columns are taken from the header row (a code column followed by its name column) and the amount column
+    defaults to 金額, unless ``spec`` gives ``levels`` and ``amount``. Returns the completed spec and an iterator over
+    the remaining rows as dicts, read from the workbook in read-only mode as they are consumed.
+    """
+    try:
+        wb = load_workbook(fp, read_only=True, data_only=True)
+    except (BadZipFile, InvalidFileException, KeyError, OSError):
+        raise ValueError("file is not an xlsx workbook")
+    ws = wb.worksheets[0]
+    header = next(ws.iter_rows(max_row=1, values_only=True), ())
+    header = [_cell_text(v) for v in header]
+    name_suffix = spec.get("name_suffix", "名称")
+    spec = dict(
+        {
+            "levels": [h for h, n in zip(header, header[1:]) if h and n == f"{h}{name_suffix}"],
+            "amount": {"column": "金額"},
+        },
+        **spec,
+    )
+    validate_spec(spec)
+    text_columns = set(header) - {spec["amount"]["column"]}
+
+    def rows():
+        try:
+            for values in ws.iter_rows(min_row=2, values_only=True):
+                yield {h: _cell_text(v) if h in text_columns else v for h, v in zip(header, values) if h}
+        finally:
+            wb.close()
+
+    return spec, rows()
@@ -0,0 +1,30 @@
+import time
+
+from budgetmapper import loaders
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Loads a flat budget CSV into a basic budget (and its COFOG mapped budget) described by a spec file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("spec", help="JSON file describing the columns of the CSV and the target budget")
+        parser.add_argument("input", help="budget CSV file")
+        parser.add_argument("--encoding", default="utf-8")
+        parser.add_argument(
+            "--diff",
+            action="store_true",
+            help="match rows to the existing classifications and apply only the changes instead of replacing them",
+        )
+
+    def handle(self, *args, **options):
+        started_at = time.perf_counter()
+        try:
+            with open(options["spec"], "r", encoding="utf-8") as fin:
+                spec = loaders.read_spec(fin)
+            with open(options["input"], "r", encoding=options["encoding"], newline="") as fin:
+                stats = loaders.load_budget_csv(spec, fin, diff=options["diff"])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        summary = ", ".join(f"{k}: +{v['inserted']} ~{v['updated']} -{v['deleted']}" for k, v in stats.items())
+        self.stdout.write(self.style.SUCCESS(f"{summary} ({time.perf_counter() - started_at:.2f}s)"))
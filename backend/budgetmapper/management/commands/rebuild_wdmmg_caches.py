@@ -0,0 +1,12 @@
+from budgetmapper import jobs, models
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Queues the rebuild of the wdmmg trees and stored totals of every budget, e.g. after they were cleared."
+
+    def handle(self, *args, **options):
+        budget_ids = list(models.BudgetBase.objects.values_list("id", flat=True))
+        for budget_id in budget_ids:
+            jobs.enqueue_wdmmg_cache_rebuild(budget_id)
+        self.stdout.write(self.style.SUCCESS(f"{len(budget_ids)} rebuild(s) queued"))
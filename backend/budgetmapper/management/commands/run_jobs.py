@@ -0,0 +1,23 @@
+from budgetmapper import jobs
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Runs the queued background jobs (imports, mapping bulk-creates and cache rebuilds)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.JOB_WORKER_CONCURRENCY,
+            help="number of jobs run in parallel (APPLICATION_JOB_WORKER_CONCURRENCY by default)",
+        )
+        parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds to wait for new jobs")
+
+    def handle(self, *args, **options):
+        done = jobs.work(
+            concurrency=options["concurrency"], once=options["once"], poll_interval=options["poll_interval"]
+        )
+        self.stdout.write(self.style.SUCCESS(f"{done} job(s) done"))
@@ -0,0 +1,36 @@
+# Generated by Django 4.0.1 on 2026-10-19 10:23
+
+import budgetmapper.models
+import django.core.validators
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetmapper', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', budgetmapper.models.PkField(blank=True, editable=False, max_length=22, primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=64)),
+                ('status', budgetmapper.models.JobStatusField(choices=[('queued', 'queued'), ('running', 'running'), ('succeeded', 'succeeded'), ('failed', 'failed')], default='queued', max_length=16)),
+                ('payload', models.JSONField(default=dict)),
+                ('result', models.JSONField(null=True)),
+                ('error', models.TextField(null=True)),
+                ('progress', models.FloatField(default=0.0, validators=[django.core.validators.MinValueValidator(0.0), django.core.validators.MaxValueValidator(1.0)])),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('created_at', budgetmapper.models.CurrentDateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('updated_at', budgetmapper.models.AutoUpdateCurrentDateTimeField(default=django.utils.timezone.now, editable=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'created_at'], name='budgetmappe_status_1cf22e_idx'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_year_and_government(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE budgetmapper_budgetbase AS b"
+            " SET year_value = s.legacy_year_value, government_value_id = s.legacy_government_value_id"
+            " FROM budgetmapper_basicbudget AS s WHERE s.budgetbase_ptr_id = b.id"
+        )
+        # mapped budgets may be mapped from other mapped budgets; copy one level at a time
+        while True:
+            cursor.execute(
+                "UPDATE budgetmapper_budgetbase AS b"
+                " SET year_value = s.year_value, government_value_id = s.government_value_id"
+                " FROM budgetmapper_mappedbudget AS m, budgetmapper_budgetbase AS s"
+                " WHERE m.budgetbase_ptr_id = b.id AND s.id = m.source_budget_id"
+                " AND b.year_value IS NULL AND s.year_value IS NOT NULL"
+            )
+            if cursor.rowcount == 0:
+                break
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetmapper', '0002_job'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='basicbudget',
+            options={'base_manager_name': 'objects'},
+        ),
+        migrations.RemoveIndex(
+            model_name='basicbudget',
+            name='budgetmappe_governm_3536ec_idx',
+        ),
+        migrations.RenameField(
+            model_name='basicbudget',
+            old_name='government_value',
+            new_name='legacy_government_value',
+        ),
+        migrations.RenameField(
+            model_name='basicbudget',
+            old_name='year_value',
+            new_name='legacy_year_value',
+        ),
+        migrations.AddField(
+            model_name='budgetbase',
+            name='government_value',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='budgetmapper.government'),
+        ),
+        migrations.AddField(
+            model_name='budgetbase',
+            name='year_value',
+            field=models.IntegerField(db_index=True, null=True),
+        ),
+        migrations.RunPython(copy_year_and_government, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='basicbudget',
+            name='legacy_government_value',
+        ),
+        migrations.RemoveField(
+            model_name='basicbudget',
+            name='legacy_year_value',
+        ),
+        migrations.AlterField(
+            model_name='budgetbase',
+            name='government_value',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='budgetmapper.government'),
+        ),
+        migrations.AlterField(
+            model_name='budgetbase',
+            name='year_value',
+            field=models.IntegerField(db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='budgetbase',
+            index=models.Index(fields=['government_value', 'year_value'], name='budgetmappe_governm_0a21bc_idx'),
+        ),
+    ]
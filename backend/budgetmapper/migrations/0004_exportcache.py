@@ -0,0 +1,31 @@
+# Generated by Django 4.0.1 on 2026-10-19 11:05
+
+import budgetmapper.models
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetmapper', '0003_budgetbase_year_value_government_value'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportCache',
+            fields=[
+                ('id', budgetmapper.models.PkField(blank=True, editable=False, max_length=22, primary_key=True, serialize=False)),
+                ('format', models.CharField(max_length=16)),
+                ('version', models.DateTimeField()),
+                ('created_at', budgetmapper.models.CurrentDateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('updated_at', budgetmapper.models.AutoUpdateCurrentDateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('blob', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='budgetmapper.blob')),
+                ('budget', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='budgetmapper.budgetbase')),
+            ],
+            options={
+                'unique_together': {('budget', 'format')},
+            },
+        ),
+    ]
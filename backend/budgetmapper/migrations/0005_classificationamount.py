@@ -0,0 +1,49 @@
+# Generated by Django 4.0.1 on 2026-10-19 11:20
+
+import budgetmapper.models
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetmapper', '0004_exportcache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClassificationAmount',
+            fields=[
+                ('id', budgetmapper.models.PkField(blank=True, editable=False, max_length=22, primary_key=True, serialize=False)),
+                ('path', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=64, null=True), size=None)),
+                ('level', models.PositiveSmallIntegerField(null=True)),
+                ('child_count', models.PositiveIntegerField(default=0)),
+                ('amount', budgetmapper.models.BudgetAmountField()),
+                ('version', models.DateTimeField()),
+                ('budget', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='budgetmapper.budgetbase')),
+                ('classification', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='budgetmapper.classification')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='classificationamount',
+            index=models.Index(fields=['budget', 'path'], name='budgetmappe_budget__3fba47_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='classificationamount',
+            index=models.Index(fields=['budget', 'level', '-amount'], name='budgetmapper_amount_level'),
+        ),
+        migrations.AddIndex(
+            model_name='classificationamount',
+            index=models.Index(condition=models.Q(('child_count', 0), ('level__isnull', False)), fields=['budget', '-amount'], name='budgetmapper_amount_leaf'),
+        ),
+        migrations.AddConstraint(
+            model_name='classificationamount',
+            constraint=models.UniqueConstraint(fields=('budget', 'classification'), name='budgetmapper_amount_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='classificationamount',
+            constraint=models.UniqueConstraint(condition=models.Q(('classification', None)), fields=('budget',), name='budgetmapper_amount_unique_total'),
+        ),
+    ]
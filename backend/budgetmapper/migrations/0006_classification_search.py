@@ -0,0 +1,44 @@
+# Generated by Django 4.0.1 on 2026-10-19 11:25
+
+import budgetmapper.models
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+def fill_search_fields(apps, schema_editor):
+    Classification = apps.get_model("budgetmapper", "Classification")
+    # bulk_update does not call pre_save, so the values are computed here
+    batch = []
+    for c in Classification.objects.only("id", "name").iterator(chunk_size=2000):
+        c.reading = budgetmapper.models.jp_reading(c.name) if c.name is not None else None
+        c.search_vector = budgetmapper.models.get_search_vector(c.name)
+        batch.append(c)
+        if len(batch) >= 2000:
+            Classification.objects.bulk_update(batch, ["reading", "search_vector"])
+            batch = []
+    Classification.objects.bulk_update(batch, ["reading", "search_vector"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetmapper', '0005_classificationamount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classification',
+            name='reading',
+            field=budgetmapper.models.ReadingField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='classification',
+            name='search_vector',
+            field=budgetmapper.models.NameSearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_search_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='classification',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='budgetmapper_classif_search'),
+        ),
+    ]
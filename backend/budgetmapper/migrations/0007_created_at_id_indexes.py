@@ -0,0 +1,25 @@
+# Generated by Django 4.0.1 on 2026-10-19 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budgetmapper', '0006_classification_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='budgetbase',
+            index=models.Index(fields=['created_at', 'id'], name='budgetmappe_created_f0310c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='budgetitembase',
+            index=models.Index(fields=['budget', 'created_at', 'id'], name='budgetmappe_budget__fa6ae2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='government',
+            index=models.Index(fields=['created_at', 'id'], name='budgetmappe_created_a7c87a_idx'),
+        ),
+    ]
@@ -1,15 +1,22 @@
 import base64
 import json
-from abc import abstractmethod
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
 from io import BufferedIOBase, BytesIO, RawIOBase
 
 import pykakasi
+import shortuuid
 import shortuuidfield
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator, RegexValidator
-from django.db import models, transaction
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, connections, models, transaction
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
@@ -38,11 +45,76 @@ class AutoUpdateCurrentDateTimeField(CurrentDateTimeField):
         return val
 
 
-kks = pykakasi.kakasi()
+@lru_cache(maxsize=1)
+def get_kakasi() -> pykakasi.kakasi:
+    # Building the converter loads the whole dictionary, so defer it until a slug is actually needed.
+    return pykakasi.kakasi()
 
 
+@lru_cache(maxsize=8192)
 def jp_slugify(name: str) -> str:
-    return slugify("-".join(d["hepburn"] for d in kks.convert(name)))
+    """
+    >>> jp_slugify("つくば市")
+    'tsukuba-shi'
+    """
+    return slugify("-".join(d["hepburn"] for d in get_kakasi().convert(name)))
+
+
+@lru_cache(maxsize=8192)
+def jp_reading(name: str) -> str:
+    """
+    >>> jp_reading("つくば市")
+    'tsukubashi'
+    >>> jp_reading("ツクバ 総務費")
+    'tsukubasoumuhi'
+    """
+    return "".join("".join(d["hepburn"] for d in get_kakasi().convert(name)).split()).lower()
+
+
+def ngrams(text: str) -> set:
+    """The bigrams of ``text`` in lower case, padded at the end so that every character starts one.
+
+    >>> sorted(ngrams("Abc"))
+    ['ab', 'bc', 'c ']
+    """
+    text = text.lower() + " "
+    return {a + b for a, b in zip(text, text[1:])}
+
+
+def _ts_lexeme(token: str) -> str:
+    return "'" + token.replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def get_search_vector(name: str) -> str:
+    """The ``tsvector`` of the bigrams of ``name`` and of its reading.
+
+    >>> get_search_vector("款")
+    "'an' 'ka' 'n ' '款 '"
+    """
+    if name is None:
+        return ""
+    tokens = ngrams(name) | ngrams(jp_reading(name))
+    return " ".join(_ts_lexeme(t) for t in sorted(tokens))
+
+
+def get_search_query(text: str) -> str:
+    """The ``tsquery`` matching the names that contain ``text`` or whose reading contains its reading.
+
+    Every bigram of ``text`` must be in the vector; a single character matches the bigrams it starts.
+
+    >>> get_search_query("ab")
+    "'ab'"
+    >>> get_search_query("款")
+    "'款':* | ( 'ka' & 'an' )"
+    """
+    terms = []
+    for term in dict.fromkeys((text.lower(), jp_reading(text))):
+        if len(term) == 1:
+            terms.append(_ts_lexeme(term) + ":*")
+        elif len(term) > 1:
+            grams = [a + b for a, b in zip(term, term[1:])]
+            terms.append(" & ".join(_ts_lexeme(t) for t in dict.fromkeys(grams)))
+    return " | ".join(terms[:1] + [f"( {t} )" for t in terms[1:]])
 
 
 class JpSlugField(models.SlugField):
@@ -62,6 +134,42 @@ class NameField(models.TextField):
         super(NameField, self).__init__(*args, **dict(kwargs, null=True, db_index=True))
 
 
+class ReadingField(models.TextField):
+    """The romanized reading of the ``name`` of the instance, kept up to date on every save."""
+
+    def __init__(self, *args, **kwargs):
+        super(ReadingField, self).__init__(*args, **dict(kwargs, null=True, editable=False))
+
+    def pre_save(self, model_instance, add):
+        val = jp_reading(model_instance.name) if model_instance.name is not None else None
+        setattr(model_instance, self.attname, val)
+        return val
+
+
+class NameSearchVectorField(SearchVectorField):
+    """The bigrams of the ``name`` of the instance and of its reading, for substring search with a GIN index."""
+
+    def __init__(self, *args, **kwargs):
+        super(NameSearchVectorField, self).__init__(*args, **dict(kwargs, null=True, editable=False))
+
+    def pre_save(self, model_instance, add):
+        val = get_search_vector(model_instance.name)
+        setattr(model_instance, self.attname, val)
+        return val
+
+
+@NameSearchVectorField.register_lookup
+class NgramMatch(models.Lookup):
+    """Matches a ``tsquery`` from :func:`get_search_query` as is, without a text search configuration."""
+
+    lookup_name = "ngram_match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} @@ ({rhs})::tsquery", lhs_params + rhs_params
+
+
 class IdField(shortuuidfield.ShortUUIDField):
     def __init__(self, *args, **kwargs):
         super(IdField, self).__init__(*args, **dict(kwargs, editable=False))
@@ -213,6 +321,11 @@ class Government(models.Model):
     created_at = CurrentDateTimeField()
     updated_at = AutoUpdateCurrentDateTimeField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at", "id"]),
+        ]
+
 
 class ClassificationSystem(models.Model):
     id = PkField()
@@ -233,17 +346,82 @@ class ClassificationSystem(models.Model):
             classification_system=self,
         )
 
-    def __iterate_classifications_sub(self, buf):
-        is_leaf = True
-        for d in Classification.objects.filter(parent=buf[-1]):
-            is_leaf = False
-            yield from self.__iterate_classifications_sub(buf + [d])
-        if is_leaf:
-            yield buf
-
-    def iterate_classifications(self):
-        for r in self.roots:
-            yield from self.__iterate_classifications_sub([r])
+    def get_children_map(self) -> dict:
+        """Returns the classifications of this system in item order, grouped by parent id (``None`` for the roots).
+
+        The whole tree is loaded with one query.
+        """
+        children = defaultdict(list)
+        for c in Classification.objects.filter(classification_system=self).order_by("item_order"):
+            children[c.parent_id].append(c)
+        return children
+
+    def iterate_classifications(self, children: dict = None):
+        """Yields the path from a root to each leaf, in preorder."""
+        children = self.get_children_map() if children is None else children
+        path = []
+        stack = [(0, c) for c in reversed(children.get(None, ()))]
+        while len(stack) > 0:
+            depth, node = stack.pop()
+            del path[depth:]
+            path.append(node)
+            sub = children.get(node.id)
+            if sub:
+                stack.extend((depth + 1, c) for c in reversed(sub))
+            else:
+                yield list(path)
+
+    def bulk_create_tree(self, data) -> list:
+        """Inserts a nested tree of classifications with one INSERT per depth level.
+
+        Each node is a dict with ``name``, ``code`` and optional ``icon_slug`` and ``children``.
+        Ids and item orders are assigned in memory in pre-order, appended after the existing items.
+        """
+        if not isinstance(data, list):
+            raise ValueError("data must be a list of classification nodes")
+        qs = Classification.objects.filter(classification_system=self)
+        max_item_order = qs.aggregate(models.Max("item_order"))["item_order__max"]
+        next_item_order = 0 if max_item_order is None else max_item_order + 1
+        levels = []
+        icon_slugs = {}
+
+        def visit(node, parent_id, depth):
+            nonlocal next_item_order
+            if not isinstance(node, dict):
+                raise ValueError("classification node must be an object")
+            inst = Classification(
+                id=shortuuid.uuid(),
+                name=node.get("name"),
+                code=node.get("code"),
+                classification_system=self,
+                parent_id=parent_id,
+                item_order=next_item_order,
+            )
+            next_item_order += 1
+            icon_slug = node.get("icon_slug", node.get("icon-slug"))
+            if icon_slug is not None:
+                icon_slugs[inst.id] = icon_slug
+            if len(levels) <= depth:
+                levels.append([])
+            levels[depth].append(inst)
+            children = node.get("children") or []
+            if not isinstance(children, list):
+                raise ValueError("children must be a list of classification nodes")
+            for child in children:
+                visit(child, inst.id, depth + 1)
+
+        for node in data:
+            visit(node, None, 0)
+
+        icons = {d.slug: d for d in IconImage.objects.filter(slug__in=set(icon_slugs.values()))}
+        with transaction.atomic():
+            for level in levels:
+                for inst in level:
+                    inst.icon = icons.get(icon_slugs.get(inst.id))
+                Classification.objects.bulk_create(level)
+            # bulk_create bypasses post_save, so invalidate the dependent budgets once for the whole tree.
+            self.save()
+        return [inst for level in levels for inst in level]
 
 
 class Classification(models.Model):
@@ -254,9 +432,22 @@ class Classification(models.Model):
     parent = models.ForeignKey("self", on_delete=models.CASCADE, null=True)
     icon = models.ForeignKey(IconImage, blank=True, null=True, on_delete=models.SET_NULL, default=None)
     item_order = ItemOrderField()
+    reading = ReadingField()
+    search_vector = NameSearchVectorField()
     created_at = CurrentDateTimeField()
     updated_at = AutoUpdateCurrentDateTimeField()
 
+    @classmethod
+    def search(cls, text: str) -> models.QuerySet:
+        """The classifications whose name contains ``text``, ignoring case, or whose reading contains its reading.
+
+        The bigram index narrows the candidates down and the conditions are then checked on them only.
+        """
+        return cls.objects.filter(
+            models.Q(name__icontains=text) | models.Q(reading__contains=jp_reading(text)),
+            search_vector__ngram_match=get_search_query(text),
+        )
+
     @property
     def level(self) -> int:
         if self.parent is None:
@@ -279,6 +470,9 @@ class Classification(models.Model):
 
     class Meta:
         unique_together = ("classification_system", "item_order")
+        indexes = [
+            GinIndex(fields=["search_vector"], name="budgetmapper_classif_search"),
+        ]
 
 
 class BudgetBase(PolymorphicModel):
@@ -287,9 +481,23 @@ class BudgetBase(PolymorphicModel):
     slug = JpSlugField(unique=True)
     subtitle = models.TextField(null=True)
     classification_system = models.ForeignKey(ClassificationSystem, on_delete=models.CASCADE, db_index=True, null=False)
+    # stored for mapped budgets as well (copied from their source budget) so that they can be filtered in SQL
+    year_value = models.IntegerField(null=False, db_index=True)
+    government_value = models.ForeignKey(Government, on_delete=models.CASCADE, db_index=True, null=False)
     created_at = CurrentDateTimeField()
     updated_at = AutoUpdateCurrentDateTimeField()
 
+    class Meta(PolymorphicModel.Meta):
+        indexes = [
+            models.Index(fields=["government_value", "year_value"]),
+            models.Index(fields=["created_at", "id"]),
+        ]
+
+    @classmethod
+    def flat_objects(cls):
+        """Non-polymorphic budgets with ``source_budget_id`` annotated (None for basic budgets), enough for lists."""
+        return cls.objects.non_polymorphic().annotate(source_budget_id=models.F("mappedbudget__source_budget"))
+
     def get_amount_of(self, classification: Classification) -> float:
         if self.classification_system != classification.classification_system:
             raise ValueError
@@ -304,28 +512,30 @@ class BudgetBase(PolymorphicModel):
         except BudgetItemBase.DoesNotExist:
             return 0.0
 
-    def iterate_items(self):
-        for cl in self.classification_system.iterate_classifications():
-            try:
-                val = BudgetItemBase.objects.get(budget=self, classification=cl[-1])
-                yield {"classifications": cl, "budget_item": val}
-            except BudgetItemBase.DoesNotExist:
-                yield {"classifications": cl, "budget_item": None}
-
-    @property
-    @abstractmethod
-    def year(self):
+    def get_item_amounts(self) -> dict:
+        """Returns the amounts of the items of this budget keyed by classification id."""
         raise NotImplementedError
 
-    @property
-    @abstractmethod
-    def government(self):
-        raise NotImplementedError
-
-
-class BasicBudget(BudgetBase):
-    year_value = models.IntegerField(null=False, db_index=True)
-    government_value = models.ForeignKey(Government, on_delete=models.CASCADE, db_index=True, null=False)
+    def get_amounts(self, children: dict = None) -> dict:
+        """Returns the amount of every classification (its item plus its descendants) keyed by classification id."""
+        children = self.classification_system.get_children_map() if children is None else children
+        items = self.get_item_amounts()
+        nodes = []
+        stack = list(children.get(None, ()))
+        while len(stack) > 0:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(children.get(node.id, ()))
+        amounts = {}
+        # children come after their parent in ``nodes``, so walking it backwards sums the leaves first
+        for node in reversed(nodes):
+            amounts[node.id] = items.get(node.id, 0.0) + sum(amounts[c.id] for c in children.get(node.id, ()))
+        return amounts
+
+    def iterate_items(self, children: dict = None):
+        items = {d.classification_id: d for d in BudgetItemBase.objects.filter(budget=self)}
+        for cl in self.classification_system.iterate_classifications(children):
+            yield {"classifications": cl, "budget_item": items.get(cl[-1].id)}
 
     @property
     def year(self):
@@ -335,10 +545,12 @@ class BasicBudget(BudgetBase):
     def government(self):
         return self.government_value
 
-    class Meta:
-        indexes = [
-            models.Index(fields=["government_value", "year_value"]),
-        ]
+
+class BasicBudget(BudgetBase):
+    def get_item_amounts(self) -> dict:
+        return {
+            k: float(v) for k, v in AtomicBudgetItem.objects.filter(budget=self).values_list("classification", "value")
+        }
 
 
 class MappedBudget(BudgetBase):
@@ -346,13 +558,29 @@ class MappedBudget(BudgetBase):
         BudgetBase, related_name="mapped_budget", db_index=True, on_delete=models.CASCADE, null=False
     )
 
-    @property
-    def year(self):
-        return self.source_budget.year
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(MappedBudget, cls).from_db(db, field_names, values)
+        instance._loaded_source_budget_id = instance.__dict__.get("source_budget_id")
+        return instance
 
-    @property
-    def government(self):
-        return self.source_budget.government
+    def save(self, *args, **kwargs):
+        if self._state.adding or self.source_budget_id != getattr(self, "_loaded_source_budget_id", None):
+            self.year_value = self.source_budget.year_value
+            self.government_value_id = self.source_budget.government_value_id
+            self._loaded_source_budget_id = self.source_budget_id
+        super(MappedBudget, self).save(*args, **kwargs)
+
+    def get_item_amounts(self) -> dict:
+        source_amounts = self.source_budget.get_real_instance().get_amounts()
+        amounts = {}
+        for k, source in (
+            MappedBudgetItem.objects.filter(budget=self)
+            .order_by("source_classifications__item_order", "source_classifications")
+            .values_list("classification", "source_classifications")
+        ):
+            amounts[k] = amounts.get(k, 0) + (source_amounts.get(source, 0.0) if source is not None else 0)
+        return amounts
 
     def bulk_create(self, data):
         qs = MappedBudgetItem.objects.filter(budget=self)
@@ -386,6 +614,40 @@ class BudgetItemBase(PolymorphicModel):
 
     class Meta:
         unique_together = ("budget", "classification")
+        indexes = [
+            models.Index(fields=["budget", "created_at", "id"]),
+        ]
+
+    @classmethod
+    def bulk_insert(cls, items: list, batch_size: int = 1000) -> list:
+        # QuerySet.bulk_create refuses multi-table inherited models, so insert the parent rows with bulk_create and
+        # the rows of the concrete subclass table with plain multi-row INSERTs.
+        if len(items) == 0:
+            return items
+        model = type(items[0])
+        ctype = ContentType.objects.get_for_model(model)
+        parent_fields = BudgetItemBase._meta.concrete_fields
+        parents = []
+        for item in items:
+            if not item.id:
+                item.id = shortuuid.uuid()
+            item.polymorphic_ctype = ctype
+            setattr(item, model._meta.pk.attname, item.id)
+            parents.append(BudgetItemBase(**{f.attname: getattr(item, f.attname) for f in parent_fields}))
+        BudgetItemBase.objects.bulk_create(parents, batch_size=batch_size)
+        fields = model._meta.local_concrete_fields
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = ", ".join(connection.ops.quote_name(f.column) for f in fields)
+        placeholder = "(" + ", ".join(["%s"] * len(fields)) + ")"
+        with connection.cursor() as cursor:
+            for start in range(0, len(items), batch_size):
+                stop = start + batch_size
+                batch = items[start:stop]
+                cursor.execute(
+                    f"INSERT INTO {table} ({columns}) VALUES {', '.join([placeholder] * len(batch))}",
+                    [f.get_db_prep_save(getattr(item, f.attname), connection) for item in batch for f in fields],
+                )
+        return items
 
     def clean(self) -> None:
         if self.budget.classification_system != self.classification.classification_system:
@@ -410,7 +672,9 @@ class MappedBudgetItem(BudgetItemBase):
 
     @property
     def amount(self) -> float:
-        return sum(self.budget.source_budget.get_amount_of(c) for c in self.source_classifications.all())
+        # float sums depend on their order, so add the sources up in item order rather than in link row order
+        sources = sorted(self.source_classifications.all(), key=lambda c: (c.item_order, c.id))
+        return sum(self.budget.source_budget.get_amount_of(c) for c in sources)
 
 
 class Blob(models.Model):
@@ -449,6 +713,12 @@ class BlobReader(BufferedIOBase):
         self._buffer = b""
         self._gen = self._next()
 
+    def readable(self) -> bool:
+        return True
+
+    def read1(self, size: int = -1) -> bytes:
+        return self.read(size)
+
     def _next(self) -> BlobChunk:
         for d in self._fp:
             yield d
@@ -497,6 +767,81 @@ class WdmmgTreeCache(models.Model):
         return None
 
 
+class ExportCache(models.Model):
+    id = PkField()
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE, db_index=False, null=False)
+    budget = models.ForeignKey(BudgetBase, on_delete=models.CASCADE, db_index=True, null=False)
+    format = models.CharField(max_length=16, null=False)
+    # the last update of the budget (and of its mapped budgets) the export was written from
+    version = models.DateTimeField(null=False)
+    created_at = CurrentDateTimeField()
+    updated_at = AutoUpdateCurrentDateTimeField()
+
+    class Meta:
+        unique_together = ("budget", "format")
+
+    @classmethod
+    def cache_export(cls, data: RawIOBase, budget, format: str, version):
+        blob = Blob.write(data, name=budget.name)
+        with transaction.atomic():
+            cache = cls.objects.select_for_update().filter(budget=budget, format=format).first()
+            if cache is None:
+                try:
+                    with transaction.atomic():
+                        return cls.objects.create(budget=budget, format=format, blob=blob, version=version)
+                except IntegrityError:
+                    # a concurrent export of the same budget inserted the row first; overwrite it instead
+                    cache = cls.objects.select_for_update().get(budget=budget, format=format)
+            old_blob_id = cache.blob_id
+            cache.blob = blob
+            cache.version = version
+            cache.save()
+            if old_blob_id is not None:
+                Blob.objects.filter(id=old_blob_id).delete()
+        return cache
+
+    @classmethod
+    def get_or_none(cls, budget, format: str, version):
+        cache = cls.objects.select_related("blob").filter(budget=budget, format=format).first()
+        if cache is not None and cache.version == version:
+            return cache
+        return None
+
+
+class ClassificationAmount(models.Model):
+    """The subtree total of every classification of a budget, stored with its path of codes so that the same node can
+    be looked up across budgets with one query. The row without classification holds the total of the budget."""
+
+    id = PkField()
+    budget = models.ForeignKey(BudgetBase, on_delete=models.CASCADE, db_index=False, null=False)
+    classification = models.ForeignKey(Classification, on_delete=models.CASCADE, db_index=True, null=True)
+    path = ArrayField(models.CharField(max_length=64, null=True))
+    # the depth of the classification (0 for the roots, None for the total of the budget)
+    level = models.PositiveSmallIntegerField(null=True)
+    child_count = models.PositiveIntegerField(null=False, default=0)
+    amount = BudgetAmountField()
+    # the updated_at of the budget the amounts were computed from
+    version = models.DateTimeField(null=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["budget", "path"]),
+            models.Index(fields=["budget", "level", "-amount"], name="budgetmapper_amount_level"),
+            models.Index(
+                fields=["budget", "-amount"],
+                name="budgetmapper_amount_leaf",
+                condition=models.Q(child_count=0, level__isnull=False),
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["budget", "classification"], name="budgetmapper_amount_unique"),
+            # NULLs are distinct in the constraint above, so the total of the budget needs its own
+            models.UniqueConstraint(
+                fields=["budget"], condition=models.Q(classification=None), name="budgetmapper_amount_unique_total"
+            ),
+        ]
+
+
 class DefaultBudget(models.Model):
     id = PkField()
     government = models.OneToOneField(Government, on_delete=models.CASCADE, db_index=True, null=False, unique=True)
@@ -505,57 +850,148 @@ class DefaultBudget(models.Model):
     updated_at = AutoUpdateCurrentDateTimeField()
 
     def save(self, *args, **kwargs):
-        if self.budget.government.id != self.government.id:
+        if self.budget.government_value_id != self.government_id:
             raise ValidationError("A budget must blongs to specified government.")
 
         super(DefaultBudget, self).save(*args, **kwargs)
 
 
+class JobStatusField(models.CharField):
+    def __init__(self, *args, **kwargs):
+        super(JobStatusField, self).__init__(
+            *args,
+            **dict(
+                kwargs,
+                max_length=16,
+                choices=(
+                    ("queued", "queued"),
+                    ("running", "running"),
+                    ("succeeded", "succeeded"),
+                    ("failed", "failed"),
+                ),
+                default="queued",
+                null=False,
+            ),
+        )
+
+
+class Job(models.Model):
+    id = PkField()
+    kind = models.CharField(max_length=64, null=False)
+    status = JobStatusField()
+    payload = models.JSONField(default=dict)
+    result = models.JSONField(null=True)
+    error = models.TextField(null=True)
+    progress = models.FloatField(default=0.0, validators=[MinValueValidator(0.0), MaxValueValidator(1.0)])
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    created_at = CurrentDateTimeField()
+    updated_at = AutoUpdateCurrentDateTimeField()
+
+    def set_progress(self, progress: float) -> None:
+        """Records ``progress`` so that pollers see it at once, even from inside the transaction of the job.
+
+        In a transaction the update would stay invisible until it commits, so it is written on a separate connection
+        instead, and skipped if the row is locked (e.g. by the enclosing transaction itself) rather than waited for.
+        """
+        self.progress = progress
+        if not connection.in_atomic_block:
+            Job.objects.filter(pk=self.pk).update(progress=progress, updated_at=timezone.now())
+            return
+        progress_connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            with progress_connection.cursor() as cursor:
+                table = progress_connection.ops.quote_name(Job._meta.db_table)
+                cursor.execute(
+                    f"UPDATE {table} SET progress = %s, updated_at = %s"
+                    f" WHERE id IN (SELECT id FROM {table} WHERE id = %s FOR UPDATE SKIP LOCKED)",
+                    [progress, timezone.now(), self.pk],
+                )
+        finally:
+            progress_connection.close()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+        ]
+
+
+touch_suspended = ContextVar("touch_suspended", default=False)
+
+
+@contextmanager
+def suspend_touch():
+    # Bulk loaders delete and rewrite many rows at once; they touch the affected objects once afterwards instead of
+    # letting the receivers below save the budgets for every single row.
+    token = touch_suspended.set(True)
+    try:
+        yield
+    finally:
+        touch_suspended.reset(token)
+
+
 @receiver(post_save, sender=AtomicBudgetItem)
 def touch_budget_on_save_atomic_budget_item(sender, instance=None, **kwargs):
-    if instance is not None:
+    if instance is not None and not touch_suspended.get():
         instance.budget.save()
 
 
 @receiver(post_delete, sender=AtomicBudgetItem)
 def touch_budget_on_delete_atomic_budget_item(sender, instance=None, **kwargs):
-    if instance is not None:
+    if instance is not None and not touch_suspended.get():
         instance.budget.save()
 
 
 @receiver(post_save, sender=MappedBudgetItem)
 def touch_budget_on_save_mapped_budget_item(sender, instance=None, **kwargs):
-    if instance is not None:
+    if instance is not None and not touch_suspended.get():
         instance.budget.save()
 
 
 @receiver(post_delete, sender=MappedBudgetItem)
 def touch_budget_on_delete_mapped_budget_item(sender, instance=None, **kwargs):
-    if instance is not None:
+    if instance is not None and not touch_suspended.get():
         instance.budget.save()
 
 
 @receiver(post_save, sender=ClassificationSystem)
 def touch_budget_on_classification_system_save(sender, instance=None, **kwargs):
-    if instance is not None:
+    if instance is not None and not touch_suspended.get():
         for budget in BudgetBase.objects.filter(classification_system=instance):
             budget.save()
 
 
 @receiver(post_save, sender=Classification)
 def touch_classification_system_on_classification_save(sender, instance=None, **kwargs):
-    if instance is not None:
+    if instance is not None and not touch_suspended.get():
         instance.classification_system.save()
 
 
 @receiver(post_delete, sender=Classification)
 def touch_classification_system_on_delete_classification(sender, instance=None, **kwargs):
-    if instance is not None:
+    if instance is not None and not touch_suspended.get():
         instance.classification_system.save()
 
 
+@receiver(post_save, sender=BasicBudget)
+@receiver(post_save, sender=MappedBudget)
+def sync_mapped_budget_year_and_government(sender, instance=None, **kwargs):
+    if instance is None:
+        return
+    ids = [instance.id]
+    while ids:
+        qs = MappedBudget.objects.filter(source_budget__in=ids).exclude(
+            year_value=instance.year_value, government_value=instance.government_value_id
+        )
+        ids = list(qs.values_list("id", flat=True))
+        if ids:
+            MappedBudget.objects.filter(pk__in=ids).update(
+                year_value=instance.year_value, government_value=instance.government_value_id
+            )
+
+
 @receiver(post_save, sender=BasicBudget)
 def touch_mapped_budget_on_budget_save(sender, instance=None, **kwargs):
-    if isinstance is not None:
+    if instance is not None and not touch_suspended.get():
         for budget in MappedBudget.objects.filter(source_budget=instance):
             budget.save()
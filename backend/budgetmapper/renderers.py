@@ -0,0 +1,65 @@
+import msgpack
+from djangorestframework_camel_case.render import CamelCaseJSONRenderer
+from djangorestframework_camel_case.settings import api_settings
+from djangorestframework_camel_case.util import camelize
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+
+
+def is_rows(value) -> bool:
+    return isinstance(value, list) and len(value) > 0 and all(isinstance(v, dict) for v in value)
+
+
+def flatten_tree(nodes: list, parent: int = None, rows: list = None) -> list:
+    """Lists the nodes in preorder with ``parent`` replaced by the index of the parent row."""
+    rows = [] if rows is None else rows
+    for node in nodes:
+        idx = len(rows)
+        rows.append(dict(((k, v) for k, v in node.items() if k != "children"), parent=parent))
+        if is_rows(node.get("children")):
+            flatten_tree(node["children"], idx, rows)
+    return rows
+
+
+def to_columns(rows: list) -> dict:
+    """Turns a list of objects into an object of parallel arrays.
+
+    >>> to_columns([{"id": "a", "parent": None}, {"id": "b", "parent": 0}])
+    {'id': ['a', 'b'], 'parent': [None, 0]}
+    """
+    if any(isinstance(row.get("children"), list) for row in rows):
+        rows = flatten_tree(rows)
+    keys = list(dict.fromkeys(k for row in rows for k in row.keys()))
+    return {k: [row.get(k) for row in rows] for k in keys}
+
+
+def to_columnar(data):
+    if isinstance(data, list):
+        return to_columns(data) if is_rows(data) else data
+    if isinstance(data, dict):
+        return {k: to_columns(v) if is_rows(v) else v for k, v in data.items()}
+    return data
+
+
+class ColumnarJSONRenderer(CamelCaseJSONRenderer):
+    """Renders lists of objects (top-level or one level down, e.g. ``results``, ``items`` and the wdmmg ``budgets``)
+    as parallel arrays; trees are flattened in preorder with ``parent`` holding the index of the parent row."""
+
+    media_type = "application/vnd.openspending.columnar+json"
+    format = "columnar"
+
+    def render(self, data, *args, **kwargs):
+        return super(ColumnarJSONRenderer, self).render(to_columnar(data), *args, **kwargs)
+
+
+class CamelCaseMessagePackRenderer(BaseRenderer):
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        # values msgpack does not know (dates, decimals, lazy strings, ...) are encoded as in JSON
+        return msgpack.packb(camelize(data, **api_settings.JSON_UNDERSCOREIZE), default=encoders.JSONEncoder().default)
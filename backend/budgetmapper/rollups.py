@@ -0,0 +1,174 @@
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+
+from . import models
+
+
+def rollup(parents: np.ndarray, depths: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Returns ``values`` with every row replaced by the sum of itself and the rows of its descendants.
+
+    ``parents`` holds the index of the parent row of each row (-1 for the roots) and ``depths`` its depth (0 for the
+    roots). The rows of one depth are added to their parents at once, deepest first, for all columns together.
+
+    >>> values = np.array([[0.0, 1.0], [0.0, 0.0], [2.0, 0.0], [3.0, 4.0]])
+    >>> rollup(np.array([-1, 0, 0, 1]), np.array([0, 1, 1, 2]), values)
+    array([[5., 5.],
+           [3., 4.],
+           [2., 0.],
+           [3., 4.]])
+    """
+    totals = values.copy()
+    for depth in range(int(depths.max(initial=0)), 0, -1):
+        rows = np.flatnonzero(depths == depth)
+        np.add.at(totals, parents[rows], totals[rows])
+    return totals
+
+
+def _item_amounts(budgets: list) -> list:
+    """The item amounts of each budget keyed by classification id, with one query for all the basic budgets."""
+    basic = [b.id for b in budgets if isinstance(b, models.BasicBudget)]
+    amounts = defaultdict(dict)
+    for budget_id, classification_id, value in models.AtomicBudgetItem.objects.filter(budget__in=basic).values_list(
+        "budget", "classification", "value"
+    ):
+        amounts[budget_id][classification_id] = float(value)
+    return [amounts[b.id] if isinstance(b, models.BasicBudget) else b.get_item_amounts() for b in budgets]
+
+
+def compare_budgets(budgets: list) -> dict:
+    """Aligns ``budgets`` node by node and returns the subtree total of every node in every budget.
+
+    Budgets of one classification system are aligned on the classification; otherwise the nodes are matched by their
+    path of codes from the root, and a node missing from a budget counts as 0 there. ``nodes`` lists the union of the
+    trees in preorder, with ``parent`` holding the index of the parent node, ``amounts`` the totals in the order of
+    ``budgets`` and ``deltas`` their differences from the first budget.
+    """
+    system_ids = list(dict.fromkeys(b.classification_system_id for b in budgets))
+    by_classification = len(system_ids) == 1
+    tree = defaultdict(list)
+    for c in (
+        models.Classification.objects.filter(classification_system__in=system_ids)
+        .order_by("item_order")
+        .values_list("id", "classification_system", "parent", "code", "name", named=True)
+    ):
+        tree[(c.classification_system, c.parent)].append(c)
+    # the union of the trees, keyed by classification id or by path of codes
+    children = defaultdict(dict)
+    nodes = {}
+    keys = {}
+    for system_id in system_ids:
+        stack = [(c, None) for c in reversed(tree[(system_id, None)])]
+        while len(stack) > 0:
+            c, parent_key = stack.pop()
+            key = c.id if by_classification else (parent_key or ()) + (c.code,)
+            keys[c.id] = key
+            if key not in nodes:
+                nodes[key] = {"id": c.id if by_classification else None, "code": c.code, "name": c.name}
+                children[parent_key][key] = None
+            stack.extend((d, key) for d in reversed(tree[(system_id, c.id)]))
+
+    # number the union of the trees in preorder
+    rows = []
+    stack = [(key, -1, 0) for key in reversed(children[None])]
+    while len(stack) > 0:
+        key, parent, depth = stack.pop()
+        nodes[key]["index"] = len(rows)
+        rows.append((key, parent, depth))
+        stack.extend((k, nodes[key]["index"], depth + 1) for k in reversed(children[key]))
+
+    parents = np.array([r[1] for r in rows], dtype=np.int64)
+    depths = np.array([r[2] for r in rows], dtype=np.int64)
+    values = np.zeros((len(rows), len(budgets)))
+    for j, amounts in enumerate(_item_amounts(budgets)):
+        for classification_id, amount in amounts.items():
+            values[nodes[keys[classification_id]]["index"], j] += amount
+    totals = rollup(parents, depths, values)
+    deltas = totals - totals[:, :1]
+    roots = depths == 0
+    return {
+        "aligned_on": "classification" if by_classification else "code",
+        "total_amounts": totals[roots].sum(axis=0).tolist(),
+        "nodes": [
+            dict(
+                id=nodes[key]["id"],
+                code=nodes[key]["code"],
+                name=nodes[key]["name"],
+                parent=parent if parent >= 0 else None,
+                amounts=amounts,
+                deltas=d,
+            )
+            for (key, parent, _), amounts, d in zip(rows, totals.tolist(), deltas.tolist())
+        ],
+    }
+
+
+def get_classification_amounts(budget: models.BudgetBase):
+    """The stored amounts of ``budget``.
+
+    They are only ever written by the ``rebuild_wdmmg_cache`` job queued when the budget changes, so they may lag
+    behind it for a while; see :func:`amounts_are_stale`.
+    """
+    return models.ClassificationAmount.objects.filter(budget=budget)
+
+
+def amounts_are_stale(budget: models.BudgetBase) -> bool:
+    """Whether the stored amounts of ``budget`` are missing or older than its last update."""
+    version = (
+        models.ClassificationAmount.objects.filter(budget=budget, classification=None)
+        .values_list("version", flat=True)
+        .first()
+    )
+    return version != budget.updated_at
+
+
+def refresh_classification_amounts(budget: models.BudgetBase) -> int:
+    """Replaces the stored :class:`~budgetmapper.models.ClassificationAmount` rows of ``budget`` and returns their
+    number.
+
+    The budget row is locked first, so concurrent refreshes of one budget run one after the other; the later ones
+    find the rows written by the first up to date and leave them alone.
+    """
+    with transaction.atomic():
+        version = (
+            models.BudgetBase.objects.non_polymorphic()
+            .select_for_update()
+            .values_list("updated_at", flat=True)
+            .get(pk=budget.pk)
+        )
+        stored = models.ClassificationAmount.objects.filter(budget=budget)
+        if stored.filter(classification=None, version=version).exists():
+            return stored.count()
+        children = budget.classification_system.get_children_map()
+        amounts = budget.get_amounts(children)
+        rows = [
+            models.ClassificationAmount(
+                budget=budget,
+                classification=None,
+                path=[],
+                level=None,
+                child_count=len(children.get(None, ())),
+                amount=sum(amounts[c.id] for c in children.get(None, ())),
+                version=version,
+            )
+        ]
+        stack = [(c, []) for c in reversed(children.get(None, ()))]
+        while len(stack) > 0:
+            c, parent_path = stack.pop()
+            path = parent_path + [c.code]
+            rows.append(
+                models.ClassificationAmount(
+                    budget=budget,
+                    classification_id=c.id,
+                    path=path,
+                    level=len(parent_path),
+                    child_count=len(children.get(c.id, ())),
+                    amount=amounts[c.id],
+                    version=version,
+                )
+            )
+            stack.extend((d, path) for d in reversed(children.get(c.id, ())))
+        stored.delete()
+        models.ClassificationAmount.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -1,5 +1,7 @@
 from django.db import IntegrityError
+from django.db.models import F
 from rest_framework import serializers, status
+from rest_framework.exceptions import NotFound
 from rest_framework.views import Response, exception_handler
 
 from . import models
@@ -82,6 +84,10 @@ class ClassificationSerializer(serializers.ModelSerializer):
         fields = ("id", "code", "name", "icon", "classification_system", "parent", "created_at", "updated_at")
 
 
+class ClassificationBulkCreateResponseSerializer(serializers.Serializer):
+    results = ClassificationSerializer(many=True)
+
+
 class ClassificationListItemSerializer(serializers.ModelSerializer):
     classification_system = ClassificationSystemSerializer()
 
@@ -90,12 +96,33 @@ class ClassificationListItemSerializer(serializers.ModelSerializer):
         fields = ("id", "code", "name", "icon", "classification_system", "parent", "created_at", "updated_at")
 
 
+class ClassificationSearchResultSerializer(serializers.ModelSerializer):
+    classification_system = ClassificationSystemSerializer()
+
+    class Meta:
+        model = models.Classification
+        fields = ("id", "code", "name", "reading", "classification_system", "parent")
+
+
 class ClassificationSummarySerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Classification
         fields = ("id", "name", "code")
 
 
+class ClassificationAmountSerializer(serializers.ModelSerializer):
+    code = serializers.CharField(source="classification.code", read_only=True)
+    name = serializers.CharField(source="classification.name", read_only=True)
+    is_leaf = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.ClassificationAmount
+        fields = ("classification", "code", "name", "path", "level", "child_count", "is_leaf", "amount")
+
+    def get_is_leaf(self, obj):
+        return obj.child_count == 0
+
+
 class BudgetItemSerializer(serializers.ModelSerializer):
     classification = ClassificationSummarySerializer()
 
@@ -105,14 +132,8 @@ class BudgetItemSerializer(serializers.ModelSerializer):
 
 
 class BasicBudgetSerializer(serializers.ModelSerializer):
-    government = serializers.SerializerMethodField()
-    year = serializers.SerializerMethodField()
-
-    def get_year(self, obj: models.BudgetBase):
-        return obj.year
-
-    def get_government(self, obj: models.BudgetBase):
-        return obj.government.id
+    government = serializers.CharField(source="government_value_id", read_only=True)
+    year = serializers.IntegerField(source="year_value", read_only=True)
 
     class Meta:
         model = models.BasicBudget
@@ -130,14 +151,10 @@ class BasicBudgetSerializer(serializers.ModelSerializer):
 
 
 class BudgetListSerializer(serializers.ModelSerializer):
-    government = serializers.SerializerMethodField()
-    year = serializers.SerializerMethodField()
-
-    def get_year(self, obj: models.BudgetBase):
-        return obj.year
-
-    def get_government(self, obj: models.BudgetBase):
-        return obj.government.id
+    government = serializers.CharField(source="government_value_id", read_only=True)
+    year = serializers.IntegerField(source="year_value", read_only=True)
+    # a field of MappedBudget or an annotation on the flat list queryset; left out for basic budgets
+    source_budget = serializers.CharField(source="source_budget_id", read_only=True, default=None)
 
     class Meta:
         model = models.BudgetBase
@@ -149,16 +166,16 @@ class BudgetListSerializer(serializers.ModelSerializer):
             "subtitle",
             "classification_system",
             "government",
+            "source_budget",
             "created_at",
             "updated_at",
         )
 
     def to_representation(self, instance: models.BudgetBase):
-        if isinstance(instance, models.MappedBudget):
-            return dict(
-                super(BudgetListSerializer, self).to_representation(instance), source_budget=instance.source_budget.id
-            )
-        return super(BudgetListSerializer, self).to_representation(instance)
+        data = super(BudgetListSerializer, self).to_representation(instance)
+        if data.get("source_budget", "") is None:
+            del data["source_budget"]
+        return data
 
 
 class BasicBudgetRetrieveSerializer(serializers.ModelSerializer):
@@ -257,19 +274,13 @@ class BasicBudgetCreateUpdateSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         return dict(
             super(BasicBudgetCreateUpdateSerializer, self).to_representation(instance),
-            government=instance.government.id,
+            government=instance.government_value_id,
         )
 
 
 class MappedBudgetSerializer(serializers.ModelSerializer):
-    government = serializers.SerializerMethodField()
-    year = serializers.SerializerMethodField()
-
-    def get_year(self, obj: models.BudgetBase):
-        return obj.year
-
-    def get_government(self, obj: models.BudgetBase):
-        return obj.government.id
+    government = serializers.CharField(source="government_value_id", read_only=True)
+    year = serializers.IntegerField(source="year_value", read_only=True)
 
     class Meta:
         model = models.MappedBudget
@@ -336,7 +347,32 @@ class AtomicBudgetItemCreateUpdateSerializer(serializers.ModelSerializer):
         fields = ("id", "budget", "classification", "value", "created_at", "updated_at")
 
 
+def in_item_order(classifications) -> list:
+    return sorted(classifications, key=lambda c: (c.item_order, c.id))
+
+
+class SourceClassificationIdsField(serializers.ManyRelatedField):
+    """The ids of the source classifications in item order, whether they were prefetched or not."""
+
+    def __init__(self, **kwargs):
+        read_only = kwargs.get("read_only", False)
+        child = serializers.PrimaryKeyRelatedField(
+            read_only=read_only, **({} if read_only else {"queryset": models.Classification.objects.all()})
+        )
+        super(SourceClassificationIdsField, self).__init__(child_relation=child, **kwargs)
+
+    def get_attribute(self, instance):
+        return in_item_order(super(SourceClassificationIdsField, self).get_attribute(instance))
+
+
+class SourceClassificationListSerializer(serializers.ListSerializer):
+    def get_attribute(self, instance):
+        return in_item_order(super(SourceClassificationListSerializer, self).get_attribute(instance).all())
+
+
 class MappedBudgetItemListSerializer(serializers.ModelSerializer):
+    source_classifications = SourceClassificationIdsField(read_only=True)
+
     class Meta:
         model = models.MappedBudgetItem
         fields = (
@@ -355,7 +391,7 @@ class MappedBudgetBulkCreateResponseSerializer(serializers.Serializer):
 
 class MappedBudgetItemRetrieveSerializer(serializers.ModelSerializer):
     classification = ClassificationSerializer()
-    source_classifications = ClassificationSerializer(many=True)
+    source_classifications = SourceClassificationListSerializer(child=ClassificationSerializer())
     budget = MappedBudgetSerializer()
 
     class Meta:
@@ -371,6 +407,8 @@ class MappedBudgetItemRetrieveSerializer(serializers.ModelSerializer):
 
 
 class MappedBudgetItemCreateUpdateSerializer(serializers.ModelSerializer):
+    source_classifications = SourceClassificationIdsField()
+
     class Meta:
         model = models.MappedBudgetItem
         fields = (
@@ -407,6 +445,32 @@ class WdmmgNodeSerializer(serializers.ModelSerializer):
         return dict(super().to_representation(instance), amount=amount, children=children)
 
 
+def find_node(nodes: list, node_id: str):
+    stack = list(nodes)
+    while len(stack) > 0:
+        node = stack.pop()
+        if node["id"] == node_id:
+            return node
+        stack.extend(node["children"] or [])
+    return None
+
+
+def truncate_tree(nodes: list, depth: int = None) -> list:
+    """Drops the nodes deeper than ``depth`` levels; the nodes whose children were dropped keep their amount and get
+    ``child_count`` so that the client can fetch them with ``?root=``."""
+    if depth is None:
+        return nodes
+    res = []
+    for node in nodes:
+        if node["children"] is None:
+            res.append(node)
+        elif depth <= 1:
+            res.append(dict(node, children=None, child_count=len(node["children"])))
+        else:
+            res.append(dict(node, children=truncate_tree(node["children"], depth - 1)))
+    return res
+
+
 class WdmmgSerializer(serializers.ModelSerializer):
     government = GovernmentSerializer()
     budgets = serializers.SerializerMethodField()
@@ -428,9 +492,9 @@ class WdmmgSerializer(serializers.ModelSerializer):
         )
 
     def get_total_amount(self, obj: models.BudgetBase):
-        return sum((d["amount"] for d in self.get_budgets(obj)))
+        return sum((d["amount"] for d in self.get_nodes(obj)))
 
-    def get_budgets(self, obj: models.BudgetBase):
+    def get_tree(self, obj: models.BudgetBase) -> list:
         res = models.WdmmgTreeCache.get_or_none(obj)
         if res is None:
             res = [
@@ -439,6 +503,22 @@ class WdmmgSerializer(serializers.ModelSerializer):
             models.WdmmgTreeCache.cache_tree(res, obj)
         return res
 
+    def get_nodes(self, obj: models.BudgetBase) -> list:
+        """The top nodes of the response: the roots, or the children of the ``root`` given in the context."""
+        if getattr(self, "_nodes", None) is None or self._nodes[0] != obj.pk:
+            nodes = self.get_tree(obj)
+            root = self.context.get("root")
+            if root is not None:
+                node = find_node(nodes, root)
+                if node is None:
+                    raise NotFound(f"classification {root} not found in the budget")
+                nodes = node["children"] or []
+            self._nodes = (obj.pk, nodes)
+        return self._nodes[1]
+
+    def get_budgets(self, obj: models.BudgetBase):
+        return truncate_tree(self.get_nodes(obj), self.context.get("depth"))
+
     def to_representation(self, instance):
         if isinstance(instance, models.MappedBudget):
             return dict(
@@ -469,16 +549,33 @@ class GovernmentBudgetListSerializer(serializers.ModelSerializer):
         fields = ("budgets", "default_budget")
 
     def get_budgets(self, obj: models.Government):
-        basic_budgets = obj.basicbudget_set.all().prefetch_related("mapped_budget")
-        basic_budget_list = list(basic_budgets)
-        mapped_budget_list = [
-            mapped_budget for basic_budget in basic_budget_list for mapped_budget in basic_budget.mapped_budget.all()
-        ]
-
-        return BudgetListSerializer(basic_budget_list + mapped_budget_list, many=True).data
+        # basic budgets first, then the mapped budgets in the order of their source budgets
+        budgets = (
+            models.BudgetBase.flat_objects()
+            .filter(government_value=obj)
+            .order_by(F("mappedbudget__source_budget__created_at").asc(nulls_first=True), "created_at", "id")
+        )
+        return BudgetListSerializer(budgets, many=True).data
 
     def get_default_budget(self, obj: models.Government):
-        try:
-            return BudgetListSerializer(obj.defaultbudget.budget).data
-        except models.Government.defaultbudget.RelatedObjectDoesNotExist:
+        budget = models.BudgetBase.flat_objects().filter(defaultbudget__government=obj).first()
+        if budget is None:
             return None
+        return BudgetListSerializer(budget).data
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Job
+        fields = (
+            "id",
+            "kind",
+            "status",
+            "progress",
+            "result",
+            "error",
+            "started_at",
+            "finished_at",
+            "created_at",
+            "updated_at",
+        )
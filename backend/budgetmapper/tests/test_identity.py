@@ -0,0 +1,53 @@
+from budgetmapper import models
+from budgetmapper.identity import IdentityMap, identity_map
+from django.test import RequestFactory, TestCase
+
+from . import factories
+
+
+class IdentityMapTestCase(TestCase):
+    def test_get_loads_once(self):
+        gov = factories.GovernmentFactory()
+        sut = IdentityMap()
+        with self.assertNumQueries(1):
+            first = sut.get(models.Government, gov.id)
+            second = sut.get(models.Government, gov.id)
+        self.assertIs(first, second)
+
+    def test_get_raises_for_missing_object(self):
+        with self.assertRaises(models.Government.DoesNotExist):
+            IdentityMap().get(models.Government, "missing")
+
+    def test_subclass_is_found_through_base_model(self):
+        bud = factories.BasicBudgetFactory()
+        sut = IdentityMap()
+        sut.add(models.BasicBudget.objects.get(pk=bud.id))
+        with self.assertNumQueries(0):
+            self.assertIsInstance(sut.get(models.BudgetBase, bud.id), models.BasicBudget)
+
+    def test_base_instance_is_upgraded_on_demand(self):
+        bud = factories.MappedBudgetFactory()
+        sut = IdentityMap()
+        base = sut.get(
+            models.BudgetBase, bud.id, queryset=models.BudgetBase.objects.non_polymorphic(), real_instance=False
+        )
+        self.assertIs(type(base), models.BudgetBase)
+        with self.assertNumQueries(1):
+            self.assertIsInstance(sut.get(models.BudgetBase, bud.id), models.MappedBudget)
+        with self.assertNumQueries(0):
+            self.assertIsInstance(sut.get(models.BudgetBase, bud.id), models.MappedBudget)
+
+    def test_prime_shares_related_objects(self):
+        gov = factories.GovernmentFactory()
+        bud1 = models.BudgetBase.objects.get(pk=factories.BasicBudgetFactory(government_value=gov).id)
+        bud2 = models.BudgetBase.objects.get(pk=factories.BasicBudgetFactory(government_value=gov).id)
+        sut = IdentityMap()
+        with self.assertNumQueries(1):
+            sut.prime(bud1, "government_value")
+            sut.prime(bud2, "government_value")
+            self.assertIs(bud1.government, bud2.government)
+
+    def test_identity_map_is_kept_on_request(self):
+        request = RequestFactory().get("/")
+        self.assertIs(identity_map(request), identity_map(request))
+        self.assertIsNot(identity_map(request), identity_map(RequestFactory().get("/")))
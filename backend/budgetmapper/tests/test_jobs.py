@@ -0,0 +1,135 @@
+import io
+from datetime import timedelta
+from unittest.mock import patch
+
+from budgetmapper import jobs, models
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import factories
+from .test_loaders import make_rows, make_spec
+
+
+class JobTestCase(TestCase):
+    def test_enqueue_rejects_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue("no-such-job", {})
+
+    def test_run_next_job_returns_none_for_empty_queue(self):
+        self.assertIsNone(jobs.run_next_job())
+
+    def test_jobs_run_in_order(self):
+        budget = factories.BasicBudgetFactory()
+        job1 = jobs.enqueue("rebuild_wdmmg_cache", {"budget": budget.id})
+        job2 = jobs.enqueue("rebuild_wdmmg_cache", {"budget": "missing"})
+        self.assertEqual(job1.status, "queued")
+
+        self.assertEqual(jobs.run_next_job().id, job1.id)
+        job1.refresh_from_db()
+        self.assertEqual(job1.status, "succeeded")
+        self.assertEqual(job1.progress, 1.0)
+        self.assertEqual(job1.result, {"budget": budget.id})
+        self.assertIsNotNone(job1.started_at)
+        self.assertIsNotNone(job1.finished_at)
+        self.assertIsNotNone(models.WdmmgTreeCache.objects.get(budget=budget))
+        self.assertTrue(models.ClassificationAmount.objects.filter(budget=budget, classification=None).exists())
+
+        self.assertEqual(jobs.run_next_job().id, job2.id)
+        job2.refresh_from_db()
+        self.assertEqual(job2.status, "failed")
+        self.assertIn("DoesNotExist", job2.error)
+
+    def test_budget_import_job(self):
+        cofog = factories.ClassificationSystemFactory(slug="cofog")
+        cofog1 = factories.ClassificationFactory(classification_system=cofog, code="1")
+        factories.ClassificationFactory(classification_system=cofog, code="1.1", parent=cofog1)
+        factories.ClassificationFactory(classification_system=cofog, code="1.2", parent=cofog1)
+        rows = make_rows()
+        data = ("\n".join([",".join(rows[0])] + [",".join(d.values()) for d in rows]) + "\n").encode("utf-8")
+        job = jobs.enqueue_budget_import(make_spec(), data)
+        progress = []
+        with patch.object(models.Job, "set_progress", autospec=True, side_effect=lambda _, p: progress.append(p)):
+            jobs.run_next_job()
+        job.refresh_from_db()
+        self.assertEqual(job.status, "succeeded", job.error)
+        self.assertEqual(job.result["atomic_budget_items"]["inserted"], 4)
+        self.assertEqual(progress, [0.3, 0.9])
+        self.assertFalse(models.Blob.objects.filter(pk=job.payload["blob"]).exists())
+        self.assertEqual(
+            sorted(models.Job.objects.filter(kind="rebuild_wdmmg_cache").values_list("payload__budget", flat=True)),
+            sorted(models.BudgetBase.objects.values_list("id", flat=True)),
+        )
+
+    @override_settings(JOB_STALE_TIMEOUT=60)
+    def test_claim_next_job_reclaims_abandoned_jobs(self):
+        budget = factories.BasicBudgetFactory()
+        abandoned = jobs.enqueue("rebuild_wdmmg_cache", {"budget": budget.id})
+        running = jobs.enqueue("rebuild_wdmmg_cache", {"budget": budget.id})
+        models.Job.objects.filter(pk=abandoned.pk).update(
+            status="running", updated_at=timezone.now() - timedelta(seconds=61)
+        )
+        models.Job.objects.filter(pk=running.pk).update(status="running", updated_at=timezone.now())
+        with self.assertLogs("budgetmapper.jobs", "WARNING"):
+            self.assertEqual(jobs.claim_next_job().id, abandoned.id)
+        self.assertIsNone(jobs.claim_next_job())
+
+    def test_budget_changes_queue_one_rebuild_once_committed(self):
+        cl = factories.ClassificationFactory()
+        budget = factories.BasicBudgetFactory(classification_system=cl.classification_system)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            factories.AtomicBudgetItemFactory(budget=budget, classification=cl, value=3)
+            factories.AtomicBudgetItemFactory(
+                budget=budget,
+                classification=factories.ClassificationFactory(classification_system=cl.classification_system),
+            )
+            self.assertFalse(models.Job.objects.exists())
+        self.assertGreater(len(callbacks), 1)
+        queued = models.Job.objects.filter(kind="rebuild_wdmmg_cache", status="queued")
+        self.assertEqual(list(queued.values_list("payload__budget", flat=True)), [budget.id])
+        jobs.run_next_job()
+        self.assertEqual(models.ClassificationAmount.objects.get(budget=budget, classification=cl).amount, 3.0)
+        # the job does not change the budget, so it queues nothing more
+        self.assertFalse(queued.exists())
+
+    def test_rebuild_wdmmg_caches_command(self):
+        budgets = [factories.BasicBudgetFactory() for _ in range(2)]
+        jobs.enqueue_wdmmg_cache_rebuild(budgets[0].id)
+        out = io.StringIO()
+        call_command("rebuild_wdmmg_caches", stdout=out)
+        self.assertIn("2 rebuild(s) queued", out.getvalue())
+        self.assertEqual(
+            sorted(models.Job.objects.filter(kind="rebuild_wdmmg_cache").values_list("payload__budget", flat=True)),
+            sorted(b.id for b in budgets),
+        )
+
+    def test_run_jobs_command(self):
+        budget = factories.BasicBudgetFactory()
+        jobs.enqueue("rebuild_wdmmg_cache", {"budget": budget.id})
+        jobs.enqueue("rebuild_wdmmg_cache", {"budget": budget.id})
+        out = io.StringIO()
+        # the worker recycles its connection between jobs, which would end the test transaction
+        with patch("budgetmapper.jobs.close_old_connections"):
+            call_command("run_jobs", "--once", "--concurrency", "1", stdout=out)
+        self.assertIn("2 job(s) done", out.getvalue())
+        self.assertEqual(models.Job.objects.filter(status="succeeded").count(), 2)
+
+
+class JobProgressTestCase(TransactionTestCase):
+    def test_progress_is_visible_before_the_transaction_of_the_job_commits(self):
+        job = jobs.enqueue("rebuild_wdmmg_cache", {"budget": "missing"})
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                job.set_progress(0.5)
+                raise RuntimeError
+        job.refresh_from_db()
+        self.assertEqual(job.progress, 0.5)
+
+    def test_progress_of_a_locked_job_is_skipped(self):
+        job = jobs.enqueue("rebuild_wdmmg_cache", {"budget": "missing"})
+        with transaction.atomic():
+            models.Job.objects.select_for_update().get(pk=job.pk)
+            job.set_progress(0.5)
+        job.refresh_from_db()
+        self.assertEqual(job.progress, 0.0)
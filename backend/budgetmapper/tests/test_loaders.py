@@ -0,0 +1,315 @@
+import csv
+import io
+import json
+import os
+import tempfile
+
+import openpyxl
+
+from budgetmapper import loaders, models
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from . import factories
+
+
+def make_spec(**kwargs):
+    return dict(
+        {
+            "government": {"slug": "mahoro-shi", "name": "まほろ市"},
+            "classification_system": {"slug": "mahoro-shi-2101", "name": "まほろ市2101年度予算"},
+            "budget": {"slug": "mahoro-shi-2101", "name": "まほろ市2101年度予算", "year": 2101},
+            "levels": ["款", "項"],
+            "name_suffix": "名称",
+            "amount": {"column": "予算額", "scale": 1000},
+            "cofog": {
+                "column": "COFOG",
+                "classification_system": "cofog",
+                "budget": {"slug": "mahoro-shi-cofog2101", "name": "まほろ市COFOG2101"},
+            },
+            "default_budget": "cofog",
+        },
+        **kwargs,
+    )
+
+
+def make_rows(n_kan=2, n_kou=2):
+    return [
+        {
+            "款": str(i),
+            "款名称": f"款{i}",
+            "項": str(j),
+            "項名称": f"項{i}-{j}",
+            "予算額": str(i * 10 + j),
+            "COFOG": "1.1" if i % 2 == 0 else "1.2",
+        }
+        for i in range(1, n_kan + 1)
+        for j in range(1, n_kou + 1)
+    ]
+
+
+class LoaderTestCase(TestCase):
+    def setUp(self):
+        self.cofog = factories.ClassificationSystemFactory(slug="cofog")
+        self.cofog1 = factories.ClassificationFactory(classification_system=self.cofog, code="1")
+        self.cofog11 = factories.ClassificationFactory(classification_system=self.cofog, code="1.1", parent=self.cofog1)
+        self.cofog12 = factories.ClassificationFactory(classification_system=self.cofog, code="1.2", parent=self.cofog1)
+
+    def test_read_spec_requires_keys(self):
+        with self.assertRaises(ValueError):
+            loaders.read_spec(io.StringIO(json.dumps({"levels": ["款"]})))
+        spec = make_spec()
+        self.assertEqual(loaders.read_spec(io.StringIO(json.dumps(spec))), spec)
+
+    def test_validate_spec_checks_nested_fields(self):
+        for spec, message in (
+            (make_spec(budget={"name": "x", "year": 2101}), "spec lacks budget.slug"),
+            (make_spec(budget={"slug": "x", "name": "x", "year": "2101"}), "spec.budget.year must be an integer"),
+            (make_spec(government="mahoro-shi"), "spec.government must be an object"),
+            (make_spec(classification_system={"slug": 1, "name": "x"}), "spec.classification_system.slug must be"),
+            (make_spec(cofog={"column": "COFOG", "budget": {"name": "x"}}), "spec lacks cofog.budget.slug"),
+            (make_spec(levels="款"), "spec.levels must be a list"),
+            (make_spec(levels=["款", 1]), "spec.levels must be a list of column names"),
+        ):
+            with self.subTest(message=message):
+                with self.assertRaisesRegex(ValueError, message):
+                    loaders.validate_spec(spec)
+
+    def test_parse_rows(self):
+        rows = make_rows(1, 2) + [{"款": "2", "款名称": "款2", "項": "", "項名称": "", "予算額": "5", "COFOG": ""}]
+        actual = loaders.parse_rows(make_spec(), rows)
+        k1, k2 = ("1", "款1"), ("2", "款2")
+        self.assertEqual(actual["nodes"], [(k1,), (k1, ("1", "項1-1")), (k1, ("2", "項1-2")), (k2,)])
+        self.assertEqual(actual["amounts"], {(k1, ("1", "項1-1")): 11000.0, (k1, ("2", "項1-2")): 12000.0, (k2,): 5000.0})
+        self.assertEqual(actual["mapping"], {"1.2": [(k1, ("1", "項1-1")), (k1, ("2", "項1-2"))]})
+
+    def test_parse_rows_reports_line_of_invalid_amount(self):
+        rows = make_rows(1, 2)
+        rows[1]["予算額"] = "abc"
+        with self.assertRaisesRegex(ValueError, "line 3"):
+            loaders.parse_rows(make_spec(), rows)
+
+    def test_parse_rows_collects_errors(self):
+        rows = make_rows(2, 2)
+        rows[1]["予算額"] = "abc"
+        rows[3]["款"] = rows[3]["款名称"] = ""
+        rows.append({"款": "", "款名称": "", "項": "", "項名称": "", "予算額": "", "COFOG": ""})
+        errors = []
+        actual = loaders.parse_rows(make_spec(), rows, errors=errors)
+        self.assertEqual(
+            errors,
+            [
+                {"row": 3, "column": "予算額", "message": "invalid amount 'abc'"},
+                {"row": 5, "column": "款", "message": "no classification"},
+            ],
+        )
+        self.assertEqual(len(actual["amounts"]), 2)
+
+    def test_read_xlsx(self):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(["款", "款名称", "項", "項名称", "金額"])
+        ws.append([1, "議会費", 1.0, "議会費", 100])
+        ws.append([1, "議会費", None, None, "abc"])
+        ws.append([None, None, None, None, None])
+        fp = io.BytesIO()
+        wb.save(fp)
+        fp.seek(0)
+        spec, rows = loaders.read_xlsx(fp, {k: v for k, v in make_spec().items() if k not in ("levels", "amount")})
+        self.assertEqual(spec["levels"], ["款", "項"])
+        self.assertEqual(spec["amount"], {"column": "金額"})
+        self.assertEqual(
+            list(rows),
+            [
+                {"款": "1", "款名称": "議会費", "項": "1", "項名称": "議会費", "金額": 100},
+                {"款": "1", "款名称": "議会費", "項": "", "項名称": "", "金額": "abc"},
+                {"款": "", "款名称": "", "項": "", "項名称": "", "金額": None},
+            ],
+        )
+
+    def test_read_xlsx_rejects_other_files(self):
+        with self.assertRaisesRegex(ValueError, "xlsx"):
+            loaders.read_xlsx(io.BytesIO("款,款名称\n".encode("utf-8")), make_spec())
+
+    def test_load_budget(self):
+        stats = loaders.load_budget(make_spec(), make_rows())
+        self.assertEqual(
+            stats,
+            {
+                "classifications": {"inserted": 6, "updated": 0, "deleted": 0},
+                "atomic_budget_items": {"inserted": 4, "updated": 0, "deleted": 0},
+                "mapped_budget_items": {"inserted": 2, "updated": 0, "deleted": 0},
+                "mapping_links": {"inserted": 4, "updated": 0, "deleted": 0},
+            },
+        )
+
+        budget = models.BasicBudget.objects.get(slug="mahoro-shi-2101")
+        self.assertEqual(budget.year, 2101)
+        self.assertEqual(budget.government.slug, "mahoro-shi")
+        self.assertEqual(budget.classification_system.level_names, ["款", "項"])
+        cls = list(models.Classification.objects.filter(classification_system=budget.classification_system))
+        self.assertEqual(
+            sorted((c.item_order, c.code, c.name, c.level) for c in cls),
+            [(0, "1", "款1", 0), (1, "1", "項1-1", 1), (2, "2", "項1-2", 1), (3, "2", "款2", 0)]
+            + [(4, "1", "項2-1", 1), (5, "2", "項2-2", 1)],
+        )
+        kan1 = models.Classification.objects.get(classification_system=budget.classification_system, name="款1")
+        self.assertEqual(budget.get_amount_of(kan1), 23000.0)
+        items = models.BudgetItemBase.objects.filter(budget=budget)
+        self.assertEqual(len(items), 4)
+        self.assertTrue(all(isinstance(d, models.AtomicBudgetItem) for d in items))
+
+        cofog_budget = models.MappedBudget.objects.get(slug="mahoro-shi-cofog2101")
+        self.assertEqual(cofog_budget.source_budget, budget)
+        self.assertEqual(models.DefaultBudget.objects.get(government=budget.government).budget, cofog_budget)
+        mbi11 = models.MappedBudgetItem.objects.get(budget=cofog_budget, classification=self.cofog11)
+        self.assertEqual(sorted(c.name for c in mbi11.source_classifications.all()), ["項2-1", "項2-2"])
+        self.assertEqual(mbi11.amount, 43000.0)
+        mbi12 = models.MappedBudgetItem.objects.get(budget=cofog_budget, classification=self.cofog12)
+        self.assertEqual(mbi12.amount, 23000.0)
+
+    def test_load_budget_replaces_previous_data(self):
+        loaders.load_budget(make_spec(), make_rows())
+        loaders.load_budget(make_spec(), make_rows(1, 1))
+        budget = models.BasicBudget.objects.get(slug="mahoro-shi-2101")
+        self.assertEqual(
+            models.Classification.objects.filter(classification_system=budget.classification_system).count(), 2
+        )
+        self.assertEqual(models.BudgetItemBase.objects.filter(budget=budget).count(), 1)
+        self.assertEqual(models.MappedBudgetItem.objects.filter(budget__slug="mahoro-shi-cofog2101").count(), 1)
+
+    def test_load_budget_rejects_unknown_cofog_code(self):
+        rows = make_rows()
+        rows[0]["COFOG"] = "9.9"
+        with self.assertRaisesRegex(ValueError, "9.9"):
+            loaders.load_budget(make_spec(), rows)
+        self.assertFalse(models.BasicBudget.objects.filter(slug="mahoro-shi-2101").exists())
+
+    def test_load_budget_query_count_does_not_depend_on_rows(self):
+        counts = []
+        # the first load also creates the government and the default budget
+        for n in (1, 2, 20):
+            spec = make_spec(
+                classification_system={"slug": f"cs-{n}", "name": "まほろ市"},
+                budget={"slug": f"b-{n}", "name": "まほろ市", "year": 2101},
+                cofog=dict(make_spec()["cofog"], budget={"slug": f"m-{n}", "name": "まほろ市"}),
+            )
+            with CaptureQueriesContext(connection) as ctx:
+                loaders.load_budget(spec, make_rows(n, n))
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[1], counts[2])
+
+    def test_load_budget_command(self):
+        with tempfile.TemporaryDirectory() as d:
+            spec_path = os.path.join(d, "spec.json")
+            csv_path = os.path.join(d, "budget.csv")
+            with open(spec_path, "w", encoding="utf-8") as fout:
+                json.dump(make_spec(), fout)
+            with open(csv_path, "w", encoding="utf-8", newline="") as fout:
+                writer = csv.DictWriter(fout, fieldnames=list(make_rows()[0]))
+                writer.writeheader()
+                writer.writerows(make_rows())
+            out = io.StringIO()
+            call_command("load_budget", spec_path, csv_path, stdout=out)
+            self.assertIn("atomic_budget_items: +4 ~0 -0", out.getvalue())
+            call_command("load_budget", spec_path, csv_path, "--diff", stdout=out)
+            self.assertIn("classifications: +0 ~0 -0", out.getvalue())
+            with self.assertRaises(CommandError):
+                call_command("load_budget", spec_path, os.path.join(d, "missing.csv"), stdout=out)
+
+
+class DiffLoaderTestCase(TestCase):
+    def setUp(self):
+        cofog = factories.ClassificationSystemFactory(slug="cofog")
+        cofog1 = factories.ClassificationFactory(classification_system=cofog, code="1")
+        self.cofog11 = factories.ClassificationFactory(classification_system=cofog, code="1.1", parent=cofog1)
+        self.cofog12 = factories.ClassificationFactory(classification_system=cofog, code="1.2", parent=cofog1)
+        loaders.load_budget(make_spec(), make_rows())
+        self.budget = models.BasicBudget.objects.get(slug="mahoro-shi-2101")
+        self.cofog_budget = models.MappedBudget.objects.get(slug="mahoro-shi-cofog2101")
+
+    def snapshot(self):
+        return {
+            "classifications": sorted(
+                models.Classification.objects.filter(
+                    classification_system=self.budget.classification_system
+                ).values_list("id", "code", "name", "parent_id", "item_order", "updated_at")
+            ),
+            "items": sorted(
+                models.AtomicBudgetItem.objects.filter(budget=self.budget).values_list(
+                    "id", "classification_id", "value", "updated_at"
+                )
+            ),
+            "mapped_items": sorted(
+                models.MappedBudgetItem.objects.filter(budget=self.cofog_budget).values_list(
+                    "id", "classification_id", "source_classifications"
+                )
+            ),
+            "budgets": sorted(models.BudgetBase.objects.values_list("id", "updated_at")),
+        }
+
+    def test_unchanged_reimport_is_a_no_op(self):
+        before = self.snapshot()
+        with CaptureQueriesContext(connection) as ctx:
+            stats = loaders.load_budget(make_spec(), make_rows(), diff=True)
+        self.assertTrue(all(v == {"inserted": 0, "updated": 0, "deleted": 0} for v in stats.values()))
+        self.assertEqual(self.snapshot(), before)
+        self.assertFalse(any(q["sql"].startswith(("INSERT", "UPDATE", "DELETE")) for q in ctx.captured_queries))
+
+    def test_changed_amount_updates_only_the_item(self):
+        before = self.snapshot()
+        rows = make_rows()
+        rows[1]["予算額"] = "100"
+        stats = loaders.load_budget(make_spec(), rows, diff=True)
+        self.assertEqual(stats["atomic_budget_items"], {"inserted": 0, "updated": 1, "deleted": 0})
+        self.assertEqual(stats["classifications"], {"inserted": 0, "updated": 0, "deleted": 0})
+        after = self.snapshot()
+        self.assertEqual(after["classifications"], before["classifications"])
+        self.assertEqual(after["mapped_items"], before["mapped_items"])
+        self.assertEqual([d[0] for d in after["items"]], [d[0] for d in before["items"]])
+        item = models.AtomicBudgetItem.objects.get(budget=self.budget, classification__name="項1-2")
+        self.assertEqual(item.value, 100000.0)
+        self.budget.refresh_from_db()
+        self.assertGreater(self.budget.updated_at, dict(before["budgets"])[self.budget.id])
+
+    def test_diff_matches_replace(self):
+        rows = make_rows(3, 2)
+        rows[0]["項名称"] = "改名"
+        rows[2]["COFOG"] = "1.1"
+        del rows[3]
+        rows.insert(1, dict(rows[0], 項="9", 項名称="新設"))
+        kou11 = models.Classification.objects.get(classification_system=self.budget.classification_system, name="項1-1")
+        stats = loaders.load_budget(make_spec(), rows, diff=True)
+        self.assertEqual(stats["classifications"], {"inserted": 4, "updated": 4, "deleted": 1})
+        self.assertEqual(stats["atomic_budget_items"], {"inserted": 3, "updated": 0, "deleted": 1})
+
+        # the renamed node keeps its id and is found by its new name
+        self.assertEqual(models.Classification.objects.get(id=kou11.id).name, "改名")
+        self.assertEqual(list(models.Classification.search("改名").values_list("id", flat=True)), [kou11.id])
+        self.assertFalse(models.Classification.search("項1-1").exists())
+
+        def tree():
+            cls = {
+                c.id: c
+                for c in models.Classification.objects.filter(classification_system=self.budget.classification_system)
+            }
+
+            def path(c):
+                return (path(cls[c.parent_id]) if c.parent_id else ()) + ((c.code, c.name),)
+
+            return (
+                sorted((c.item_order, path(c)) for c in cls.values()),
+                sorted((path(cls[d.classification_id]), d.value) for d in models.AtomicBudgetItem.objects.all()),
+                sorted(
+                    (d.classification_id, path(cls[s.id]))
+                    for d in models.MappedBudgetItem.objects.all()
+                    for s in d.source_classifications.all()
+                ),
+            )
+
+        diffed = tree()
+        loaders.load_budget(make_spec(), rows)
+        self.assertEqual(tree(), diffed)
@@ -1,5 +1,6 @@
 import doctest
 import json
+import threading
 from collections.abc import Iterator
 from datetime import datetime
 from io import BytesIO
@@ -8,6 +9,7 @@ from unittest.mock import MagicMock, call, patch
 import freezegun
 from budgetmapper import models
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.db.utils import IntegrityError
 from django.test import TestCase, TransactionTestCase
 
@@ -21,6 +23,25 @@ def load_tests(loader, tests, ignore):
     return tests
 
 
+class JpSlugifyTestCase(TestCase):
+    def setUp(self):
+        models.get_kakasi.cache_clear()
+        models.jp_slugify.cache_clear()
+
+    def tearDown(self):
+        models.get_kakasi.cache_clear()
+        models.jp_slugify.cache_clear()
+
+    @patch("budgetmapper.models.pykakasi.kakasi")
+    def test_kakasi_is_built_lazily_once(self, kakasi: MagicMock) -> None:
+        kakasi.return_value.convert.return_value = [{"hepburn": "mahoro"}, {"hepburn": "shi"}]
+        kakasi.assert_not_called()
+        self.assertEqual(models.jp_slugify("まほろ市"), "mahoro-shi")
+        self.assertEqual(models.jp_slugify("まほろ市"), "mahoro-shi")
+        kakasi.assert_called_once_with()
+        kakasi.return_value.convert.assert_called_once_with("まほろ市")
+
+
 class IconImageTestCase(TransactionTestCase):
     @freezegun.freeze_time(datetime(2022, 2, 22, 22, 22, 22, 222222))
     @patch("budgetmapper.models.jp_slugify", return_value="icon-slug-1")
@@ -169,6 +190,37 @@ class ClassificationTest(TransactionTestCase):
         self.assertIsNone(sut.parent)
         self.assertEqual(sut.level, 0)
 
+    def test_classification_has_reading(self) -> None:
+        sut = factories.ClassificationFactory(name="総務費")
+        self.assertEqual(sut.reading, "soumuhi")
+        sut.name = "教育費"
+        sut.save()
+        sut.refresh_from_db()
+        self.assertEqual(sut.reading, "kyouikuhi")
+
+    def test_search(self) -> None:
+        cs = factories.ClassificationSystemFactory()
+        soumu = models.Classification.objects.bulk_create(
+            [
+                models.Classification(name="総務費", classification_system=cs, item_order=0),
+                models.Classification(name="消防総務課", classification_system=cs, item_order=1),
+                models.Classification(name="教育費", classification_system=cs, item_order=2),
+                models.Classification(name="総 務", classification_system=cs, item_order=3),
+            ]
+        )[:2]
+
+        def search(text):
+            return sorted(models.Classification.search(text).values_list("name", flat=True))
+
+        expected = sorted(c.name for c in soumu)
+        self.assertEqual(search("総務"), expected)
+        self.assertEqual(search("そうむ"), expected)
+        self.assertEqual(search("ソウム"), expected)
+        self.assertEqual(search("SOUMU"), expected)
+        self.assertEqual(search("費"), ["教育費", "総務費"])
+        self.assertEqual(search("務費"), ["総務費"])
+        self.assertEqual(search("予算"), [])
+
     def test_classification_has_code(self) -> None:
         cs = factories.ClassificationSystemFactory()
         sut = models.Classification(name="総務費", classification_system=cs, code="2")
@@ -299,6 +351,61 @@ class BasicBudgetTest(TestCase):
         for e, a in zip(expected, actual):
             self.assertEqual(a, e)
 
+    def test_get_amounts(self) -> None:
+        cs = factories.ClassificationSystemFactory()
+        bud = factories.BasicBudgetFactory(classification_system=cs)
+        cl0 = factories.ClassificationFactory(classification_system=cs)
+        cl00 = factories.ClassificationFactory(classification_system=cs, parent=cl0)
+        cl000 = factories.ClassificationFactory(classification_system=cs, parent=cl00)
+        cl01 = factories.ClassificationFactory(classification_system=cs, parent=cl0)
+        cl1 = factories.ClassificationFactory(classification_system=cs)
+        factories.AtomicBudgetItemFactory(budget=bud, classification=cl000, value=1)
+        factories.AtomicBudgetItemFactory(budget=bud, classification=cl01, value=20)
+        factories.AtomicBudgetItemFactory(budget=bud, classification=cl1, value=300)
+
+        actual = bud.get_amounts()
+        self.assertEqual(actual, {cl0.id: 21.0, cl00.id: 1.0, cl000.id: 1.0, cl01.id: 20.0, cl1.id: 300.0})
+        for cl in (cl0, cl00, cl000, cl01, cl1):
+            self.assertEqual(actual[cl.id], bud.get_amount_of(cl))
+
+
+class MappedBudgetTest(TestCase):
+    def test_mapped_budget_copies_year_and_government(self) -> None:
+        src = factories.BasicBudgetFactory(year_value=2101)
+        sut = factories.MappedBudgetFactory(source_budget=src)
+        sut.refresh_from_db()
+        self.assertEqual(sut.year_value, 2101)
+        self.assertEqual(sut.government_value, src.government_value)
+
+    def test_source_budget_changes_are_propagated(self) -> None:
+        src = factories.BasicBudgetFactory(year_value=2101)
+        mapped = factories.MappedBudgetFactory(source_budget=src)
+        mapped_from_mapped = factories.MappedBudgetFactory(source_budget=mapped)
+        gov = factories.GovernmentFactory()
+        src.year_value = 2102
+        src.government_value = gov
+        with models.suspend_touch():
+            src.save()
+        for b in (mapped, mapped_from_mapped):
+            b.refresh_from_db()
+            self.assertEqual(b.year, 2102)
+            self.assertEqual(b.government, gov)
+
+    def test_changing_source_budget_resyncs(self) -> None:
+        sut = factories.MappedBudgetFactory(source_budget=factories.BasicBudgetFactory(year_value=2101))
+        other = factories.BasicBudgetFactory(year_value=2102)
+        sut = models.MappedBudget.objects.get(pk=sut.pk)
+        sut.source_budget = other
+        sut.save()
+        sut.refresh_from_db()
+        self.assertEqual(sut.year_value, 2102)
+        self.assertEqual(sut.government_value, other.government_value)
+
+    def test_save_does_not_fetch_unchanged_source_budget(self) -> None:
+        sut = models.MappedBudget.objects.get(pk=factories.MappedBudgetFactory().pk)
+        with self.assertNumQueries(3):  # two updates and the check for mapped budgets to sync
+            sut.save()
+
 
 class AtomicBudgetItemTestCase(TestCase):
     def test_atomic_budget_item_default(self) -> None:
@@ -813,6 +920,33 @@ class BlobTestCase(TestCase):
         self.assertEqual(actual, expected)
 
 
+class ExportCacheTestCase(TransactionTestCase):
+    def test_concurrent_first_exports_keep_one_cache(self):
+        bud = factories.BasicBudgetFactory()
+        barrier = threading.Barrier(2)
+        errors = []
+
+        def export(body):
+            try:
+                budget = models.BasicBudget.objects.get(pk=bud.pk)
+                barrier.wait()
+                models.ExportCache.cache_export(BytesIO(body), budget, "csv", budget.updated_at)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=export, args=(body,)) for body in (b"a", b"b")]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        cache = models.ExportCache.objects.get(budget=bud, format="csv")
+        self.assertIn(models.BlobReader(cache.blob).read(), (b"a", b"b"))
+        self.assertEqual(list(models.Blob.objects.values_list("id", flat=True)), [cache.blob_id])
+
+
 class WdmmgTreeCacheTestCase(TransactionTestCase):
     def test_wdmmg_tree_cache(self):
         raw_data = BytesIO(json.dumps({"a": 1}).encode("utf-8"))
@@ -0,0 +1,80 @@
+import doctest
+import json
+from datetime import datetime, timezone
+from io import BytesIO
+
+import msgpack
+from budgetmapper import parsers, renderers
+from django.test import SimpleTestCase
+from rest_framework.exceptions import ParseError
+
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(doctest.DocTestSuite(renderers))
+    return tests
+
+
+class ColumnarJSONRendererTestCase(SimpleTestCase):
+    def render(self, data):
+        return json.loads(renderers.ColumnarJSONRenderer().render(data))
+
+    def test_list(self):
+        data = [{"id": "a", "created_at": 1}, {"id": "b", "created_at": 2}]
+        self.assertEqual(self.render(data), {"id": ["a", "b"], "createdAt": [1, 2]})
+
+    def test_paginated_list(self):
+        data = {"next": None, "previous": None, "results": [{"id": "a", "budget": "x"}]}
+        self.assertEqual(self.render(data), {"next": None, "previous": None, "results": {"id": ["a"], "budget": ["x"]}})
+
+    def test_empty_list_is_kept(self):
+        self.assertEqual(self.render({"results": []}), {"results": []})
+
+    def test_missing_keys_are_null(self):
+        data = [{"id": "a"}, {"id": "b", "source_budget": "a"}]
+        self.assertEqual(self.render(data), {"id": ["a", "b"], "sourceBudget": [None, "a"]})
+
+    def test_tree_is_encoded_with_parent_indices(self):
+        data = {
+            "id": "budget",
+            "government": {"id": "gov"},
+            "budgets": [
+                {
+                    "id": "1",
+                    "amount": 30,
+                    "children": [{"id": "1.1", "amount": 10, "children": None}, {"id": "1.2", "amount": 20}],
+                },
+                {"id": "2", "amount": 5, "children": None},
+            ],
+        }
+        expected = {
+            "id": "budget",
+            "government": {"id": "gov"},
+            "budgets": {
+                "id": ["1", "1.1", "1.2", "2"],
+                "amount": [30, 10, 20, 5],
+                "parent": [None, 0, 0, None],
+            },
+        }
+        self.assertEqual(self.render(data), expected)
+
+
+class CamelCaseMessagePackTestCase(SimpleTestCase):
+    def test_round_trip(self):
+        data = {
+            "source_budget": "a",
+            "created_at": datetime(2101, 4, 1, tzinfo=timezone.utc),
+            "items": [{"item_order": 1}],
+        }
+        packed = renderers.CamelCaseMessagePackRenderer().render(data)
+        self.assertEqual(
+            msgpack.unpackb(packed),
+            {"sourceBudget": "a", "createdAt": "2101-04-01T00:00:00Z", "items": [{"itemOrder": 1}]},
+        )
+        parsed = parsers.CamelCaseMessagePackParser().parse(BytesIO(packed))
+        self.assertEqual(
+            parsed, {"source_budget": "a", "created_at": "2101-04-01T00:00:00Z", "items": [{"item_order": 1}]}
+        )
+
+    def test_parse_error(self):
+        with self.assertRaises(ParseError):
+            parsers.CamelCaseMessagePackParser().parse(BytesIO(b"\xc1"))
@@ -1,18 +1,28 @@
 import csv
 import io
+import json
 import random
 from codecs import getreader
 from datetime import datetime
 from unittest.mock import patch
 
 import freezegun
-from budgetmapper import models
-from budgetmapper.views import CreatedAtPagination, ItemOrderPagination
+import msgpack
+import openpyxl
+import pyarrow as pa
+import pyarrow.parquet as pq
+from budgetmapper import jobs, models, renderers, rollups
+from budgetmapper.views import BudgetFilter, CreatedAtPagination, ItemOrderPagination
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
 
 from . import factories
 
@@ -46,6 +56,205 @@ class TestCsvDownload(TestCase):
         actual = list(csv.reader(getreader("utf-8")(io.BytesIO(res.getvalue()))))
         self.assertEqual(actual, expected)
 
+    def test_mapped_budget(self):
+        src_cs = factories.ClassificationSystemFactory()
+        src = factories.BasicBudgetFactory(classification_system=src_cs)
+        s0 = factories.ClassificationFactory(classification_system=src_cs)
+        s00 = factories.ClassificationFactory(classification_system=src_cs, parent=s0)
+        s01 = factories.ClassificationFactory(classification_system=src_cs, parent=s0)
+        s1 = factories.ClassificationFactory(classification_system=src_cs)
+        factories.AtomicBudgetItemFactory(value=100, budget=src, classification=s00)
+        factories.AtomicBudgetItemFactory(value=20, budget=src, classification=s01)
+        factories.AtomicBudgetItemFactory(value=3, budget=src, classification=s1)
+        cs = factories.ClassificationSystemFactory(level_names=["x"])
+        bud = factories.MappedBudgetFactory(classification_system=cs, source_budget=src)
+        cl0 = factories.ClassificationFactory(classification_system=cs, code="1")
+        cl1 = factories.ClassificationFactory(classification_system=cs, code="2")
+        cl2 = factories.ClassificationFactory(classification_system=cs, code="3")
+        factories.MappedBudgetItemFactory(budget=bud, classification=cl0).source_classifications.set([s0, s1])
+        factories.MappedBudgetItemFactory(budget=bud, classification=cl1).source_classifications.set([s01])
+
+        res = Client().get(f"/transfer/csv/{bud.id}")
+        self.assertEqual(res.status_code, 200)
+        expected = [
+            ["x", "x名称", "金額"],
+            [cl0.code, cl0.name, "123.0"],
+            [cl1.code, cl1.name, "20.0"],
+            [cl2.code, cl2.name, "0"],
+        ]
+        actual = list(csv.reader(getreader("utf-8")(io.BytesIO(res.getvalue()))))
+        self.assertEqual(actual, expected)
+
+    def test_pads_shallow_leaves(self):
+        cs = factories.ClassificationSystemFactory(level_names=None)
+        bud = factories.BasicBudgetFactory(classification_system=cs)
+        cl0 = factories.ClassificationFactory(classification_system=cs, code="1")
+        cl00 = factories.ClassificationFactory(classification_system=cs, parent=cl0, code="1.1")
+        cl1 = factories.ClassificationFactory(classification_system=cs, code="2")
+        factories.AtomicBudgetItemFactory(value=5, budget=bud, classification=cl1)
+
+        res = Client().get(f"/transfer/csv/{bud.id}")
+        expected = [
+            ["level_0", "level_0名称", "level_1", "level_1名称", "金額"],
+            [cl0.code, cl0.name, cl00.code, cl00.name, "0"],
+            [cl1.code, cl1.name, "", "", "5.0"],
+        ]
+        actual = list(csv.reader(getreader("utf-8")(io.BytesIO(res.getvalue()))))
+        self.assertEqual(actual, expected)
+        cs.refresh_from_db()
+        self.assertIsNone(cs.level_names)
+
+    def test_number_of_queries_does_not_depend_on_size(self):
+        def count_queries(n):
+            cs = factories.ClassificationSystemFactory()
+            bud = factories.BasicBudgetFactory(classification_system=cs)
+            for _ in range(n):
+                parent = factories.ClassificationFactory(classification_system=cs)
+                cl = factories.ClassificationFactory(classification_system=cs, parent=parent)
+                factories.AtomicBudgetItemFactory(budget=bud, classification=cl)
+            with CaptureQueriesContext(connection) as ctx:
+                res = Client().get(f"/transfer/csv/{bud.id}")
+                self.assertEqual(len(res.getvalue().splitlines()), n + 1)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries(2), count_queries(20))
+
+    def test_header_is_sent_before_the_items_are_read(self):
+        cs = factories.ClassificationSystemFactory(level_names=["a"])
+        bud = factories.BasicBudgetFactory(classification_system=cs)
+        cl = factories.ClassificationFactory(classification_system=cs, code="1")
+        factories.AtomicBudgetItemFactory(value=3, budget=bud, classification=cl)
+        res = Client().get(f"/transfer/csv/{bud.id}")
+        content = iter(res.streaming_content)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(next(content), "a,a名称,金額\n".encode("utf-8"))
+        self.assertFalse(any("budgetitembase" in q["sql"] for q in ctx.captured_queries))
+        self.assertEqual(b"".join(content), f"1,{cl.name},3.0\n".encode("utf-8"))
+
+
+class TestXlsxDownload(TestCase):
+    def test_request(self):
+        cs = factories.ClassificationSystemFactory(level_names=["a", "b"])
+        bud = factories.BasicBudgetFactory(classification_system=cs)
+        cl0 = factories.ClassificationFactory(classification_system=cs, code="1")
+        cl00 = factories.ClassificationFactory(classification_system=cs, parent=cl0, code="1.1")
+        cl01 = factories.ClassificationFactory(classification_system=cs, parent=cl0, code="1.2")
+        cl1 = factories.ClassificationFactory(classification_system=cs, code="2")
+        factories.AtomicBudgetItemFactory(value=123, budget=bud, classification=cl00)
+        factories.AtomicBudgetItemFactory(value=7, budget=bud, classification=cl1)
+
+        res = Client().get(f"/transfer/xlsx/{bud.id}")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.streaming)
+        self.assertEqual(
+            res.headers["Content-Type"], "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+        self.assertIn(f'filename="{bud.slug}.xlsx"', res.headers["Content-Disposition"])
+        wb = openpyxl.load_workbook(io.BytesIO(res.getvalue()), read_only=True)
+        expected = [
+            ("a", "a名称", "b", "b名称", "金額"),
+            (cl0.code, cl0.name, cl00.code, cl00.name, 123),
+            (cl0.code, cl0.name, cl01.code, cl01.name, 0),
+            (cl1.code, cl1.name, None, None, 7),
+        ]
+        self.assertEqual(list(wb.worksheets[0].iter_rows(values_only=True)), expected)
+
+    def test_mirrors_template(self):
+        call_command("loaddata", "budget_xlsx_template", verbosity=0)
+        template = openpyxl.load_workbook(io.BytesIO(Client().get("/transfer/xlsx_template").getvalue()))
+        template_header = next(template.worksheets[0].iter_rows(max_row=1, values_only=True))
+        levels = list(template_header[:-1:2])
+        cs = factories.ClassificationSystemFactory(level_names=levels)
+        bud = factories.BasicBudgetFactory(classification_system=cs)
+        parent = None
+        for _ in levels:
+            parent = factories.ClassificationFactory(classification_system=cs, parent=parent)
+
+        wb = openpyxl.load_workbook(io.BytesIO(Client().get(f"/transfer/xlsx/{bud.id}").getvalue()), read_only=True)
+        self.assertEqual([ws.title for ws in wb.worksheets], [ws.title for ws in template.worksheets])
+        self.assertEqual(next(wb.worksheets[0].iter_rows(max_row=1, values_only=True)), template_header)
+
+    def test_not_found(self):
+        res = Client().get("/transfer/xlsx/unknown")
+        self.assertEqual(res.status_code, 404)
+
+
+class TestTableDownload(TestCase):
+    def setUp(self):
+        self.cs = factories.ClassificationSystemFactory(level_names=["a", "b"])
+        self.bud = factories.BasicBudgetFactory(classification_system=self.cs)
+        self.cl0 = factories.ClassificationFactory(classification_system=self.cs, code="1")
+        self.cl00 = factories.ClassificationFactory(classification_system=self.cs, parent=self.cl0, code="1.1")
+        self.cl01 = factories.ClassificationFactory(classification_system=self.cs, parent=self.cl0, code="1.2")
+        self.cl1 = factories.ClassificationFactory(classification_system=self.cs, code="2")
+        self.abi00 = factories.AtomicBudgetItemFactory(value=123, budget=self.bud, classification=self.cl00)
+        factories.AtomicBudgetItemFactory(value=7, budget=self.bud, classification=self.cl1)
+        cofog_cs = factories.ClassificationSystemFactory(slug="cofog")
+        self.cofog = factories.ClassificationFactory(classification_system=cofog_cs, code="01")
+        cofog_bud = factories.MappedBudgetFactory(classification_system=cofog_cs, source_budget=self.bud)
+        models.MappedBudgetItem.objects.create(budget=cofog_bud, classification=self.cofog).source_classifications.set(
+            [self.cl0]
+        )
+
+    def test_parquet(self):
+        res = Client().get(f"/transfer/parquet/{self.bud.id}")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Content-Type"], "application/vnd.apache.parquet")
+        table = pq.read_table(io.BytesIO(res.getvalue()))
+        self.assertEqual(
+            table.column_names,
+            [
+                "classification_id",
+                "level_0_code",
+                "level_0_name",
+                "level_1_code",
+                "level_1_name",
+                "amount",
+                "cofog_code",
+                "cofog_name",
+                "budget",
+                "government",
+                "year",
+            ],
+        )
+        actual = table.to_pylist()
+        self.assertEqual(
+            [(r["classification_id"], r["level_1_code"], r["amount"], r["cofog_code"]) for r in actual],
+            [
+                (self.cl00.id, "1.1", 123.0, "01"),
+                (self.cl01.id, "1.2", 0.0, "01"),
+                (self.cl1.id, None, 7.0, None),
+            ],
+        )
+        self.assertEqual(actual[0]["government"], self.bud.government_value.slug)
+        self.assertEqual(actual[0]["year"], self.bud.year_value)
+        self.assertEqual(json.loads(table.schema.metadata[b"openspending"])["level_names"], ["a", "b"])
+
+    def test_arrow(self):
+        res = Client().get(f"/transfer/arrow/{self.bud.id}")
+        self.assertEqual(res.status_code, 200)
+        table = pa.ipc.open_file(io.BytesIO(res.getvalue())).read_all()
+        self.assertEqual(table.column("amount").to_pylist(), [123.0, 0.0, 7.0])
+
+    def test_not_found(self):
+        res = Client().get("/transfer/parquet/unknown")
+        self.assertEqual(res.status_code, 404)
+
+    def test_export_is_cached_per_budget_version(self):
+        Client().get(f"/transfer/parquet/{self.bud.id}")
+        cache = models.ExportCache.objects.get(budget=self.bud, format="parquet")
+        with CaptureQueriesContext(connection) as ctx:
+            Client().get(f"/transfer/parquet/{self.bud.id}").getvalue()
+        self.assertFalse(any("INSERT" in q["sql"] for q in ctx.captured_queries))
+        self.assertEqual(models.ExportCache.objects.get(budget=self.bud, format="parquet").blob_id, cache.blob_id)
+
+        self.abi00.value = 100
+        self.abi00.save()
+        res = Client().get(f"/transfer/parquet/{self.bud.id}")
+        self.assertEqual(pq.read_table(io.BytesIO(res.getvalue())).column("amount").to_pylist(), [100.0, 0.0, 7.0])
+        self.assertNotEqual(models.ExportCache.objects.get(budget=self.bud, format="parquet").blob_id, cache.blob_id)
+        self.assertFalse(models.Blob.objects.filter(id=cache.blob_id).exists())
+
 
 class IconTestCase(TestCase):
     def test_get_icon_by_slug(self):
@@ -74,6 +283,419 @@ class BudgetMapperTestUserAPITestCase(APITestCase):
         user.set_password(self._user_password)
         user.save()
 
+    def run_queued_jobs(self):
+        while jobs.run_next_job() is not None:
+            pass
+
+
+class ClassificationSearchTestCase(BudgetMapperTestUserAPITestCase):
+    def setUp(self):
+        super(ClassificationSearchTestCase, self).setUp()
+        self.gov = factories.GovernmentFactory(slug="mahoro-shi")
+        self.cs2021 = factories.ClassificationSystemFactory(slug="mahoro-shi-2021")
+        self.cs2022 = factories.ClassificationSystemFactory()
+        factories.BasicBudgetFactory(classification_system=self.cs2021, government_value=self.gov, year_value=2021)
+        factories.BasicBudgetFactory(classification_system=self.cs2022, government_value=self.gov, year_value=2022)
+        factories.BasicBudgetFactory(classification_system=factories.ClassificationSystemFactory(), year_value=2021)
+        self.soumuka = factories.ClassificationFactory(classification_system=self.cs2021, name="消防総務課")
+        self.soumuhi = factories.ClassificationFactory(classification_system=self.cs2022, name="総務費")
+        factories.ClassificationFactory(classification_system=self.cs2022, name="教育費")
+
+    def search(self, query):
+        res = self.client.get(f"/api/v1/classification-search/?{query}", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [d["id"] for d in res.json()["results"]]
+
+    def test_search(self):
+        res = self.client.get("/api/v1/classification-search/?q=そうむ", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        actual = res.json()
+        self.assertEqual(actual["q"], "そうむ")
+        self.assertEqual([d["id"] for d in actual["results"]], [self.soumuhi.id, self.soumuka.id])
+        self.assertEqual(actual["results"][0]["reading"], "soumuhi")
+        self.assertEqual(actual["results"][0]["classificationSystem"]["id"], self.cs2022.id)
+
+    def test_names_containing_the_text_come_first(self):
+        kana = factories.ClassificationFactory(classification_system=self.cs2022, name="ソウム")
+        self.assertEqual(self.search("q=総務"), [self.soumuhi.id, self.soumuka.id, kana.id])
+
+    def test_filters(self):
+        self.assertEqual(self.search("q=soumu&year=2021"), [self.soumuka.id])
+        self.assertEqual(self.search("q=soumu&government=mahoro-shi&year=2022"), [self.soumuhi.id])
+        self.assertEqual(self.search(f"q=soumu&government={self.gov.id}"), [self.soumuhi.id, self.soumuka.id])
+        self.assertEqual(self.search("q=soumu&classificationSystem=mahoro-shi-2021"), [self.soumuka.id])
+        self.assertEqual(self.search(f"q=soumu&classificationSystem={self.cs2022.id}"), [self.soumuhi.id])
+        self.assertEqual(self.search("q=soumu&year=x"), [])
+        self.assertEqual(self.search("q=soumu&limit=1"), [self.soumuhi.id])
+
+    def test_requires_text(self):
+        res = self.client.get("/api/v1/classification-search/?q=%20", format="json")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get("/api/v1/classification-search/?q=soumu&limit=x", format="json")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BudgetTopTestCase(BudgetMapperTestUserAPITestCase):
+    def setUp(self):
+        super(BudgetTopTestCase, self).setUp()
+        cs = factories.ClassificationSystemFactory()
+        self.cl0 = factories.ClassificationFactory(classification_system=cs, code="1")
+        self.cl00 = factories.ClassificationFactory(classification_system=cs, parent=self.cl0, code="1")
+        self.cl01 = factories.ClassificationFactory(classification_system=cs, parent=self.cl0, code="2")
+        self.cl1 = factories.ClassificationFactory(classification_system=cs, code="2")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.budget = factories.BasicBudgetFactory(classification_system=cs)
+            for cl, value in ((self.cl00, 3), (self.cl01, 2), (self.cl1, 4)):
+                factories.AtomicBudgetItemFactory(budget=self.budget, classification=cl, value=value)
+        self.run_queued_jobs()
+
+    def get_top(self, query=""):
+        res = self.client.get(f"/api/v1/budgets/{self.budget.id}/top/?{query}", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.json()
+
+    def test_top_leaves(self):
+        actual = self.get_top()
+        self.assertEqual(actual["budget"], self.budget.id)
+        self.assertIsNone(actual["level"])
+        self.assertFalse(actual["stale"])
+        self.assertEqual(
+            actual["results"],
+            [
+                {
+                    "classification": self.cl1.id,
+                    "code": "2",
+                    "name": self.cl1.name,
+                    "path": ["2"],
+                    "level": 0,
+                    "isLeaf": True,
+                    "amount": 4.0,
+                },
+                {
+                    "classification": self.cl00.id,
+                    "code": "1",
+                    "name": self.cl00.name,
+                    "path": ["1", "1"],
+                    "level": 1,
+                    "isLeaf": True,
+                    "amount": 3.0,
+                },
+                {
+                    "classification": self.cl01.id,
+                    "code": "2",
+                    "name": self.cl01.name,
+                    "path": ["1", "2"],
+                    "level": 1,
+                    "isLeaf": True,
+                    "amount": 2.0,
+                },
+            ],
+        )
+        self.assertEqual([d["classification"] for d in self.get_top("n=1")["results"]], [self.cl1.id])
+
+    def test_top_nodes_of_level(self):
+        actual = self.get_top("level=0")
+        self.assertEqual(actual["level"], 0)
+        self.assertEqual(
+            [(d["classification"], d["amount"]) for d in actual["results"]], [(self.cl0.id, 5.0), (self.cl1.id, 4.0)]
+        )
+        self.assertFalse(actual["results"][0]["isLeaf"])
+        self.assertEqual(self.get_top("level=2")["results"], [])
+
+    def test_top_follows_changes_once_the_rebuild_job_ran(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            factories.AtomicBudgetItemFactory(budget=self.budget, classification=self.cl0, value=10)
+        # the stored amounts are read as they are: the budget, their version and the top rows
+        with self.assertNumQueries(3):
+            actual = self.get_top("level=0")
+        self.assertTrue(actual["stale"])
+        self.assertEqual(actual["results"][0]["amount"], 5.0)
+        self.run_queued_jobs()
+        actual = self.get_top("level=0")
+        self.assertFalse(actual["stale"])
+        self.assertEqual(actual["results"][0]["amount"], 15.0)
+
+    def test_top_does_not_write(self):
+        budget = factories.BasicBudgetFactory(classification_system=self.budget.classification_system)
+        res = self.client.get(f"/api/v1/budgets/{budget.id}/top/", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()["results"], [])
+        self.assertTrue(res.json()["stale"])
+        self.assertFalse(models.ClassificationAmount.objects.filter(budget=budget).exists())
+
+    def test_repeated_refreshes_do_not_duplicate_rows(self):
+        self.get_top()
+        factories.AtomicBudgetItemFactory(budget=self.budget, classification=self.cl0, value=10)
+        # both were loaded while the stored amounts were stale, like the budgets of two concurrent requests
+        stale = [models.BasicBudget.objects.get(pk=self.budget.pk) for _ in range(2)]
+        for budget in stale:
+            rollups.refresh_classification_amounts(budget)
+        counts = (
+            models.ClassificationAmount.objects.filter(budget=self.budget)
+            .values("classification")
+            .annotate(n=Count("id"))
+        )
+        self.assertEqual(len(counts), 5)
+        self.assertTrue(all(d["n"] == 1 for d in counts))
+        results = self.get_top()["results"]
+        self.assertEqual(len(results), len({d["classification"] for d in results}))
+        self.assertEqual([d["classification"] for d in self.get_top("level=0")["results"]], [self.cl0.id, self.cl1.id])
+
+    def test_invalid_parameters(self):
+        for query in ("n=0", "n=101", "n=x", "level=-1", "level=x"):
+            res = self.client.get(f"/api/v1/budgets/{self.budget.id}/top/?{query}", format="json")
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, query)
+        res = self.client.get("/api/v1/budgets/nonexistent/top/", format="json")
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BudgetNodeTestCase(BudgetMapperTestUserAPITestCase):
+    def setUp(self):
+        super(BudgetNodeTestCase, self).setUp()
+        cs = factories.ClassificationSystemFactory()
+        self.cl0 = factories.ClassificationFactory(classification_system=cs, code="1")
+        self.cl00 = factories.ClassificationFactory(classification_system=cs, parent=self.cl0, code="1")
+        self.cl000 = factories.ClassificationFactory(classification_system=cs, parent=self.cl00, code="1")
+        self.cl01 = factories.ClassificationFactory(classification_system=cs, parent=self.cl0, code="2")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.budget = factories.BasicBudgetFactory(classification_system=cs)
+            for cl, value in ((self.cl000, 3), (self.cl01, 2)):
+                factories.AtomicBudgetItemFactory(budget=self.budget, classification=cl, value=value)
+        self.run_queued_jobs()
+
+    def test_children(self):
+        # the budget and the children
+        with self.assertNumQueries(2):
+            res = self.client.get(f"/api/v1/budgets/{self.budget.id}/nodes/{self.cl0.id}/children/", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.json(),
+            {
+                "budget": self.budget.id,
+                "parent": self.cl0.id,
+                "stale": False,
+                "results": [
+                    {
+                        "classification": self.cl00.id,
+                        "code": "1",
+                        "name": self.cl00.name,
+                        "path": ["1", "1"],
+                        "level": 1,
+                        "childCount": 1,
+                        "isLeaf": False,
+                        "amount": 3.0,
+                    },
+                    {
+                        "classification": self.cl01.id,
+                        "code": "2",
+                        "name": self.cl01.name,
+                        "path": ["1", "2"],
+                        "level": 1,
+                        "childCount": 0,
+                        "isLeaf": True,
+                        "amount": 2.0,
+                    },
+                ],
+            },
+        )
+
+    def test_children_after_repeated_refreshes(self):
+        url = f"/api/v1/budgets/{self.budget.id}/nodes/{self.cl0.id}/children/"
+        self.client.get(url, format="json")
+        factories.AtomicBudgetItemFactory(budget=self.budget, classification=self.cl00, value=1)
+        for budget in [models.BasicBudget.objects.get(pk=self.budget.pk) for _ in range(2)]:
+            rollups.refresh_classification_amounts(budget)
+        res = self.client.get(url, format="json")
+        self.assertEqual(
+            [(d["classification"], d["amount"]) for d in res.json()["results"]],
+            [(self.cl00.id, 4.0), (self.cl01.id, 2.0)],
+        )
+
+    def test_children_of_leaf(self):
+        res = self.client.get(f"/api/v1/budgets/{self.budget.id}/nodes/{self.cl01.id}/children/", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()["results"], [])
+
+    def test_node(self):
+        res = self.client.get(f"/api/v1/budgets/{self.budget.id}/nodes/{self.cl0.id}/", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()["amount"], 5.0)
+        self.assertEqual(res.json()["childCount"], 2)
+        self.assertFalse(res.json()["stale"])
+
+    def test_node_is_served_stale_until_the_rebuild_job_runs(self):
+        url = f"/api/v1/budgets/{self.budget.id}/nodes/{self.cl0.id}/"
+        with self.captureOnCommitCallbacks(execute=True):
+            factories.AtomicBudgetItemFactory(budget=self.budget, classification=self.cl00, value=1)
+        res = self.client.get(url, format="json")
+        self.assertEqual((res.json()["amount"], res.json()["stale"]), (5.0, True))
+        res = self.client.get(f"{url}children/", format="json")
+        self.assertTrue(res.json()["stale"])
+        self.run_queued_jobs()
+        res = self.client.get(url, format="json")
+        self.assertEqual((res.json()["amount"], res.json()["stale"]), (6.0, False))
+
+    def test_not_found(self):
+        other = factories.ClassificationFactory()
+        for url in (
+            f"/api/v1/budgets/{self.budget.id}/nodes/{other.id}/children/",
+            f"/api/v1/budgets/{self.budget.id}/nodes/{other.id}/",
+            f"/api/v1/budgets/nonexistent/nodes/{self.cl0.id}/children/",
+        ):
+            res = self.client.get(url, format="json")
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND, url)
+
+
+class CompareTestCase(BudgetMapperTestUserAPITestCase):
+    def test_compare(self):
+        cs = factories.ClassificationSystemFactory()
+        cl0 = factories.ClassificationFactory(classification_system=cs, code="1")
+        cl00 = factories.ClassificationFactory(classification_system=cs, parent=cl0, code="1.1")
+        bud0 = factories.BasicBudgetFactory(classification_system=cs)
+        bud1 = factories.BasicBudgetFactory(classification_system=cs)
+        factories.AtomicBudgetItemFactory(budget=bud0, classification=cl00, value=10)
+        factories.AtomicBudgetItemFactory(budget=bud1, classification=cl00, value=4)
+
+        res = self.client.get(f"/api/v1/compare/?budgets={bud1.id},{bud0.id}", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        actual = res.json()
+        self.assertEqual([b["id"] for b in actual["budgets"]], [bud1.id, bud0.id])
+        self.assertEqual(actual["alignedOn"], "classification")
+        self.assertEqual(actual["totalAmounts"], [4.0, 10.0])
+        self.assertEqual(
+            actual["nodes"],
+            [
+                {
+                    "id": cl0.id,
+                    "code": "1",
+                    "name": cl0.name,
+                    "parent": None,
+                    "amounts": [4.0, 10.0],
+                    "deltas": [0.0, 6.0],
+                },
+                {
+                    "id": cl00.id,
+                    "code": "1.1",
+                    "name": cl00.name,
+                    "parent": 0,
+                    "amounts": [4.0, 10.0],
+                    "deltas": [0.0, 6.0],
+                },
+            ],
+        )
+
+    def test_compare_mapped_budgets(self):
+        src_cs = factories.ClassificationSystemFactory()
+        s0 = factories.ClassificationFactory(classification_system=src_cs)
+        s1 = factories.ClassificationFactory(classification_system=src_cs)
+        cofog = factories.ClassificationSystemFactory()
+        c0 = factories.ClassificationFactory(classification_system=cofog)
+        budgets = []
+        for value in (1, 2):
+            src = factories.BasicBudgetFactory(classification_system=src_cs)
+            factories.AtomicBudgetItemFactory(budget=src, classification=s0, value=value)
+            factories.AtomicBudgetItemFactory(budget=src, classification=s1, value=10 * value)
+            bud = factories.MappedBudgetFactory(classification_system=cofog, source_budget=src)
+            models.MappedBudgetItem.objects.create(budget=bud, classification=c0).source_classifications.set([s0, s1])
+            budgets.append(bud)
+        res = self.client.get(f"/api/v1/compare/?budgets={budgets[0].id},{budgets[1].id}", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()["nodes"][0]["amounts"], [11.0, 22.0])
+
+    def test_compare_rejects_invalid_budgets(self):
+        bud = factories.BasicBudgetFactory()
+        res = self.client.get(f"/api/v1/compare/?budgets={bud.id}", format="json")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(f"/api/v1/compare/?budgets={bud.id},unknown", format="json")
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class GovernmentSeriesTestCase(BudgetMapperTestUserAPITestCase):
+    def setUp(self):
+        super(GovernmentSeriesTestCase, self).setUp()
+        self.gov = factories.GovernmentFactory(slug="mahoro-shi")
+        self.budgets = []
+        self.items = []
+        with self.captureOnCommitCallbacks(execute=True):
+            for year, with_child in ((2103, True), (2101, True), (2102, False)):
+                cs = factories.ClassificationSystemFactory()
+                cl = factories.ClassificationFactory(classification_system=cs, code="3")
+                bud = factories.BasicBudgetFactory(classification_system=cs, government_value=self.gov, year_value=year)
+                if with_child:
+                    child = factories.ClassificationFactory(classification_system=cs, parent=cl, code="1")
+                    self.items.append(factories.AtomicBudgetItemFactory(budget=bud, classification=child, value=year))
+                else:
+                    factories.AtomicBudgetItemFactory(budget=bud, classification=cl, value=year)
+                self.budgets.append(bud)
+            # budgets of other governments are left out
+            factories.BasicBudgetFactory(year_value=2101)
+        self.run_queued_jobs()
+
+    def test_series(self):
+        res = self.client.get("/api/v1/governments/mahoro-shi/series/?code=3", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        actual = res.json()
+        self.assertEqual(actual["code"], ["3"])
+        self.assertEqual(
+            [(d["budget"], d["year"], d["amount"]) for d in actual["series"]],
+            [
+                (self.budgets[1].id, 2101, 2101.0),
+                (self.budgets[2].id, 2102, 2102.0),
+                (self.budgets[0].id, 2103, 2103.0),
+            ],
+        )
+
+        res = self.client.get("/api/v1/governments/mahoro-shi/series/?code=3&code=1", format="json")
+        self.assertEqual([d["amount"] for d in res.json()["series"]], [2101.0, None, 2103.0])
+
+    def test_series_costs_one_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get("/api/v1/governments/mahoro-shi/series/?code=3&code=1", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_series_follows_changes_once_the_rebuild_job_ran(self):
+        self.items[0].value = 1
+        with self.captureOnCommitCallbacks(execute=True):
+            self.items[0].save()
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get("/api/v1/governments/mahoro-shi/series/?code=3", format="json")
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(
+            [(d["amount"], d["stale"]) for d in res.json()["series"]],
+            [(2101.0, False), (2102.0, False), (2103.0, True)],
+        )
+        self.run_queued_jobs()
+        res = self.client.get("/api/v1/governments/mahoro-shi/series/?code=3", format="json")
+        self.assertEqual(
+            [(d["amount"], d["stale"]) for d in res.json()["series"]],
+            [(2101.0, False), (2102.0, False), (1.0, False)],
+        )
+
+    def test_series_of_mapped_budgets(self):
+        cofog = factories.ClassificationSystemFactory(slug="cofog")
+        c = factories.ClassificationFactory(classification_system=cofog, code="10")
+        with self.captureOnCommitCallbacks(execute=True):
+            for bud in self.budgets:
+                mapped = factories.MappedBudgetFactory(classification_system=cofog, source_budget=bud)
+                models.MappedBudgetItem.objects.create(budget=mapped, classification=c).source_classifications.set(
+                    bud.classification_system.roots
+                )
+        self.run_queued_jobs()
+        res = self.client.get(
+            "/api/v1/governments/mahoro-shi/series/?code=10&classificationSystem=cofog", format="json"
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(d["year"], d["amount"]) for d in res.json()["series"]], [(2101, 2101.0), (2102, 2102.0), (2103, 2103.0)]
+        )
+
+    def test_series_errors(self):
+        res = self.client.get("/api/v1/governments/mahoro-shi/series/", format="json")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get("/api/v1/governments/unknown/series/?code=3", format="json")
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
 
 class WdmmgTestCase(BudgetMapperTestUserAPITestCase):
     def setUp(self):
@@ -281,6 +903,55 @@ class WdmmgTestCase(BudgetMapperTestUserAPITestCase):
         actual = res.json()
         self.assertEqual(actual, expected)
 
+    def make_tree_budget(self):
+        cs = factories.ClassificationSystemFactory()
+        self.cl0 = factories.ClassificationFactory(classification_system=cs, code="1")
+        self.cl00 = factories.ClassificationFactory(classification_system=cs, parent=self.cl0, code="1.1")
+        self.cl000 = factories.ClassificationFactory(classification_system=cs, parent=self.cl00, code="1.1.1")
+        self.cl001 = factories.ClassificationFactory(classification_system=cs, parent=self.cl00, code="1.1.2")
+        self.cl1 = factories.ClassificationFactory(classification_system=cs, code="2")
+        bud = factories.BasicBudgetFactory(classification_system=cs)
+        factories.AtomicBudgetItemFactory(value=1.0, budget=bud, classification=self.cl000)
+        factories.AtomicBudgetItemFactory(value=2.0, budget=bud, classification=self.cl001)
+        factories.AtomicBudgetItemFactory(value=4.0, budget=bud, classification=self.cl1)
+        return bud
+
+    def test_get_with_depth(self) -> None:
+        bud = self.make_tree_budget()
+        res = self.client.get(f"/api/v1/wdmmg/{bud.slug}/?depth=1", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        actual = res.json()
+        self.assertEqual(actual["totalAmount"], 7.0)
+        self.assertEqual(
+            [(n["code"], n["amount"], n["children"], n.get("childCount")) for n in actual["budgets"]],
+            [("1", 3.0, None, 1), ("2", 4.0, None, None)],
+        )
+
+        res = self.client.get(f"/api/v1/wdmmg/{bud.slug}/?depth=2", format="json")
+        node = res.json()["budgets"][0]["children"][0]
+        self.assertEqual((node["code"], node["amount"], node["children"], node["childCount"]), ("1.1", 3.0, None, 2))
+
+    def test_get_with_root(self) -> None:
+        bud = self.make_tree_budget()
+        res = self.client.get(f"/api/v1/wdmmg/{bud.slug}/?root={self.cl00.id}&depth=1", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        actual = res.json()
+        self.assertEqual(actual["totalAmount"], 3.0)
+        self.assertEqual(
+            [(n["id"], n["amount"]) for n in actual["budgets"]], [(self.cl000.id, 1.0), (self.cl001.id, 2.0)]
+        )
+
+    def test_get_with_unknown_root(self) -> None:
+        bud = self.make_tree_budget()
+        res = self.client.get(f"/api/v1/wdmmg/{bud.slug}/?root=unknown", format="json")
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_with_invalid_depth(self) -> None:
+        bud = self.make_tree_budget()
+        for depth in ("0", "-1", "a"):
+            res = self.client.get(f"/api/v1/wdmmg/{bud.slug}/?depth={depth}", format="json")
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_mapped_budget(self) -> None:
         gov = factories.GovernmentFactory()
         cs0 = factories.ClassificationSystemFactory()
@@ -402,6 +1073,140 @@ class WdmmgTestCase(BudgetMapperTestUserAPITestCase):
         self.assertEqual(actual, expected)
 
 
+class ColumnarFormatTestCase(BudgetMapperTestUserAPITestCase):
+    def test_classification_list(self):
+        cs = factories.ClassificationSystemFactory()
+        for i in range(3):
+            factories.ClassificationFactory(classification_system=cs, item_order=i)
+        url = f"/api/v1/classification-systems/{cs.id}/classifications/"
+        expected = renderers.to_columnar(self.client.get(url, format="json").json())
+        res = self.client.get(f"{url}?format=columnar")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "application/vnd.openspending.columnar+json")
+        self.assertEqual(res.json(), expected)
+        self.assertEqual(len(res.json()["results"]["id"]), 3)
+
+    def test_budget_item_list_by_accept_header(self):
+        cs = factories.ClassificationSystemFactory()
+        budget = factories.BasicBudgetFactory(classification_system=cs)
+        for _ in range(3):
+            factories.AtomicBudgetItemFactory(
+                budget=budget, classification=factories.ClassificationFactory(classification_system=cs)
+            )
+        url = f"/api/v1/budgets/{budget.id}/items/"
+        expected = renderers.to_columnar(self.client.get(url, format="json").json())
+        res = self.client.get(url, HTTP_ACCEPT="application/vnd.openspending.columnar+json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json(), expected)
+        self.assertEqual(
+            set(res.json()["results"].keys()), {"id", "value", "budget", "classification", "createdAt", "updatedAt"}
+        )
+
+    def test_wdmmg_tree(self):
+        cs = factories.ClassificationSystemFactory()
+        cl0 = factories.ClassificationFactory(classification_system=cs, code="1")
+        cl00 = factories.ClassificationFactory(classification_system=cs, parent=cl0, code="1.1")
+        cl01 = factories.ClassificationFactory(classification_system=cs, parent=cl0, code="1.2")
+        cl1 = factories.ClassificationFactory(classification_system=cs, code="2")
+        budget = factories.BasicBudgetFactory(classification_system=cs)
+        factories.AtomicBudgetItemFactory(budget=budget, classification=cl00, value=1.0)
+        factories.AtomicBudgetItemFactory(budget=budget, classification=cl01, value=2.0)
+        factories.AtomicBudgetItemFactory(budget=budget, classification=cl1, value=4.0)
+        res = self.client.get(f"/api/v1/wdmmg/{budget.slug}/?format=columnar")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        actual = res.json()
+        self.assertEqual(actual["totalAmount"], 7.0)
+        self.assertEqual(actual["budgets"]["id"], [cl0.id, cl00.id, cl01.id, cl1.id])
+        self.assertEqual(actual["budgets"]["parent"], [None, 0, 0, None])
+        self.assertEqual(actual["budgets"]["amount"], [3.0, 1.0, 2.0, 4.0])
+        self.assertNotIn("children", actual["budgets"])
+
+
+class MessagePackTestCase(BudgetMapperTestUserAPITestCase):
+    def test_get(self):
+        cs = factories.ClassificationSystemFactory()
+        factories.ClassificationFactory(classification_system=cs)
+        url = f"/api/v1/classification-systems/{cs.id}/"
+        expected = self.client.get(url, format="json").json()
+        res = self.client.get(url, HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "application/msgpack")
+        self.assertEqual(msgpack.unpackb(res.content), expected)
+
+    def test_post(self):
+        cs = factories.ClassificationSystemFactory()
+        self.client.login(username=self._user_username, password=self._user_password)
+        body = msgpack.packb({"data": [{"code": "1", "name": "議会費", "children": [{"code": "1.1", "name": "議会費"}]}]})
+        res = self.client.post(
+            f"/api/v1/classification-systems/{cs.id}/bulk-create/?format=msgpack",
+            body,
+            content_type="application/msgpack",
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([d["code"] for d in msgpack.unpackb(res.content)["results"]], ["1", "1.1"])
+
+
+class SparseFieldsetTestCase(BudgetMapperTestUserAPITestCase):
+    def test_fields_on_list(self):
+        gov = factories.GovernmentFactory()
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get("/api/v1/governments/?fields=id,name,slug,latitude,longitude", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        expected = [
+            {"id": gov.id, "name": gov.name, "slug": gov.slug, "latitude": gov.latitude, "longitude": gov.longitude}
+        ]
+        self.assertEqual(res.json()["results"], expected)
+        sql = ctx.captured_queries[-1]["sql"]
+        self.assertNotIn("primary_color_code", sql)
+        self.assertNotIn("updated_at", sql)
+
+    def test_omit_on_list(self):
+        bud = factories.MappedBudgetFactory()
+        res = self.client.get("/api/v1/budgets/?omit=government,sourceBudget,createdAt,updatedAt", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        actual = {d["id"]: d for d in res.json()["results"]}
+        self.assertEqual(
+            actual[bud.id],
+            {
+                "id": bud.id,
+                "name": bud.name,
+                "slug": bud.slug,
+                "year": bud.year,
+                "subtitle": bud.subtitle,
+                "classificationSystem": bud.classification_system.id,
+            },
+        )
+
+    def test_omit_nested_field_drops_its_query(self):
+        cs = factories.ClassificationSystemFactory()
+        cl = factories.ClassificationFactory(classification_system=cs)
+        url = f"/api/v1/classification-systems/{cs.id}/classifications/{cl.id}/"
+        with CaptureQueriesContext(connection) as full:
+            res = self.client.get(url, format="json")
+        self.assertIn("classificationSystem", res.json())
+        with CaptureQueriesContext(connection) as sparse:
+            res = self.client.get(f"{url}?omit=classificationSystem", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn("classificationSystem", res.json())
+        self.assertEqual(len(sparse.captured_queries), len(full.captured_queries) - 1)
+
+    def test_fields_on_budget_items(self):
+        cs = factories.ClassificationSystemFactory()
+        budget = factories.BasicBudgetFactory(classification_system=cs)
+        item = factories.AtomicBudgetItemFactory(
+            budget=budget, classification=factories.ClassificationFactory(classification_system=cs)
+        )
+        res = self.client.get(f"/api/v1/budgets/{budget.id}/items/?fields=id,value", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()["results"], [{"id": item.id, "value": item.value}])
+
+    def test_fields_are_ignored_on_write(self):
+        self.client.login(username=self._user_username, password=self._user_password)
+        res = self.client.post("/api/v1/governments/?fields=id", {"name": "まほろ市", "slug": "mahoro-shi"}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.json()["slug"], "mahoro-shi")
+
+
 class GovernmentCrudTestCase(BudgetMapperTestUserAPITestCase):
     def test_list(self):
         ordering = CreatedAtPagination.ordering
@@ -441,6 +1246,34 @@ class GovernmentCrudTestCase(BudgetMapperTestUserAPITestCase):
         else:
             self.assertIsNone(n)
 
+    def test_list_page_size(self):
+        govs = [factories.GovernmentFactory() for i in range(15)]
+        expected = [gov.id for gov in sorted(govs, key=lambda gov: gov.created_at, reverse=True)]
+        res = self.client.get("/api/v1/governments/?pageSize=12", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([d["id"] for d in res.json()["results"]], expected[:12])
+        self.assertIn("pageSize=12", res.json()["next"])
+        res = self.client.get(res.json()["next"], format="json")
+        self.assertEqual([d["id"] for d in res.json()["results"]], expected[12:])
+        self.assertIsNone(res.json()["next"])
+
+        res = self.client.get("/api/v1/governments/?pageSize=x", format="json")
+        self.assertEqual(len(res.json()["results"]), CreatedAtPagination.page_size)
+        with patch.object(CreatedAtPagination, "max_page_size", 4):
+            res = self.client.get("/api/v1/governments/?pageSize=12", format="json")
+        self.assertEqual(len(res.json()["results"]), 4)
+
+    def test_list_breaks_ties_by_id(self):
+        with freezegun.freeze_time(datetime(2022, 2, 22)):
+            govs = [factories.GovernmentFactory() for i in range(7)]
+        actual = []
+        url = "/api/v1/governments/?pageSize=3"
+        while url is not None:
+            res = self.client.get(url, format="json")
+            actual += [d["id"] for d in res.json()["results"]]
+            url = res.json()["next"]
+        self.assertEqual(actual, sorted((gov.id for gov in govs), reverse=True))
+
     def test_list_with_filter_governments_without_default_budget(self):
         ordering = CreatedAtPagination.ordering
         page_size = CreatedAtPagination.page_size
@@ -849,6 +1682,23 @@ class GovernmentBudgetListTestCase(BudgetMapperTestUserAPITestCase):
         actual = res.json()
         self.assertEqual(actual, expected)
 
+    def test_budget_list_query_count_does_not_depend_on_the_number_of_budgets(self):
+        gov = factories.GovernmentFactory()
+        counts = []
+        for n in (1, 10):
+            for _ in range(n):
+                factories.MappedBudgetFactory(source_budget=factories.BasicBudgetFactory(government_value=gov))
+            if n == 1:
+                factories.DefaultBudgetFactory(government=gov, budget=models.MappedBudget.objects.get())
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.client.get(f"/api/v1/governments/{gov.slug}/budgets/", format="json")
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(res.json()["budgets"]), 2 * models.BasicBudget.objects.count())
+            self.assertIsNotNone(res.json()["defaultBudget"])
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(counts[1], 3)
+
     def test_budget_list_with_invalid_slug(self):
         gov = factories.GovernmentFactory()
         factories.BasicBudgetFactory(government_value=gov)
@@ -949,6 +1799,60 @@ class ClassificationSystemCrudTestCase(BudgetMapperTestUserAPITestCase):
         actual = res.json()
         self.assertEqual(actual, expected)
 
+    def test_retrieve_without_items(self):
+        cs = factories.ClassificationSystemFactory()
+        factories.ClassificationFactory(classification_system=cs)
+        res = self.client.get(f"/api/v1/classification-systems/{cs.id}/?items=none", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        expected = {
+            "id": cs.id,
+            "name": cs.name,
+            "slug": cs.slug,
+            "levelNames": cs.level_names,
+            "createdAt": cs.created_at.strftime(datetime_format),
+            "updatedAt": cs.updated_at.strftime(datetime_format),
+        }
+        self.assertEqual(res.json(), expected)
+
+    def test_retrieve_with_paginated_items(self):
+        page_size = ItemOrderPagination.page_size
+        cs = factories.ClassificationSystemFactory()
+        cls = [factories.ClassificationFactory(classification_system=cs, item_order=i) for i in range(page_size + 3)]
+        res = self.client.get(f"/api/v1/classification-systems/{cs.id}/?items=page", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        actual = res.json()
+        self.assertEqual(actual["id"], cs.id)
+        self.assertEqual([d["id"] for d in actual["items"]], [c.id for c in cls[:page_size]])
+        self.assertIsNone(actual["previous"])
+        self.assertTrue(actual["next"].startswith(f"/api/v1/classification-systems/{cs.id}/?"))
+        self.assertIn("items=page", actual["next"])
+
+        res = self.client.get(actual["next"], format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([d["id"] for d in res.json()["items"]], [c.id for c in cls[page_size:]])
+        self.assertIsNone(res.json()["next"])
+
+    def test_retrieve_with_streamed_items(self):
+        cs = factories.ClassificationSystemFactory()
+        factories.ClassificationFactory(classification_system=cs, item_order=2)
+        factories.ClassificationFactory(classification_system=cs, item_order=0)
+        factories.ClassificationFactory(classification_system=cs, item_order=1)
+        expected = self.client.get(f"/api/v1/classification-systems/{cs.id}/", format="json").json()
+        res = self.client.get(f"/api/v1/classification-systems/{cs.id}/?items=stream", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        self.assertEqual(json.loads(b"".join(res.streaming_content)), expected)
+
+    def test_retrieve_with_streamed_items_of_empty_system(self):
+        cs = factories.ClassificationSystemFactory()
+        res = self.client.get(f"/api/v1/classification-systems/{cs.id}/?items=stream", format="json")
+        self.assertEqual(json.loads(b"".join(res.streaming_content))["items"], [])
+
+    def test_retrieve_with_invalid_items_mode(self):
+        cs = factories.ClassificationSystemFactory()
+        res = self.client.get(f"/api/v1/classification-systems/{cs.id}/?items=everything", format="json")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_retrieve_by_slug(self):
         css = [factories.ClassificationSystemFactory() for i in range(100)]
         cs = css[random.randint(0, 99)]
@@ -1263,6 +2167,268 @@ class MappedBudgetBulkCreate(BudgetMapperTestUserAPITestCase):
                 models.MappedBudgetItem.objects.get(id=mbi12.id)
 
 
+class ClassificationBulkCreateTestCase(BudgetMapperTestUserAPITestCase):
+    def test_post_requires_login(self):
+        cs = factories.ClassificationSystemFactory()
+        res = self.client.post(f"/api/v1/classification-systems/{cs.id}/bulk-create/", {"data": []}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_bulk_create_tree(self):
+        cs = factories.ClassificationSystemFactory()
+        existing = factories.ClassificationFactory(classification_system=cs, item_order=3)
+        icon = factories.IconImageFactory(slug="gikai")
+        bud = factories.BasicBudgetFactory(classification_system=cs)
+        updated_at = bud.updated_at
+        self.client.login(username=self._user_username, password=self._user_password)
+        query = {
+            "data": [
+                {
+                    "code": "1",
+                    "name": "議会費",
+                    "iconSlug": icon.slug,
+                    "children": [
+                        {"code": "1.1", "name": "議会費", "children": [{"code": "1.1.1", "name": "議員報酬"}]},
+                        {"code": "1.2", "name": "事務局費"},
+                    ],
+                },
+                {"code": "2", "name": "総務費"},
+            ]
+        }
+        res = self.client.post(f"/api/v1/classification-systems/{cs.id}/bulk-create/", query, format="json")
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.json()["results"]), 5)
+        actual = list(
+            models.Classification.objects.filter(classification_system=cs)
+            .exclude(id=existing.id)
+            .order_by("item_order")
+        )
+        self.assertEqual([c.code for c in actual], ["1", "1.1", "1.1.1", "1.2", "2"])
+        self.assertEqual([c.item_order for c in actual], [4, 5, 6, 7, 8])
+        self.assertEqual([c.parent_id for c in actual], [None, actual[0].id, actual[1].id, actual[0].id, None])
+        self.assertEqual([c.icon_id for c in actual], [icon.id, None, None, None, None])
+        bud.refresh_from_db()
+        self.assertGreater(bud.updated_at, updated_at)
+
+    def test_bulk_create_tree_issues_one_insert_per_level(self):
+        def tree(width):
+            return [
+                {"code": f"{i}", "name": f"款{i}", "children": [{"code": f"{i}.{j}", "name": "項"} for j in range(width)]}
+                for i in range(width)
+            ]
+
+        self.client.login(username=self._user_username, password=self._user_password)
+        counts = []
+        for width in (2, 20):
+            cs = factories.ClassificationSystemFactory()
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.client.post(
+                    f"/api/v1/classification-systems/{cs.id}/bulk-create/", {"data": tree(width)}, format="json"
+                )
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(models.Classification.objects.filter(classification_system=cs).count(), width + width**2)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_bulk_create_tree_rejects_malformed_data(self):
+        cs = factories.ClassificationSystemFactory()
+        self.client.login(username=self._user_username, password=self._user_password)
+        res = self.client.post(
+            f"/api/v1/classification-systems/{cs.id}/bulk-create/", {"data": [{"children": "x"}]}, format="json"
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(models.Classification.objects.filter(classification_system=cs).count(), 0)
+
+
+class JobTestCase(BudgetMapperTestUserAPITestCase):
+    def test_async_mapping_bulk_create_returns_job(self):
+        cs0 = factories.ClassificationSystemFactory()
+        bud0 = factories.BasicBudgetFactory(classification_system=cs0)
+        cl00 = factories.ClassificationFactory(classification_system=cs0)
+        factories.AtomicBudgetItemFactory(budget=bud0, classification=cl00)
+        cs1 = factories.ClassificationSystemFactory()
+        bud1 = factories.MappedBudgetFactory(classification_system=cs1, source_budget=bud0)
+        cl10 = factories.ClassificationFactory(classification_system=cs1)
+        self.client.login(username=self._user_username, password=self._user_password)
+        query = {"data": [{"classification": cl10.id, "sourceClassifications": [cl00.id]}]}
+        res = self.client.post(f"/api/v1/budgets/{bud1.id}/bulk-create/?async=true", query, format="json")
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        job_id = res.json()["id"]
+        self.assertEqual(res.headers["Location"], f"/api/v1/jobs/{job_id}")
+        self.assertFalse(models.MappedBudgetItem.objects.filter(budget=bud1).exists())
+
+        res = self.client.get(f"/api/v1/jobs/{job_id}/", format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()["status"], "queued")
+        self.assertEqual(res.json()["progress"], 0.0)
+
+        jobs.run_next_job()
+        res = self.client.get(f"/api/v1/jobs/{job_id}/", format="json")
+        self.assertEqual(res.json()["status"], "succeeded")
+        self.assertEqual(res.json()["result"], {"mappedBudgetItems": 1})
+        self.assertEqual(
+            list(models.MappedBudgetItem.objects.get(budget=bud1).source_classifications.all()),
+            [cl00],
+        )
+
+    def test_async_classification_tree_bulk_create_returns_job(self):
+        cs = factories.ClassificationSystemFactory()
+        self.client.login(username=self._user_username, password=self._user_password)
+        query = {"data": [{"code": "1", "name": "議会費", "children": [{"code": "1.1", "name": "議会費"}]}]}
+        res = self.client.post(f"/api/v1/classification-systems/{cs.id}/bulk-create/?async=1", query, format="json")
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        jobs.run_next_job()
+        self.assertEqual(models.Classification.objects.filter(classification_system=cs).count(), 2)
+
+    def test_budget_import_requires_login(self):
+        res = self.client.post("/api/v1/budget-imports/", {}, format="multipart")
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_budget_import(self):
+        spec = {
+            "government": {"slug": "mahoro-shi", "name": "まほろ市"},
+            "classification_system": {"slug": "mahoro-shi-2101", "name": "まほろ市2101年度予算"},
+            "budget": {"slug": "mahoro-shi-2101", "name": "まほろ市2101年度予算", "year": 2101},
+            "levels": ["款"],
+            "amount": {"column": "予算額"},
+        }
+        self.client.login(username=self._user_username, password=self._user_password)
+        res = self.client.post(
+            "/api/v1/budget-imports/",
+            {"spec": json.dumps(spec), "file": io.BytesIO("款,款名称,予算額\n1,議会費,100\n".encode("utf-8"))},
+            format="multipart",
+        )
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        job_id = res.json()["id"]
+        jobs.run_next_job()
+        res = self.client.get(f"/api/v1/jobs/{job_id}/", format="json")
+        self.assertEqual(res.json()["status"], "succeeded")
+        self.assertEqual(models.AtomicBudgetItem.objects.get(budget__slug="mahoro-shi-2101").value, 100.0)
+
+    def test_budget_import_rejects_invalid_spec(self):
+        self.client.login(username=self._user_username, password=self._user_password)
+        res = self.client.post("/api/v1/budget-imports/", {"spec": "{}", "file": io.BytesIO(b"")}, format="multipart")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(models.Job.objects.exists())
+
+    def test_budget_import_rejects_file_that_is_not_an_upload(self):
+        spec = {
+            "government": {"slug": "mahoro-shi", "name": "まほろ市"},
+            "classification_system": {"slug": "mahoro-shi-2101", "name": "まほろ市2101年度予算"},
+            "budget": {"slug": "mahoro-shi-2101", "name": "まほろ市2101年度予算", "year": 2101},
+            "levels": ["款"],
+            "amount": {"column": "予算額"},
+        }
+        self.client.login(username=self._user_username, password=self._user_password)
+        for format in ("multipart", "json"):
+            with self.subTest(format=format):
+                res = self.client.post(
+                    "/api/v1/budget-imports/", {"spec": json.dumps(spec), "file": "款,款名称,予算額\n"}, format=format
+                )
+                self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertEqual(res.json(), {"error": "file must be an uploaded file"})
+        self.assertFalse(models.Job.objects.exists())
+
+    def test_budget_import_rejects_spec_with_invalid_nested_fields(self):
+        spec = {
+            "government": {"slug": "mahoro-shi", "name": "まほろ市"},
+            "classification_system": {"slug": "mahoro-shi-2101", "name": "まほろ市2101年度予算"},
+            "budget": {"name": "まほろ市2101年度予算", "year": 2101},
+            "levels": ["款"],
+            "amount": {"column": "予算額"},
+        }
+        self.client.login(username=self._user_username, password=self._user_password)
+        res = self.client.post(
+            "/api/v1/budget-imports/",
+            {"spec": json.dumps(spec), "file": io.BytesIO("款,款名称,予算額\n1,議会費,100\n".encode("utf-8"))},
+            format="multipart",
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.json(), {"error": "spec lacks budget.slug"})
+        self.assertFalse(models.Job.objects.exists())
+
+    def post_xlsx(self, rows, spec=None):
+        if spec is None:
+            spec = {
+                "government": {"slug": "mahoro-shi", "name": "まほろ市"},
+                "classification_system": {"slug": "mahoro-shi-2101", "name": "まほろ市2101年度予算"},
+                "budget": {"slug": "mahoro-shi-2101", "name": "まほろ市2101年度予算", "year": 2101},
+            }
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet("x")
+        ws.append(["款", "款名称", "項", "項名称", "金額"])
+        for row in rows:
+            ws.append(row)
+        fp = io.BytesIO()
+        wb.save(fp)
+        fp.seek(0)
+        fp.name = "budget.xlsx"
+        self.client.login(username=self._user_username, password=self._user_password)
+        return self.client.post(
+            "/api/v1/budget-xlsx-imports/", {"spec": json.dumps(spec), "file": fp}, format="multipart"
+        )
+
+    def test_budget_xlsx_import(self):
+        res = self.post_xlsx([["1", "議会費", "1", "議会費", 100], ["2", "総務費", None, None, 20]])
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.json()["atomicBudgetItems"]["inserted"], 2)
+        budget = models.BasicBudget.objects.get(slug="mahoro-shi-2101")
+        self.assertEqual(budget.classification_system.level_names, ["款", "項"])
+        self.assertEqual(sorted(budget.get_item_amounts().values()), [20.0, 100.0])
+        self.assertTrue(models.Job.objects.filter(kind="rebuild_wdmmg_cache").exists())
+
+    def test_budget_xlsx_import_reports_every_invalid_row(self):
+        res = self.post_xlsx(
+            [["1", "議会費", "1", "議会費", "abc"], ["2", "総務費", None, None, 20], [None, None, None, None, 5]]
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            res.json(),
+            {
+                "errorCount": 2,
+                "errors": [
+                    {"row": 2, "column": "金額", "message": "invalid amount 'abc'"},
+                    {"row": 4, "column": "款", "message": "no classification"},
+                ],
+            },
+        )
+        self.assertFalse(models.BasicBudget.objects.filter(slug="mahoro-shi-2101").exists())
+
+    def test_budget_xlsx_import_rejects_specs_other_than_objects(self):
+        for spec in ([], 1, "spec"):
+            with self.subTest(spec=spec):
+                res = self.post_xlsx([["1", "議会費", "1", "議会費", 100]], spec=spec)
+                self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertEqual(res.json(), {"error": "spec must be a JSON object"})
+        self.assertFalse(models.BasicBudget.objects.filter(slug="mahoro-shi-2101").exists())
+
+    def test_budget_xlsx_import_rejects_file_that_is_not_an_upload(self):
+        self.client.login(username=self._user_username, password=self._user_password)
+        res = self.client.post("/api/v1/budget-xlsx-imports/", {"spec": "{}", "file": "/etc/hosts"}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.json(), {"error": "file must be an uploaded file"})
+
+    def test_budget_xlsx_import_rejects_spec_with_invalid_nested_fields(self):
+        spec = {
+            "government": {"slug": "mahoro-shi", "name": "まほろ市"},
+            "classification_system": {"slug": "mahoro-shi-2101", "name": "まほろ市2101年度予算"},
+            "budget": {"slug": "mahoro-shi-2101", "name": "まほろ市2101年度予算", "year": 2101},
+            "cofog": {"column": "COFOG", "budget": {"name": "まほろ市COFOG2101"}},
+        }
+        res = self.post_xlsx([["1", "議会費", "1", "議会費", 100]], spec=spec)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.json(), {"error": "spec lacks cofog.budget.slug"})
+        self.assertFalse(models.Government.objects.filter(slug="mahoro-shi").exists())
+
+    def test_budget_xlsx_import_rejects_other_files(self):
+        self.client.login(username=self._user_username, password=self._user_password)
+        res = self.client.post(
+            "/api/v1/budget-xlsx-imports/",
+            {"spec": "{}", "file": io.BytesIO("款,款名称,金額\n".encode("utf-8"))},
+            format="multipart",
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class ClassificationCrudTestCase(BudgetMapperTestUserAPITestCase):
     def test_list(self):
         ordering = ItemOrderPagination.ordering
@@ -1525,6 +2691,33 @@ class BudgetCrudTestCase(BudgetMapperTestUserAPITestCase):
         else:
             self.assertIsNone(n)
 
+    def test_list_query_count_does_not_depend_on_the_page(self):
+        counts = []
+        for n in (1, CreatedAtPagination.page_size):
+            for _ in range(n):
+                factories.MappedBudgetFactory()
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.client.get("/api/v1/budgets/", format="json")
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            sources = dict(models.MappedBudget.objects.values_list("id", "source_budget"))
+            for b in res.json()["results"]:
+                self.assertEqual(b.get("sourceBudget"), sources.get(b["id"]))
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_retrieve_loads_each_object_once(self):
+        gov = factories.GovernmentFactory()
+        bud = factories.BasicBudgetFactory(government_value=gov)
+        mapped = factories.MappedBudgetFactory(source_budget=bud)
+        # budget (base and subclass rows), classification system and government
+        with self.assertNumQueries(4):
+            res = self.client.get(f"/api/v1/budgets/{bud.id}/", format="json")
+        self.assertEqual(res.json()["government"]["id"], gov.id)
+        # plus the source budget and its classification system; the government is shared
+        with self.assertNumQueries(7):
+            res = self.client.get(f"/api/v1/budgets/{mapped.slug}/", format="json")
+        self.assertEqual(res.json()["sourceBudget"]["government"]["id"], gov.id)
+
     def test_list_can_filter_by_government(self):
         ordering = CreatedAtPagination.ordering
         page_size = CreatedAtPagination.page_size
@@ -1708,6 +2901,24 @@ class BudgetCrudTestCase(BudgetMapperTestUserAPITestCase):
         else:
             self.assertIsNone(n)
 
+    def test_list_filter_does_not_depend_on_the_number_of_budgets(self):
+        gov = factories.GovernmentFactory()
+        counts = []
+        for n in (1, 20):
+            for _ in range(n):
+                factories.MappedBudgetFactory(source_budget=factories.BasicBudgetFactory(government_value=gov))
+            request = Request(APIRequestFactory().get(f"/api/v1/budgets/?government={gov.id}"))
+            with CaptureQueriesContext(connection) as ctx:
+                ids = set(
+                    BudgetFilter()
+                    .filter_queryset(request, models.BudgetBase.objects.all(), None)
+                    .values_list("id", flat=True)
+                )
+            self.assertEqual(len(ids), models.BudgetBase.objects.count())
+            self.assertEqual(len(ctx.captured_queries), 1)
+            counts.append(len(ctx.captured_queries[0]["sql"]))
+        self.assertEqual(counts[0], counts[1])
+
     def test_list_can_filter_by_source_budget(self) -> None:
         ordering = CreatedAtPagination.ordering
         page_size = CreatedAtPagination.page_size
@@ -2262,6 +3473,17 @@ class AtomicBudgetItemCrudTestCase(BudgetMapperTestUserAPITestCase):
         actual = res_json["results"]
         self.assertEqual(actual, expected)
 
+    def test_retrieve_loads_each_object_once(self):
+        cs = factories.ClassificationSystemFactory()
+        budget = factories.BasicBudgetFactory(classification_system=cs)
+        item = factories.AtomicBudgetItemFactory(
+            budget=budget, classification=factories.ClassificationFactory(classification_system=cs)
+        )
+        # budget type, item, budget subclass row and classification
+        with self.assertNumQueries(4):
+            res = self.client.get(f"/api/v1/budgets/{budget.id}/items/{item.id}/", format="json")
+        self.assertEqual(res.json()["budget"]["id"], budget.id)
+
     def test_retrieve(self):
         cs = factories.ClassificationSystemFactory()
         budget = factories.BasicBudgetFactory(classification_system=cs)
@@ -2401,6 +3623,21 @@ class AtomicBudgetItemCrudTestCase(BudgetMapperTestUserAPITestCase):
             actual = res.json()
             self.assertEqual(actual, expected)
 
+    def test_list_query_count_does_not_depend_on_the_page(self):
+        cs = factories.ClassificationSystemFactory()
+        budget = factories.BasicBudgetFactory(classification_system=cs)
+        counts = []
+        for n in (1, CreatedAtPagination.page_size):
+            for _ in range(n):
+                factories.AtomicBudgetItemFactory(
+                    budget=budget, classification=factories.ClassificationFactory(classification_system=cs)
+                )
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.client.get(f"/api/v1/budgets/{budget.id}/items/", format="json")
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
 
 class MappedBudgetItemCrudTestCase(BudgetMapperTestUserAPITestCase):
     def test_list(self):
@@ -2449,7 +3686,7 @@ class MappedBudgetItemCrudTestCase(BudgetMapperTestUserAPITestCase):
             {
                 "id": b.id,
                 "budget": bud1.id,
-                "sourceClassifications": [c.id for c in b.source_classifications.all()],
+                "sourceClassifications": [c.id for c in b.source_classifications.order_by("item_order")],
                 "classification": b.classification.id,
                 "createdAt": b.created_at.strftime(datetime_format),
                 "updatedAt": b.updated_at.strftime(datetime_format),
@@ -2635,7 +3872,7 @@ class MappedBudgetItemCrudTestCase(BudgetMapperTestUserAPITestCase):
 
     def test_update_adding_source_classifications(self):
         mbi = factories.MappedBudgetItemFactory()
-        cl_orig = [c.id for c in mbi.source_classifications.all()]
+        cl_orig = [c.id for c in mbi.source_classifications.order_by("item_order")]
         cl = factories.ClassificationFactory(classification_system=mbi.budget.source_budget.classification_system)
         query = {"sourceClassifications": cl_orig + [cl.id]}
         dt = datetime(2021, 1, 31, 12, 23, 34, 5678)
@@ -2654,6 +3891,28 @@ class MappedBudgetItemCrudTestCase(BudgetMapperTestUserAPITestCase):
             actual = res.json()
             self.assertEqual(actual, expected)
 
+    def test_list_query_count_does_not_depend_on_the_page(self):
+        cs0 = factories.ClassificationSystemFactory()
+        cl0 = factories.ClassificationFactory(classification_system=cs0)
+        cs1 = factories.ClassificationSystemFactory()
+        budget = factories.MappedBudgetFactory(
+            classification_system=cs1, source_budget=factories.BasicBudgetFactory(classification_system=cs0)
+        )
+        counts = []
+        for n in (1, CreatedAtPagination.page_size):
+            for _ in range(n):
+                mbi = models.MappedBudgetItem(
+                    budget=budget, classification=factories.ClassificationFactory(classification_system=cs1)
+                )
+                mbi.save()
+                mbi.source_classifications.set([cl0])
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.client.get(f"/api/v1/budgets/{budget.id}/items/", format="json")
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res.json()["results"][0]["sourceClassifications"], [cl0.id])
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
 
 class IconImageCrudTestCase(BudgetMapperTestUserAPITestCase):
     def test_list(self) -> None:
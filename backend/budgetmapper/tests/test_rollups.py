@@ -0,0 +1,145 @@
+import doctest
+import threading
+from collections import Counter
+
+from budgetmapper import models, rollups
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from . import factories
+
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(doctest.DocTestSuite(rollups))
+    return tests
+
+
+class CompareBudgetsTestCase(TestCase):
+    def test_same_classification_system(self):
+        cs = factories.ClassificationSystemFactory()
+        cl0 = factories.ClassificationFactory(classification_system=cs, code="1")
+        cl00 = factories.ClassificationFactory(classification_system=cs, parent=cl0, code="1.1")
+        cl01 = factories.ClassificationFactory(classification_system=cs, parent=cl0, code="1.2")
+        cl1 = factories.ClassificationFactory(classification_system=cs, code="2")
+        bud0 = factories.BasicBudgetFactory(classification_system=cs)
+        bud1 = factories.BasicBudgetFactory(classification_system=cs)
+        factories.AtomicBudgetItemFactory(budget=bud0, classification=cl00, value=10)
+        factories.AtomicBudgetItemFactory(budget=bud0, classification=cl01, value=5)
+        factories.AtomicBudgetItemFactory(budget=bud1, classification=cl00, value=12)
+        factories.AtomicBudgetItemFactory(budget=bud1, classification=cl1, value=1)
+
+        actual = rollups.compare_budgets([bud0, bud1])
+        self.assertEqual(actual["aligned_on"], "classification")
+        self.assertEqual(actual["total_amounts"], [15.0, 13.0])
+        self.assertEqual(
+            [(n["id"], n["parent"], n["amounts"], n["deltas"]) for n in actual["nodes"]],
+            [
+                (cl0.id, None, [15.0, 12.0], [0.0, -3.0]),
+                (cl00.id, 0, [10.0, 12.0], [0.0, 2.0]),
+                (cl01.id, 0, [5.0, 0.0], [0.0, -5.0]),
+                (cl1.id, None, [0.0, 1.0], [0.0, 1.0]),
+            ],
+        )
+
+    def test_different_classification_systems_are_aligned_on_codes(self):
+        cs0 = factories.ClassificationSystemFactory()
+        a0 = factories.ClassificationFactory(classification_system=cs0, code="1")
+        a00 = factories.ClassificationFactory(classification_system=cs0, parent=a0, code="1")
+        cs1 = factories.ClassificationSystemFactory()
+        b0 = factories.ClassificationFactory(classification_system=cs1, code="1")
+        b00 = factories.ClassificationFactory(classification_system=cs1, parent=b0, code="1")
+        b01 = factories.ClassificationFactory(classification_system=cs1, parent=b0, code="2")
+        bud0 = factories.BasicBudgetFactory(classification_system=cs0)
+        bud1 = factories.BasicBudgetFactory(classification_system=cs1)
+        factories.AtomicBudgetItemFactory(budget=bud0, classification=a00, value=3)
+        factories.AtomicBudgetItemFactory(budget=bud1, classification=b00, value=4)
+        factories.AtomicBudgetItemFactory(budget=bud1, classification=b01, value=6)
+
+        actual = rollups.compare_budgets([bud0, bud1])
+        self.assertEqual(actual["aligned_on"], "code")
+        self.assertEqual(
+            [(n["id"], n["code"], n["name"], n["parent"], n["amounts"]) for n in actual["nodes"]],
+            [
+                (None, "1", a0.name, None, [3.0, 10.0]),
+                (None, "1", a00.name, 0, [3.0, 4.0]),
+                (None, "2", b01.name, 0, [0.0, 6.0]),
+            ],
+        )
+
+
+class RefreshClassificationAmountsTestCase(TestCase):
+    def test_refresh(self):
+        cs = factories.ClassificationSystemFactory()
+        cl0 = factories.ClassificationFactory(classification_system=cs, code="1")
+        cl00 = factories.ClassificationFactory(classification_system=cs, parent=cl0, code="1")
+        cl1 = factories.ClassificationFactory(classification_system=cs, code="2")
+        bud = factories.BasicBudgetFactory(classification_system=cs)
+        factories.AtomicBudgetItemFactory(budget=bud, classification=cl00, value=3)
+        factories.AtomicBudgetItemFactory(budget=bud, classification=cl1, value=4)
+        bud.refresh_from_db()
+
+        self.assertEqual(rollups.refresh_classification_amounts(bud), 4)
+        self.assertEqual(rollups.refresh_classification_amounts(bud), 4)
+        actual = models.ClassificationAmount.objects.filter(budget=bud)
+        self.assertEqual(
+            sorted((d.classification_id or "", d.path, d.level, d.child_count, d.amount) for d in actual),
+            sorted(
+                [
+                    ("", [], None, 2, 7.0),
+                    (cl0.id, ["1"], 0, 1, 3.0),
+                    (cl00.id, ["1", "1"], 1, 0, 3.0),
+                    (cl1.id, ["2"], 0, 0, 4.0),
+                ]
+            ),
+        )
+        self.assertTrue(all(d.version == bud.updated_at for d in actual))
+
+    def test_get_classification_amounts_serves_stored_rows(self):
+        cl = factories.ClassificationFactory()
+        bud = factories.BasicBudgetFactory(classification_system=cl.classification_system)
+        item = factories.AtomicBudgetItemFactory(budget=bud, classification=cl, value=3)
+        bud.refresh_from_db()
+        self.assertTrue(rollups.amounts_are_stale(bud))
+        self.assertFalse(rollups.get_classification_amounts(bud).exists())
+        rollups.refresh_classification_amounts(bud)
+        self.assertFalse(rollups.amounts_are_stale(bud))
+
+        item.value = 5
+        item.save()
+        bud.refresh_from_db()
+        with self.assertNumQueries(2):
+            self.assertTrue(rollups.amounts_are_stale(bud))
+            self.assertEqual(rollups.get_classification_amounts(bud).get(classification=cl).amount, 3.0)
+
+
+class ConcurrentRefreshTestCase(TransactionTestCase):
+    def test_concurrent_refreshes_store_one_row_per_classification(self):
+        cs = factories.ClassificationSystemFactory()
+        cl0 = factories.ClassificationFactory(classification_system=cs, code="1")
+        factories.ClassificationFactory(classification_system=cs, parent=cl0, code="1")
+        bud = factories.BasicBudgetFactory(classification_system=cs)
+        factories.AtomicBudgetItemFactory(budget=bud, classification=cl0, value=3)
+        bud.refresh_from_db()
+        barrier = threading.Barrier(2)
+        errors = []
+
+        def refresh():
+            try:
+                barrier.wait()
+                rollups.refresh_classification_amounts(models.BasicBudget.objects.get(pk=bud.pk))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=refresh) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        stored = Counter(
+            models.ClassificationAmount.objects.filter(budget=bud).values_list("classification", flat=True)
+        )
+        self.assertEqual(len(stored), 3)
+        self.assertTrue(all(n == 1 for n in stored.values()))
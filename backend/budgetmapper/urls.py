@@ -9,10 +9,16 @@ router.register(r"classification-systems", views.ClassificationSystemViewSet)
 router.register(r"budgets", views.BudgetViewSet)
 router.register(r"wdmmg", views.WdmmgView)
 router.register(r"icon-images", views.IconImageViewSet)
+router.register(r"budget-imports", views.BudgetImportView, basename="budget-import")
+router.register(r"budget-xlsx-imports", views.BudgetXlsxImportView, basename="budget-xlsx-import")
+router.register(r"jobs", views.JobViewSet)
+router.register(r"compare", views.CompareView, basename="compare")
+router.register(r"classification-search", views.ClassificationSearchView, basename="classification-search")
 
 government_router = routers.NestedDefaultRouter(router, r"governments", lookup="government")
 government_router.register(r"default-budget", views.DefaultBudgetView, basename="government-default-budget")
 government_router.register(r"budgets", views.GovernmentBudgetView, basename="government-budget-list")
+government_router.register(r"series", views.GovernmentSeriesView, basename="government-series")
 
 classification_system_router = routers.NestedDefaultRouter(
     router, r"classification-systems", lookup=r"classification_system"
@@ -22,12 +28,19 @@ classification_system_router.register(
     views.ClassificationViewSet,
     basename="classification-system-classification",
 )
+classification_system_router.register(
+    r"bulk-create",
+    views.ClassificationBulkCreateView,
+    basename="classification-system-bulk-create",
+)
 budget_router = routers.NestedDefaultRouter(router, r"budgets", lookup="budget")
 budget_router.register(r"items", views.BudgetItemViewSet, basename="budget-item")
 budget_router.register(
     r"mapped-budget-candidates", views.MappedgBudgetCandidateView, basename="budget-mapping-budget-candidate"
 )
 budget_router.register(r"bulk-create", views.MappedbudgetItemBulkCreateView, basename="budget-bulk-create")
+budget_router.register(r"top", views.BudgetTopView, basename="budget-top")
+budget_router.register(r"nodes", views.BudgetNodeView, basename="budget-node")
 
 urlpatterns = [
     path("api/v1/", include(router.urls)),
@@ -36,5 +49,8 @@ urlpatterns = [
     path("api/v1/", include(budget_router.urls)),
     path("transfer/xlsx_template", views.download_xlsx_template_view),
     path("transfer/csv/<str:budget_id>", views.download_csv_view),
+    path("transfer/xlsx/<str:budget_id>", views.download_xlsx_view),
+    path("transfer/parquet/<str:budget_id>", views.download_table_view, {"format": "parquet"}),
+    path("transfer/arrow/<str:budget_id>", views.download_table_view, {"format": "arrow"}),
     path("icons/<str:icon_slug_or_id>", views.icon_view),
 ]
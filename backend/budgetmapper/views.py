@@ -1,23 +1,40 @@
 import csv
+import json
 import operator
 from functools import reduce
-from io import BytesIO, StringIO
+from io import StringIO
 
-from django.db.models import Q
-from django.http import FileResponse, HttpResponse
+from django.db.models import Case, OuterRef, Prefetch, Q, Subquery, When
+from django.db.models.functions import Length
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from djangorestframework_camel_case.util import camel_to_underscore, camelize
 from rest_framework import filters, mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
+from rest_framework.serializers import ListSerializer
+from rest_framework.utils import encoders
 
-from . import models, serializers
+from . import exports, jobs, loaders, models, rollups, serializers
+from .identity import identity_map
 
 
 class RelativePathNextLinkPagination(CursorPagination):
+    page_size_query_param = "pageSize"
+    max_page_size = 1000
+
     def paginate_queryset(self, queryset, request, view=None):
         self.request = request
         return super().paginate_queryset(queryset, request, view)
 
+    def get_ordering(self, request, queryset, view):
+        ordering = super(RelativePathNextLinkPagination, self).get_ordering(request, queryset, view)
+        # the id breaks ties in the same direction, so that pages are read in order from a (created_at, id) index
+        # instead of being sorted
+        return tuple(ordering) + ("-id" if ordering[0].startswith("-") else "id",)
+
     def get_next_link(self):
         self.base_url = self.request.get_full_path()
         return super(RelativePathNextLinkPagination, self).get_next_link()
@@ -42,6 +59,100 @@ class UpdatedAtPagination(RelativePathNextLinkPagination):
     ordering = "-updated_at"
 
 
+def is_async_request(request) -> bool:
+    return request.query_params.get("async", "").lower() in ("1", "true", "yes")
+
+
+def job_accepted_response(job: models.Job) -> Response:
+    return Response(
+        serializers.JobSerializer(job).data,
+        status=status.HTTP_202_ACCEPTED,
+        headers={"Location": f"/api/v1/jobs/{job.id}"},
+    )
+
+
+def dump_json(data) -> str:
+    # same output as CamelCaseJSONRenderer
+    return json.dumps(camelize(data), cls=encoders.JSONEncoder, ensure_ascii=False, separators=(",", ":"))
+
+
+def stream_json_with_items(data: dict, items, serializer, chunk_size: int = 1000):
+    """Yields ``data`` as a JSON object with ``items`` appended, serializing the items from a server-side cursor."""
+    head = dump_json(data)
+    yield head[:-1] + (',"items":[' if len(data) > 0 else '"items":[')
+    buf = []
+    for idx, item in enumerate(items.iterator(chunk_size=chunk_size)):
+        buf.append(("," if idx > 0 else "") + dump_json(serializer.to_representation(item)))
+        if len(buf) >= chunk_size:
+            yield "".join(buf)
+            buf = []
+    yield "".join(buf) + "]}"
+
+
+class SparseFieldsetMixin(object):
+    """Keeps only the fields listed in ``?fields=`` (or drops those in ``?omit=``) of GET responses.
+
+    Field names are the camelCase names of the response. Dropped fields are not computed at all, and list queries
+    only load the columns the remaining fields are read from.
+    """
+
+    def get_sparse_fieldset(self):
+        if self.request is None or self.request.method != "GET":
+            return None, set()
+        params = self.request.query_params
+        fields = None
+        if "fields" in params:
+            fields = {camel_to_underscore(f.strip()) for f in params["fields"].split(",") if f.strip() != ""}
+        omit = {camel_to_underscore(f.strip()) for f in params.get("omit", "").split(",") if f.strip() != ""}
+        return fields, omit
+
+    def prune_fields(self, serializer):
+        fields, omit = self.get_sparse_fieldset()
+        if fields is None and len(omit) == 0:
+            return serializer
+        target = serializer.child if isinstance(serializer, ListSerializer) else serializer
+        for name in list(target.fields.keys()):
+            if (fields is not None and name not in fields) or name in omit:
+                target.fields.pop(name)
+        return serializer
+
+    def get_serializer(self, *args, **kwargs):
+        return self.prune_fields(super(SparseFieldsetMixin, self).get_serializer(*args, **kwargs))
+
+    def get_sparse_columns(self, queryset):
+        """Returns the columns to load for the remaining fields, or None if some field has an unknown source."""
+        opts = queryset.model._meta
+        serializer = self.prune_fields(self.get_serializer_class()(context=self.get_serializer_context()))
+        ordering = getattr(self.paginator, "ordering", None)
+        ordering = [ordering] if isinstance(ordering, str) else list(ordering or [])
+        sources = [f.source.split(".")[0] for f in serializer.fields.values()] + [o.lstrip("-") for o in ordering]
+        columns = {opts.pk.name}
+        for source in sources:
+            if source == "*":
+                return None
+            if source in queryset.query.annotations:
+                continue
+            field = next((f for f in opts.get_fields() if source in (f.name, getattr(f, "attname", None))), None)
+            if field is None:
+                return None
+            if field.concrete and not field.many_to_many:
+                columns.add(field.name)
+        return columns
+
+    def filter_queryset(self, queryset):
+        queryset = super(SparseFieldsetMixin, self).filter_queryset(queryset)
+        fields, omit = self.get_sparse_fieldset()
+        # polymorphic querysets need the full rows to build the subclass instances
+        if (
+            self.action != "list"
+            or (fields is None and len(omit) == 0)
+            or not getattr(queryset, "polymorphic_disabled", True)
+        ):
+            return queryset
+        columns = self.get_sparse_columns(queryset)
+        return queryset if columns is None else queryset.only(*columns)
+
+
 class MultipleFieldLookupMixin(object):
     # refs: https://stackoverflow.com/a/38462137
     def get_object(self):
@@ -51,10 +162,13 @@ class MultipleFieldLookupMixin(object):
         for field in self.lookup_fields:
             filter[field] = self.kwargs[self.param_field_name_in_path]
         q = reduce(operator.or_, (Q(x) for x in filter.items()))
-        return get_object_or_404(queryset, q)
+        # get_serializer_class may need the object too; look it up once per request
+        if getattr(self, "_object", None) is None:
+            self._object = identity_map(self.request).add(get_object_or_404(queryset, q))
+        return self._object
 
 
-class IconImageViewSet(viewsets.ReadOnlyModelViewSet):
+class IconImageViewSet(SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = models.IconImage.objects.all()
     pagination_class = CreatedAtPagination
 
@@ -71,14 +185,14 @@ class GovernmentFilter(filters.BaseFilterBackend):
         return queryset
 
 
-class GovernmentViewSet(viewsets.ModelViewSet):
+class GovernmentViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = models.Government.objects.all()
     serializer_class = serializers.GovernmentSerializer
     pagination_class = CreatedAtPagination
     filter_backends = [GovernmentFilter]
 
 
-class ClassificationSystemViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
+class ClassificationSystemViewSet(SparseFieldsetMixin, MultipleFieldLookupMixin, viewsets.ModelViewSet):
     queryset = models.ClassificationSystem.objects.all()
     serializer_class = serializers.ClassificationSystemSerializer
     pagination_class = CreatedAtPagination
@@ -90,8 +204,35 @@ class ClassificationSystemViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSe
             return serializers.ClassificationSystemDetailSerializer
         return serializers.ClassificationSystemSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        mode = request.query_params.get("items", "all")
+        if mode == "all":
+            return super(ClassificationSystemViewSet, self).retrieve(request, *args, **kwargs)
+        if mode not in ("none", "page", "stream"):
+            return Response({"error": "items"}, status=status.HTTP_400_BAD_REQUEST)
+        instance = self.get_object()
+        data = serializers.ClassificationSystemSerializer(instance).data
+        if mode == "none":
+            return Response(data)
+        items = models.Classification.objects.filter(classification_system=instance)
+        if mode == "page":
+            paginator = ItemOrderPagination()
+            page = paginator.paginate_queryset(items, request, view=self)
+            return Response(
+                dict(
+                    data,
+                    items=serializers.ClassificationSerializer(page, many=True).data,
+                    next=paginator.get_next_link(),
+                    previous=paginator.get_previous_link(),
+                )
+            )
+        return StreamingHttpResponse(
+            stream_json_with_items(data, items.order_by("item_order"), serializers.ClassificationSerializer()),
+            content_type="application/json",
+        )
+
 
-class MappedgBudgetCandidateView(mixins.ListModelMixin, viewsets.GenericViewSet):
+class MappedgBudgetCandidateView(SparseFieldsetMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     serializer_class = serializers.ClassificationSystemSerializer
     pagination_class = CreatedAtPagination
 
@@ -110,6 +251,8 @@ class MappedbudgetItemBulkCreateView(mixins.CreateModelMixin, viewsets.GenericVi
         if "data" not in request.data:
             return Response({"error": "data"}, status=status.HTTP_400_BAD_REQUEST)
         data = request.data["data"]
+        if is_async_request(request):
+            return job_accepted_response(jobs.enqueue("bulk_create_mapping", {"budget": budget.id, "data": data}))
         try:
             return Response(
                 serializers.MappedBudgetBulkCreateResponseSerializer({"results": budget.bulk_create(data)}).data,
@@ -119,7 +262,234 @@ class MappedbudgetItemBulkCreateView(mixins.CreateModelMixin, viewsets.GenericVi
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ClassificationViewSet(viewsets.ModelViewSet):
+class ClassificationBulkCreateView(mixins.CreateModelMixin, viewsets.GenericViewSet):
+    def create(self, request, classification_system_pk):
+        cs = get_object_or_404(models.ClassificationSystem.objects, pk=classification_system_pk)
+        if "data" not in request.data:
+            return Response({"error": "data"}, status=status.HTTP_400_BAD_REQUEST)
+        data = request.data["data"]
+        if is_async_request(request):
+            return job_accepted_response(
+                jobs.enqueue("bulk_create_classification_tree", {"classification_system": cs.id, "data": data})
+            )
+        try:
+            return Response(
+                serializers.ClassificationBulkCreateResponseSerializer({"results": cs.bulk_create_tree(data)}).data,
+                status=status.HTTP_201_CREATED,
+            )
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class GovernmentSeriesView(viewsets.GenericViewSet):
+    pagination_class = None
+    queryset = None
+
+    def get_series(self, government_slug: str, codes: list, classification_system: str = None) -> list:
+        qs = models.BudgetBase.objects.non_polymorphic().filter(government_value__slug=government_slug)
+        if classification_system is None:
+            qs = qs.instance_of(models.BasicBudget)
+        else:
+            qs = qs.filter(
+                Q(classification_system=classification_system) | Q(classification_system__slug=classification_system)
+            )
+        amounts = models.ClassificationAmount.objects.filter(budget=OuterRef("pk"))
+        node = amounts.filter(path=codes)
+        return list(
+            qs.annotate(
+                amounts_version=Subquery(amounts.filter(classification=None).values("version")[:1]),
+                classification=Subquery(node.values("classification")[:1]),
+                classification_name=Subquery(node.values("classification__name")[:1]),
+                amount=Subquery(node.values("amount")[:1]),
+            )
+            .order_by("year_value", "created_at", "id")
+            .values(
+                "id",
+                "name",
+                "slug",
+                "year_value",
+                "updated_at",
+                "amounts_version",
+                "classification",
+                "classification_name",
+                "amount",
+            )
+        )
+
+    def list(self, request, *args, **kwargs):
+        government_slug = self.kwargs["government_pk"]
+        codes = request.query_params.getlist("code")
+        if len(codes) == 0:
+            raise ValidationError({"code": "give the path of codes from the root, e.g. ?code=3&code=1"})
+        classification_system = request.query_params.get("classificationSystem")
+        # the stored totals are refreshed by the wdmmg cache job queued when a budget changes, so those of a budget
+        # changed since are served as they are and marked stale
+        series = self.get_series(government_slug, codes, classification_system)
+        if len(series) == 0:
+            get_object_or_404(models.Government.objects, slug=government_slug)
+        return Response(
+            {
+                "code": codes,
+                "series": [
+                    {
+                        "budget": d["id"],
+                        "name": d["name"],
+                        "slug": d["slug"],
+                        "year": d["year_value"],
+                        "classification": d["classification"],
+                        "classification_name": d["classification_name"],
+                        "amount": d["amount"],
+                        "stale": d["amounts_version"] != d["updated_at"],
+                    }
+                    for d in series
+                ],
+            }
+        )
+
+
+class BudgetTopView(viewsets.GenericViewSet):
+    pagination_class = None
+    queryset = None
+    default_n = 20
+    max_n = 100
+
+    def list(self, request, budget_pk):
+        try:
+            n = int(request.query_params.get("n", self.default_n))
+            level = request.query_params.get("level")
+            level = None if level in (None, "") else int(level)
+        except ValueError:
+            raise ValidationError({"n": "n and level must be integers"})
+        if not 1 <= n <= self.max_n:
+            raise ValidationError({"n": f"give between 1 and {self.max_n}"})
+        if level is not None and level < 0:
+            raise ValidationError({"level": "0 for the roots"})
+        budget = get_object_or_404(models.BudgetBase.objects.non_polymorphic(), pk=budget_pk)
+        amounts = rollups.get_classification_amounts(budget)
+        # the leaves or the nodes of one level, read from an index in the order of the amounts
+        amounts = amounts.filter(level__isnull=False, child_count=0) if level is None else amounts.filter(level=level)
+        top = amounts.order_by("-amount", "path").values(
+            "classification", "classification__code", "classification__name", "path", "level", "child_count", "amount"
+        )[:n]
+        return Response(
+            {
+                "budget": budget.id,
+                "level": level,
+                "stale": rollups.amounts_are_stale(budget),
+                "results": [
+                    {
+                        "classification": d["classification"],
+                        "code": d["classification__code"],
+                        "name": d["classification__name"],
+                        "path": d["path"],
+                        "level": d["level"],
+                        "is_leaf": d["child_count"] == 0,
+                        "amount": d["amount"],
+                    }
+                    for d in top
+                ],
+            }
+        )
+
+
+class BudgetNodeView(viewsets.GenericViewSet):
+    """The stored subtree total of a classification of the budget and those of its direct children."""
+
+    pagination_class = None
+    serializer_class = serializers.ClassificationAmountSerializer
+
+    def get_budget(self):
+        if getattr(self, "_budget", None) is None:
+            self._budget = get_object_or_404(models.BudgetBase.objects.non_polymorphic(), pk=self.kwargs["budget_pk"])
+        return self._budget
+
+    def get_queryset(self):
+        return rollups.get_classification_amounts(self.get_budget()).select_related("classification")
+
+    def retrieve(self, request, budget_pk, pk):
+        node = get_object_or_404(self.get_queryset(), classification=pk)
+        return Response(dict(self.get_serializer(node).data, stale=node.version != self.get_budget().updated_at))
+
+    @action(detail=True)
+    def children(self, request, budget_pk, pk):
+        children = list(
+            self.get_queryset()
+            .filter(classification__parent=pk)
+            .order_by("classification__item_order", "classification_id")
+        )
+        if len(children) == 0:
+            # a leaf, or a classification of another system
+            if not self.get_queryset().filter(classification=pk).exists():
+                raise Http404
+        return Response(
+            {
+                "budget": budget_pk,
+                "parent": pk,
+                "stale": any(c.version != self.get_budget().updated_at for c in children),
+                "results": self.get_serializer(children, many=True).data,
+            }
+        )
+
+
+class BudgetImportView(mixins.CreateModelMixin, viewsets.GenericViewSet):
+    def create(self, request):
+        if "spec" not in request.data:
+            return Response({"error": "spec"}, status=status.HTTP_400_BAD_REQUEST)
+        if "file" not in request.FILES:
+            return Response({"error": "file must be an uploaded file"}, status=status.HTTP_400_BAD_REQUEST)
+        spec = request.data["spec"]
+        try:
+            spec = loaders.read_spec(StringIO(spec if isinstance(spec, str) else json.dumps(spec)))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        job = jobs.enqueue_budget_import(
+            spec,
+            request.FILES["file"].read(),
+            diff=str(request.data.get("diff", "")).lower() in ("1", "true", "yes"),
+            encoding=request.data.get("encoding", "utf-8"),
+        )
+        return job_accepted_response(job)
+
+
+class BudgetXlsxImportView(mixins.CreateModelMixin, viewsets.GenericViewSet):
+    max_reported_errors = 1000
+
+    def create(self, request):
+        if "spec" not in request.data:
+            return Response({"error": "spec"}, status=status.HTTP_400_BAD_REQUEST)
+        if "file" not in request.FILES:
+            return Response({"error": "file must be an uploaded file"}, status=status.HTTP_400_BAD_REQUEST)
+        spec = request.data["spec"]
+        errors = []
+        try:
+            spec = json.loads(spec) if isinstance(spec, str) else spec
+            if not isinstance(spec, dict):
+                raise ValueError("spec must be a JSON object")
+            spec, rows = loaders.read_xlsx(request.FILES["file"], spec)
+            parsed = loaders.parse_rows(spec, rows, errors=errors)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if len(errors) > 0:
+            return Response(
+                {"error_count": len(errors), "errors": errors[: self.max_reported_errors]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            stats = loaders.load_parsed(
+                spec, parsed, diff=str(request.data.get("diff", "")).lower() in ("1", "true", "yes")
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        jobs.enqueue_wdmmg_cache_rebuilds(spec)
+        return Response(stats, status=status.HTTP_201_CREATED)
+
+
+class JobViewSet(SparseFieldsetMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    queryset = models.Job.objects.all()
+    serializer_class = serializers.JobSerializer
+
+
+class ClassificationViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     def get_queryset(self):
         return models.Classification.objects.filter(classification_system=self.kwargs["classification_system_pk"])
 
@@ -146,26 +516,40 @@ class BudgetFilter(filters.BaseFilterBackend):
                     ).values("id")
                 )
             )
-        basic_qs = models.BasicBudget.objects
         if "government" in request.query_params:
-            basic_qs = basic_qs.filter(government_value_id=request.query_params["government"])
+            queryset = queryset.filter(government_value_id=request.query_params["government"])
         if "year" in request.query_params:
             try:
-                basic_qs = basic_qs.filter(year_value=int(request.query_params["year"]))
+                queryset = queryset.filter(year_value=int(request.query_params["year"]))
             except ValueError:
                 return queryset.filter(pk=None)
-        ids = list(d["id"] for d in basic_qs.values("id"))
-        ids += list(d["id"] for d in models.MappedBudget.objects.filter(source_budget__in=ids).values("id"))
-        return queryset.filter(Q(pk__in=ids))
+        return queryset
 
 
-class BudgetViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
+class BudgetViewSet(SparseFieldsetMixin, MultipleFieldLookupMixin, viewsets.ModelViewSet):
     queryset = models.BudgetBase.objects.all()
     pagination_class = CreatedAtPagination
     filter_backends = [BudgetFilter]
     lookup_fields = ("pk", "slug")
     param_field_name_in_path = "pk"
 
+    def get_queryset(self):
+        if self.action == "list":
+            # BudgetListSerializer only needs the base columns and the source budget of mapped budgets,
+            # so a flat query with a join replaces the per-subclass polymorphic fetches
+            return models.BudgetBase.flat_objects()
+        return super(BudgetViewSet, self).get_queryset()
+
+    def get_object(self):
+        bud = super(BudgetViewSet, self).get_object()
+        im = identity_map(self.request)
+        im.prime(bud, "classification_system", "government_value")
+        if isinstance(bud, models.MappedBudget):
+            # the source budget usually belongs to the same government, which is then not fetched again
+            im.prime(bud, "source_budget")
+            im.prime(bud.source_budget, "classification_system", "government_value")
+        return bud
+
     def get_serializer_class(self):
         if "pk" not in self.kwargs and "slug" not in self.kwargs:
             if self.action == "create":
@@ -183,12 +567,31 @@ class BudgetViewSet(MultipleFieldLookupMixin, viewsets.ModelViewSet):
         return serializers.MappedBudgetSerializer
 
 
-class BudgetItemViewSet(viewsets.ModelViewSet):
+class BudgetItemViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     pagination_class = CreatedAtPagination
 
+    def get_budget_class(self):
+        try:
+            bud = identity_map(self.request).get(
+                models.BudgetBase,
+                self.kwargs["budget_pk"],
+                queryset=models.BudgetBase.objects.non_polymorphic(),
+                real_instance=False,
+            )
+        except models.BudgetBase.DoesNotExist:
+            raise Http404
+        return bud.get_real_instance_class()
+
+    def get_item_class(self):
+        if issubclass(self.get_budget_class(), models.BasicBudget):
+            return models.AtomicBudgetItem
+        return models.MappedBudgetItem
+
+    def get_object(self):
+        return identity_map(self.request).prime(super(BudgetItemViewSet, self).get_object(), "budget", "classification")
+
     def get_serializer_class(self):
-        bud = get_object_or_404(models.BudgetBase.objects, pk=self.kwargs["budget_pk"])
-        if isinstance(bud, models.BasicBudget):
+        if issubclass(self.get_budget_class(), models.BasicBudget):
             if self.action == "retrieve":
                 return serializers.AtomicBudgetItemRetrieveSerializer
             if self.action in {"create", "update", "partial_update"}:
@@ -204,40 +607,163 @@ class BudgetItemViewSet(viewsets.ModelViewSet):
             return serializers.MappedBudgetItemListSerializer
 
     def get_queryset(self):
-        return models.BudgetItemBase.objects.filter(budget=self.kwargs["budget_pk"])
+        if self.action == "list":
+            if issubclass(self.get_budget_class(), models.BasicBudget):
+                return models.AtomicBudgetItem.objects.non_polymorphic().filter(budget=self.kwargs["budget_pk"])
+            return (
+                models.MappedBudgetItem.objects.non_polymorphic()
+                .filter(budget=self.kwargs["budget_pk"])
+                .prefetch_related(
+                    Prefetch("source_classifications", models.Classification.objects.only("id", "item_order"))
+                )
+            )
+        return self.get_item_class().objects.filter(budget=self.kwargs["budget_pk"])
 
 
-class WdmmgView(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+class WdmmgView(SparseFieldsetMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     queryset = models.BudgetBase.objects.all()
     pagination_class = CreatedAtPagination
     serializer_class = serializers.WdmmgSerializer
     lookup_field = "slug"
 
+    def get_serializer_context(self):
+        context = super(WdmmgView, self).get_serializer_context()
+        depth = self.request.query_params.get("depth")
+        if depth is not None:
+            if not depth.isdigit() or int(depth) < 1:
+                raise ValidationError({"depth": "depth must be a positive integer"})
+            context["depth"] = int(depth)
+        context["root"] = self.request.query_params.get("root")
+        return context
+
+
+class CompareView(viewsets.GenericViewSet):
+    queryset = models.BudgetBase.objects.all()
+    max_budgets = 20
+
+    def list(self, request):
+        ids = [i for i in request.query_params.get("budgets", "").split(",") if i != ""]
+        if not 2 <= len(ids) <= self.max_budgets:
+            raise ValidationError({"budgets": f"give between 2 and {self.max_budgets} comma-separated budget ids"})
+        found = self.get_queryset().in_bulk(ids)
+        missing = [i for i in ids if i not in found]
+        if len(missing) > 0:
+            raise Http404(f"budgets not found: {', '.join(missing)}")
+        budgets = [found[i] for i in ids]
+        return Response(
+            dict(
+                rollups.compare_budgets(budgets),
+                budgets=serializers.BudgetListSerializer(budgets, many=True).data,
+            )
+        )
+
+
+class ClassificationSearchFilter(filters.BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        if "classificationSystem" in params:
+            queryset = queryset.filter(
+                Q(classification_system=params["classificationSystem"])
+                | Q(classification_system__slug=params["classificationSystem"])
+            )
+        if "government" in params or "year" in params:
+            budgets = models.BudgetBase.objects.non_polymorphic()
+            if "government" in params:
+                budgets = budgets.filter(
+                    Q(government_value=params["government"]) | Q(government_value__slug=params["government"])
+                )
+            if "year" in params:
+                try:
+                    budgets = budgets.filter(year_value=int(params["year"]))
+                except ValueError:
+                    return queryset.none()
+            queryset = queryset.filter(classification_system__in=budgets.values("classification_system"))
+        return queryset
+
+
+class ClassificationSearchView(viewsets.GenericViewSet):
+    pagination_class = None
+    filter_backends = [ClassificationSearchFilter]
+    serializer_class = serializers.ClassificationSearchResultSerializer
+    default_limit = 20
+    max_limit = 100
+
+    def get_queryset(self):
+        return models.Classification.search(self.query).select_related("classification_system")
+
+    def list(self, request):
+        self.query = request.query_params.get("q", "").strip()
+        if self.query == "":
+            raise ValidationError({"q": "give the text to search for"})
+        try:
+            limit = int(request.query_params.get("limit", self.default_limit))
+        except ValueError:
+            raise ValidationError({"limit": "must be an integer"})
+        limit = max(1, min(limit, self.max_limit))
+        results = self.filter_queryset(self.get_queryset()).order_by(
+            # names containing the text first, then the readings only, shorter names first
+            Case(When(name__icontains=self.query, then=0), default=1),
+            Length("name"),
+            "classification_system",
+            "item_order",
+        )[:limit]
+        return Response({"q": self.query, "results": self.get_serializer(results, many=True).data})
+
 
 def download_xlsx_template_view(request):
     blob = models.Blob.objects.get(id="Jm3YrwfxRJaNbayG7mJNCm")
     return FileResponse(models.BlobReader(blob), as_attachment=True, filename=blob.name)
 
 
+class Echo(object):
+    """A file-like object whose ``write`` returns the value, so that ``csv.writer`` hands back each line."""
+
+    def write(self, value):
+        return value
+
+
+def iterate_csv(budget: models.BudgetBase, chunk_size: int = 1000):
+    writer = csv.writer(Echo(), lineterminator="\n")
+    rows = exports.iterate_rows(budget)
+    yield writer.writerow(next(rows)).encode("utf-8")
+    lines = []
+    for row in rows:
+        lines.append(writer.writerow(row))
+        if len(lines) >= chunk_size:
+            yield "".join(lines).encode("utf-8")
+            lines = []
+    if len(lines) > 0:
+        yield "".join(lines).encode("utf-8")
+
+
 def download_csv_view(request, budget_id):
     budget = get_object_or_404(models.BudgetBase, pk=budget_id)
-    level_names = (
-        budget.classification_system.level_names if budget.classification_system.level_names is not None else []
+    res = StreamingHttpResponse(iterate_csv(budget), content_type="text/csv")
+    res["Content-Disposition"] = f'attachment; filename="{budget.slug}.csv"'
+    return res
+
+
+def download_xlsx_view(request, budget_id):
+    budget = get_object_or_404(models.BudgetBase, pk=budget_id)
+    return FileResponse(
+        exports.write_xlsx(budget),
+        as_attachment=True,
+        filename=f"{budget.slug}.xlsx",
+        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     )
-    data = list(budget.iterate_items())
-    max_level = max(len(d["classifications"]) for d in data)
-    level_names += list(f"level_{i}" for i in range(len(level_names), max_level, 1))
-    buf = StringIO()
-    writer = csv.writer(buf, lineterminator="\n")
-    writer.writerow(sum(([ln, f"{ln}名称"] for ln in level_names), []) + ["金額"])
-    for d in data:
-        writer.writerow(
-            sum(([c.code, c.name] for c in d["classifications"]), [])
-            + [["", ""] for i in range(len(d["classifications"]), max_level, 1)]
-            + [d["budget_item"].amount if d["budget_item"] is not None else 0]
-        )
 
-    return FileResponse(BytesIO(buf.getvalue().encode("utf-8")), as_attachment=True, filename=f"{budget.slug}.csv")
+
+def download_table_view(request, budget_id, format):
+    budget = get_object_or_404(
+        models.BudgetBase.objects.select_related("classification_system", "government_value"), pk=budget_id
+    )
+    blob = exports.get_table_export(budget, format)
+    return FileResponse(
+        models.BlobReader(blob),
+        as_attachment=True,
+        filename=f"{budget.slug}.{exports.TABLE_FORMATS[format]['extension']}",
+        content_type=exports.TABLE_FORMATS[format]["content_type"],
+    )
 
 
 def icon_view(request, icon_slug_or_id):
@@ -275,7 +801,7 @@ class DefaultBudgetView(mixins.CreateModelMixin, viewsets.GenericViewSet):
             return Response(serializer.to_representation(obj), status=status.HTTP_201_CREATED)
 
 
-class GovernmentBudgetView(mixins.ListModelMixin, viewsets.GenericViewSet):
+class GovernmentBudgetView(SparseFieldsetMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     pagination_class = None
     queryset = None
     lookup_fields = "slug"
@@ -285,4 +811,4 @@ class GovernmentBudgetView(mixins.ListModelMixin, viewsets.GenericViewSet):
     def list(self, request, *args, **kwargs):
         government_slug = self.kwargs["government_pk"]
         obj = get_object_or_404(models.Government.objects, slug=government_slug)
-        return Response(serializers.GovernmentBudgetListSerializer(obj).data, status=status.HTTP_200_OK)
+        return Response(self.get_serializer(obj).data, status=status.HTTP_200_OK)
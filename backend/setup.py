@@ -14,6 +14,7 @@ setup(
         "django",
         "python-dotenv",
         "django-shortuuidfield",
+        "shortuuid",
         "djangorestframework",
         "django-filter",
         "djangorestframework-camel-case",
@@ -22,6 +23,10 @@ setup(
         "django-polymorphic",
         "django",
         "django-cors-headers",
+        "msgpack",
+        "pyarrow",
+        "openpyxl",
+        "numpy",
     ],
     extras_require={
         "dev": [
@@ -138,14 +138,21 @@ REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': (
         'djangorestframework_camel_case.render.CamelCaseJSONRenderer',
         'djangorestframework_camel_case.render.CamelCaseBrowsableAPIRenderer',
+        'budgetmapper.renderers.ColumnarJSONRenderer',
+        'budgetmapper.renderers.CamelCaseMessagePackRenderer',
     ),
     'DEFAULT_PARSER_CLASSES': (
         'djangorestframework_camel_case.parser.CamelCaseFormParser',
         'djangorestframework_camel_case.parser.CamelCaseMultiPartParser',
         'djangorestframework_camel_case.parser.CamelCaseJSONParser',
+        'budgetmapper.parsers.CamelCaseMessagePackParser',
     ),
 }
 
+JOB_WORKER_CONCURRENCY = int(os.getenv("APPLICATION_JOB_WORKER_CONCURRENCY", "1"))
+# seconds after its last update that a running job is taken for abandoned by a dead worker and claimed again
+JOB_STALE_TIMEOUT = int(os.getenv("APPLICATION_JOB_STALE_TIMEOUT", "3600"))
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.0/topics/i18n/
 
@@ -0,0 +1,96 @@
+import os
+import statistics
+import time
+from argparse import ArgumentParser
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wdmmgserver.settings")
+django.setup()
+
+from budgetmapper import models  # noqa: E402
+from budgetmapper.views import BudgetFilter  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.test.utils import CaptureQueriesContext, setup_test_environment  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIClient, APIRequestFactory  # noqa: E402
+
+
+def populate(governments: int, years: int):
+    cs = models.ClassificationSystem.objects.create(name="bench", slug="bench")
+    cofog = models.ClassificationSystem.objects.create(name="bench-cofog", slug="bench-cofog")
+    govs = []
+    with transaction.atomic(), models.suspend_touch():
+        for g in range(governments):
+            gov = models.Government.objects.create(name=f"gov{g}", slug=f"gov{g}")
+            govs.append(gov)
+            for y in range(years):
+                bud = models.BasicBudget.objects.create(
+                    name=f"gov{g}-{2000 + y}",
+                    slug=f"gov{g}-{2000 + y}",
+                    year_value=2000 + y,
+                    government_value=gov,
+                    classification_system=cs,
+                )
+                models.MappedBudget.objects.create(
+                    name=f"gov{g}-{2000 + y}-cofog",
+                    slug=f"gov{g}-{2000 + y}-cofog",
+                    source_budget=bud,
+                    classification_system=cofog,
+                )
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    return govs
+
+
+def measure_filter(url: str, repeat: int):
+    """Time the filter alone: the count and the first page of ids, as the paginator asks for them."""
+    request = Request(APIRequestFactory().get(url))
+    samples = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as ctx:
+            t0 = time.perf_counter()
+            qs = BudgetFilter().filter_queryset(request, models.BudgetBase.objects.non_polymorphic(), None)
+            qs.count()
+            list(qs.order_by("-created_at").values_list("id", flat=True)[:10])
+            samples.append(time.perf_counter() - t0)
+    longest = max(len(q["sql"]) for q in ctx.captured_queries)
+    return statistics.median(samples), len(ctx.captured_queries), longest
+
+
+def measure_endpoint(client: APIClient, url: str, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        res = client.get(url, format="json")
+        samples.append(time.perf_counter() - t0)
+        assert res.status_code == 200, res.content
+    return statistics.median(samples)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measure GET /api/v1/budgets/ with the government/year filters.")
+    parser.add_argument("--governments", type=int, default=1000)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        govs = populate(args.governments, args.years)
+        client = APIClient()
+        for label, url in (
+            ("government", f"/api/v1/budgets/?government={govs[-1].id}"),
+            ("year", "/api/v1/budgets/?year=2000"),
+            ("government + year", f"/api/v1/budgets/?government={govs[-1].id}&year=2000"),
+            ("no filter", "/api/v1/budgets/"),
+        ):
+            elapsed, queries, longest = measure_filter(url, args.repeat)
+            endpoint = measure_endpoint(client, url, args.repeat)
+            print(
+                f"{label:18s} filter median {elapsed * 1000:7.2f} ms"
+                f" ({queries} queries, longest SQL {longest:6d} chars)  endpoint median {endpoint * 1000:7.2f} ms"
+            )
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
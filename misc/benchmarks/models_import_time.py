@@ -0,0 +1,37 @@
+import os
+import statistics
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+PROBE = """
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wdmmgserver.settings')
+t0 = time.perf_counter()
+django.setup()
+from budgetmapper import models
+
+t1 = time.perf_counter()
+models.jp_slugify("つくば市")
+t2 = time.perf_counter()
+models.jp_slugify("つくば市")
+t3 = time.perf_counter()
+print(t1 - t0, t2 - t1, t3 - t2)
+"""
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measure the start-up cost of importing budgetmapper.models.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    samples = []
+    for _ in range(args.repeat):
+        out = subprocess.run([sys.executable, "-c", PROBE], check=True, capture_output=True, text=True, env=os.environ)
+        samples.append([float(v) for v in out.stdout.split()])
+    for idx, label in enumerate(("django.setup() + import models", "first jp_slugify", "cached jp_slugify")):
+        values = [s[idx] for s in samples]
+        print(f"{label:32s} median {statistics.median(values) * 1000:9.2f} ms  min {min(values) * 1000:9.2f} ms")
@@ -0,0 +1,52 @@
+import json
+import os
+import statistics
+import time
+from argparse import ArgumentParser
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wdmmgserver.settings")
+django.setup()
+
+import msgpack  # noqa: E402
+from budgetmapper import models, renderers, serializers  # noqa: E402
+from django.db.models import Count  # noqa: E402
+from djangorestframework_camel_case.render import CamelCaseJSONRenderer  # noqa: E402
+
+
+def median_ms(func, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples) * 1000
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare the JSON and MessagePack renderers on the largest budgets.")
+    parser.add_argument("--budgets", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    formats = (
+        ("json", CamelCaseJSONRenderer(), json.loads),
+        ("msgpack", renderers.CamelCaseMessagePackRenderer(), msgpack.unpackb),
+    )
+    budgets = models.BudgetBase.objects.annotate(n=Count("budgetitembase")).order_by("-n")[: args.budgets]
+    for budget in budgets:
+        cs = budget.classification_system
+        payloads = (
+            ("wdmmg", serializers.WdmmgSerializer(budget).data),
+            ("classification system", serializers.ClassificationSystemDetailSerializer(cs).data),
+        )
+        for label, data in payloads:
+            for name, renderer, loads in formats:
+                body = renderer.render(data)
+                encode = median_ms(lambda: renderer.render(data), args.repeat)
+                decode = median_ms(lambda: loads(body), args.repeat)
+                print(
+                    f"{budget.slug[:32]:32s} {label:22s} {name:8s} {len(body):9d} bytes"
+                    f"  encode {encode:7.2f} ms  decode {decode:7.2f} ms"
+                )
@@ -0,0 +1,99 @@
+import os
+import statistics
+import time
+from argparse import ArgumentParser
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wdmmgserver.settings")
+django.setup()
+
+from budgetmapper import models  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+NEW_INDEXES = (
+    (models.Government, ["created_at", "id"]),
+    (models.BudgetBase, ["created_at", "id"]),
+    (models.BudgetItemBase, ["budget", "created_at", "id"]),
+)
+
+
+def populate(governments: int, items: int):
+    with transaction.atomic(), models.suspend_touch():
+        models.Government.objects.bulk_create(
+            [models.Government(name=f"gov{g}", slug=f"gov{g}") for g in range(governments)], batch_size=1000
+        )
+        cs = models.ClassificationSystem.objects.create(name="bench", slug="bench")
+        gov = models.Government.objects.first()
+        budget = models.BasicBudget.objects.create(
+            name="bench", slug="bench", year_value=2000, government_value=gov, classification_system=cs
+        )
+        classifications = models.Classification.objects.bulk_create(
+            [
+                models.Classification(name=f"c{i}", code=str(i), classification_system=cs, item_order=i)
+                for i in range(items)
+            ],
+            batch_size=1000,
+        )
+        models.BudgetItemBase.bulk_insert(
+            [
+                models.AtomicBudgetItem(budget=budget, classification=c, value=float(i))
+                for i, c in enumerate(classifications)
+            ]
+        )
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    return budget
+
+
+def drop_new_indexes():
+    with connection.cursor() as cursor:
+        for model, fields in NEW_INDEXES:
+            index = next(d for d in model._meta.indexes if d.fields == fields)
+            cursor.execute(f"DROP INDEX {connection.ops.quote_name(index.name)}")
+
+
+def walk(client: APIClient, url: str):
+    """Follows the next links to the end of the listing and returns the time taken by each page."""
+    samples = []
+    while url is not None:
+        t0 = time.perf_counter()
+        res = client.get(url, format="json")
+        samples.append(time.perf_counter() - t0)
+        assert res.status_code == 200, res.content
+        url = res.json()["next"]
+    return samples
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measure the page latency of cursor-paginated lists from start to end.")
+    parser.add_argument("--governments", type=int, default=2000)
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--page-sizes", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--without-indexes", action="store_true", help="drop the (created_at, id) indexes first")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        budget = populate(args.governments, args.items)
+        if args.without_indexes:
+            drop_new_indexes()
+        client = APIClient()
+        for label, path in (
+            ("governments", "/api/v1/governments/"),
+            ("budget items", f"/api/v1/budgets/{budget.id}/items/"),
+        ):
+            for page_size in args.page_sizes:
+                samples = walk(client, f"{path}?pageSize={page_size}")
+                tenth = max(1, len(samples) // 10)
+                print(
+                    f"{label:12s} pageSize {page_size:4d} {len(samples):5d} pages"
+                    f"  first 10% median {statistics.median(samples[:tenth]) * 1000:7.2f} ms"
+                    f"  last 10% median {statistics.median(samples[-tenth:]) * 1000:7.2f} ms"
+                    f"  max {max(samples) * 1000:7.2f} ms"
+                )
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)